@@ -6,3 +6,13 @@ pytest -s tests/generator_tests/test_sdxl.py
 pytest -s tests/generator_tests/test_sdxl_embedding_lora.py
 pytest -s tests/generator_tests/test_sdxl_reference_canny_pose.py
 pytest -s tests/generator_tests/test_sdxl_reference_open_midas_pose.py
+pytest -s tests/generator_tests/test_checkpoint_cache.py
+pytest -s tests/generator_tests/test_acceleration_cpu.py
+pytest -s tests/unit_tests/test_backlog.py
+pytest -s tests/unit_tests/test_cost_model.py
+pytest -s tests/unit_tests/test_job_service.py
+pytest -s tests/unit_tests/test_prompt_cache.py
+pytest -s tests/unit_tests/test_conditioning_cache.py
+pytest -s tests/unit_tests/test_lora.py
+pytest -s tests/unit_tests/test_checkpoint_cache_cpu.py
+pytest -s tests/unit_tests/test_chunk_long_prompt.py
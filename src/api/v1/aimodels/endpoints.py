@@ -4,8 +4,11 @@
 from dishka.integrations.fastapi import FromDishka, inject
 from fastapi import APIRouter, status
 
+from src.core.config import Config
+from src.core.enums import Device
+
 from .repositories import AIModelRepo
-from .schemas import AIModelSchema
+from .schemas import AIModelSchema, ConvertedModelSchema
 from .services import AIModelService
 from .user_inputs import AIModelUserInput
 
@@ -38,3 +41,38 @@ async def create_aimodel(
 async def delete(id: int, svc: FromDishka[AIModelService]):
     _ = await svc.delete(id)
     return None
+
+
+@router.get("/{id}/converted", response_model=list[ConvertedModelSchema])
+@inject
+async def get_converted(
+    id: int, svc: FromDishka[AIModelService], config: FromDishka[Config]
+):
+    return await svc.get_converted(config, id)
+
+
+@router.post(
+    "/{id}/converted",
+    response_model=ConvertedModelSchema,
+    status_code=status.HTTP_201_CREATED,
+)
+@inject
+async def build_converted(
+    id: int,
+    svc: FromDishka[AIModelService],
+    config: FromDishka[Config],
+    device: Device | None = None,
+    gpu_id: int = 0,
+):
+    return await svc.build_converted(config, id, device, gpu_id)
+
+
+@router.delete(
+    "/{id}/converted", response_model=None, status_code=status.HTTP_204_NO_CONTENT
+)
+@inject
+async def purge_converted(
+    id: int, svc: FromDishka[AIModelService], config: FromDishka[Config]
+):
+    await svc.purge_converted(config, id)
+    return None
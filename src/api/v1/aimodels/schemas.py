@@ -29,3 +29,14 @@ class AIModelSchema(BaseModel):
     trigger_pos_words: str | None = Field(default=None)
     trigger_neg_words: str | None = Field(default=None)
     error: str | None = Field(default=None)
+
+
+class ConvertedModelSchema(BaseModel):
+    """A diffusers-layout copy of a single-file model."""
+
+    path: str
+    source: str
+    kind: str
+    torch_dtype: str
+    size_bytes: int
+    created_at: float
@@ -1,14 +1,19 @@
 # Copyright © 2025-2026 Emmanouil Ragiadakos
 # SPDX-License-Identifier: MIT
 
+import asyncio
 import os
 
 from pytsterrors import TSTError
 
-from src.core.enums import AIModelStatus, AIModelType, PathType
+from src.api.v1.generators.process.checkpoint_cache import CheckpointCache
+from src.api.v1.generators.process.device import resolve_device
+from src.api.v1.generators.process.pipe import converted_model_path
+from src.core.config import Config
+from src.core.enums import AIModelStatus, AIModelType, Device, PathType
 
 from .repositories import AIModelRepo
-from .schemas import AIModelSchema
+from .schemas import AIModelSchema, ConvertedModelSchema
 from .user_inputs import AIModelUserInput
 
 
@@ -99,3 +104,47 @@ class AIModelService:
                 metadata={"status_code": 400},
             )
         await self.aimodel_repo.delete(id)
+
+    async def _converted_source(
+        self, config: Config, id: int
+    ) -> tuple[CheckpointCache, AIModelSchema]:
+        if config.cache.converted_models_path is None:
+            raise TSTError(
+                "converted-models-are-disabled",
+                "cache.converted_models_path is not set in the configuration",
+                metadata={"status_code": 400},
+            )
+
+        aimodel = await self.aimodel_repo.get_one(id)
+        if aimodel.path_type != PathType.FILE:
+            raise TSTError(
+                "aimodel-is-not-single-file",
+                f"AIModel with ID {id} is not loaded from a single file",
+                metadata={"status_code": 400},
+            )
+        return CheckpointCache(config.cache.converted_models_path), aimodel
+
+    async def build_converted(
+        self, config: Config, id: int, device: Device | None = None, gpu_id: int = 0
+    ) -> ConvertedModelSchema:
+        """
+        Converts the model ahead of the first generator that loads it. The copy
+        is stored in the dtype of the device, resolved as a generator with the
+        device and GPU would resolve it.
+        """
+        cache, aimodel = await self._converted_source(config, id)
+        path = await asyncio.to_thread(
+            converted_model_path, cache, aimodel, resolve_device(device, gpu_id)
+        )
+        entry = next(e for e in cache.entries(aimodel.path) if e["path"] == path)
+        return ConvertedModelSchema.model_validate(entry)
+
+    async def get_converted(self, config: Config, id: int) -> list[ConvertedModelSchema]:
+        cache, aimodel = await self._converted_source(config, id)
+        entries = await asyncio.to_thread(cache.entries, aimodel.path)
+        return [ConvertedModelSchema.model_validate(e) for e in entries]
+
+    async def purge_converted(self, config: Config, id: int):
+        cache, aimodel = await self._converted_source(config, id)
+        removed = await asyncio.to_thread(cache.purge, aimodel.path)
+        print(f"purged {removed} converted copies of AIModel {id}")
@@ -7,10 +7,16 @@ from pytsterrors import TSTError
 from tortoise.expressions import Q
 
 from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.images.schemas import EncodeSettings
 from src.core.enums import AIModelType
 from src.db.models import AIModel, AIModelForEngine, Engine, Generator
 
-from .schemas import EngineSchema, LoraAndWeight
+from .schemas import (
+    AccelerationOptions,
+    AutoscalePolicy,
+    EngineSchema,
+    LoraAndWeight,
+)
 
 
 class EngineRepo:
@@ -50,6 +56,16 @@ class EngineRepo:
             control_guidance_start=input.control_guidance_start,
             control_guidance_end=input.control_guidance_end,
             clip_skip=input.clip_skip,
+            autoscale=input.autoscale.model_dump() if input.autoscale else None,
+            max_batch_size=input.max_batch_size,
+            encode_settings=input.encode_settings.model_dump()
+            if input.encode_settings
+            else None,
+            device=input.device,
+            acceleration=input.acceleration.model_dump()
+            if input.acceleration
+            else None,
+            memory_mode=input.memory_mode,
         )
         input.id = e.id
         _ = await AIModelForEngine.create(
@@ -183,5 +199,15 @@ async def serialize_engine(e: Engine) -> EngineSchema:
         control_guidance_start=e.control_guidance_start,
         control_guidance_end=e.control_guidance_end,
         clip_skip=e.clip_skip,
+        autoscale=AutoscalePolicy.model_validate(e.autoscale) if e.autoscale else None,
+        max_batch_size=e.max_batch_size,
+        encode_settings=EncodeSettings.model_validate(e.encode_settings)
+        if e.encode_settings
+        else None,
+        device=e.device,
+        acceleration=AccelerationOptions.model_validate(e.acceleration)
+        if e.acceleration
+        else None,
+        memory_mode=e.memory_mode,
     )
     return engine_schema
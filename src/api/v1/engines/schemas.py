@@ -6,8 +6,13 @@ from typing import Any
 from pydantic import BaseModel, ConfigDict, Field
 
 from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.images.schemas import EncodeSettings
 from src.core.enums import (
+    AttentionProcessor,
+    CompileMode,
+    Device,
     LongPromptTechnique,
+    MemoryMode,
     PipeType,
     Scheduler,
 )
@@ -18,6 +23,30 @@ class LoraAndWeight(BaseModel):
     weight: float
 
 
+class AutoscalePolicy(BaseModel):
+    min_generators: int = 0
+    max_generators: int = 1
+    # waiting jobs per live generator above which one more is started
+    scale_up_backlog: int = 1
+    # seconds the oldest waiting job may wait before one more is started
+    scale_up_oldest_job_age: float | None = None
+    # seconds a ready generator may stay without work before it is closed
+    idle_timeout: float = 600.0
+
+
+class AccelerationOptions(BaseModel):
+    # None keeps the attention processors the pipe was loaded with
+    attention: AttentionProcessor | None = None
+    # UNet, VAE and ControlNets in channels_last memory format
+    channels_last: bool = False
+    # torch.compile mode of the UNet, None doesn't compile
+    compile_mode: CompileMode | None = None
+    # compiles the VAE decoder too
+    compile_vae: bool = True
+    # runs the pipe at the engine's size before the generator is READY
+    warm_up: bool = True
+
+
 class EngineSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)  # pyright: ignore[reportUnannotatedClassAttribute]
 
@@ -42,3 +71,13 @@ class EngineSchema(BaseModel):
     control_guidance_start: float | None = None
     control_guidance_end: float | None = None
     clip_skip: int | None = None
+    autoscale: AutoscalePolicy | None = None
+    # images of a job that are denoised together in one pipe call
+    max_batch_size: int = 1
+    # how the generated images are written, images can override it
+    encode_settings: EncodeSettings | None = None
+    # where its generators run unless they set their own, None is auto
+    device: Device | None = None
+    acceleration: AccelerationOptions | None = None
+    # how its generators keep the pipe on the device, None keeps all of it there
+    memory_mode: MemoryMode | None = None
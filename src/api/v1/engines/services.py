@@ -110,6 +110,35 @@ class EngineService:
                     }
                 )
 
+        if input.autoscale is not None:
+            policy = input.autoscale
+            if policy.min_generators < 0 or policy.max_generators < 1:
+                res.append(
+                    {
+                        "field": "autoscale",
+                        "error": "min_generators can't be negative and max_generators must be at least 1",
+                    }
+                )
+            elif policy.min_generators > policy.max_generators:
+                res.append(
+                    {
+                        "field": "autoscale",
+                        "error": "min_generators can't be greater than max_generators",
+                    }
+                )
+
+        if input.encode_settings is not None:
+            for err in input.encode_settings.errors():
+                res.append({"field": "encode_settings", "error": err})
+
+        if input.max_batch_size < 1:
+            res.append(
+                {
+                    "field": "max_batch_size",
+                    "error": "max_batch_size must be at least 1",
+                }
+            )
+
         return res
 
     async def create(self, input: EngineUserInput) -> EngineSchema | None:
@@ -163,6 +192,12 @@ class EngineService:
             control_guidance_start=input.control_guidance_start,
             control_guidance_end=input.control_guidance_end,
             clip_skip=input.clip_skip,
+            autoscale=input.autoscale,
+            max_batch_size=input.max_batch_size,
+            encode_settings=input.encode_settings,
+            device=input.device,
+            acceleration=input.acceleration,
+            memory_mode=input.memory_mode,
         )
         res = await self.engine_repo.create(engine)
         return res
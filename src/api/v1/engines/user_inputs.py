@@ -5,8 +5,12 @@ from typing import Any
 
 from pydantic import BaseModel, ConfigDict, Field
 
+from src.api.v1.engines.schemas import AccelerationOptions, AutoscalePolicy
+from src.api.v1.images.schemas import EncodeSettings
 from src.core.enums import (
+    Device,
     LongPromptTechnique,
+    MemoryMode,
     PipeType,
     Scheduler,
 )
@@ -40,3 +44,13 @@ class EngineUserInput(BaseModel):
     control_guidance_start: float | None = None
     control_guidance_end: float | None = None
     clip_skip: int | None = None
+    autoscale: AutoscalePolicy | None = None
+    # images of a job that are denoised together in one pipe call
+    max_batch_size: int = 1
+    # how the generated images are written, images can override it
+    encode_settings: EncodeSettings | None = None
+    # where its generators run unless they set their own, None is auto
+    device: Device | None = None
+    acceleration: AccelerationOptions | None = None
+    # how its generators keep the pipe on the device, None keeps all of it there
+    memory_mode: MemoryMode | None = None
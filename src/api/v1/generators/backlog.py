@@ -0,0 +1,199 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import time
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any
+
+from src.api.v1.engines.schemas import EngineSchema
+from src.api.v1.jobs.schemas import JobSchema
+
+from .cost_model import cost_factor, job_extra_bytes
+
+
+@dataclass
+class BacklogEntry:
+    job_id: int
+    # None when any generator of the engine can take the job
+    generator_id: int | None
+    tenant: str
+    priority: int
+    # expected cost of each image that is not ready yet, in order
+    image_costs: list[float]
+    queued_at: float = field(default_factory=time.monotonic)
+    # the LoRA adapter set the job runs with
+    lora_key: tuple[Any, ...] = ()
+    # the job's image costs are its megapixel-steps times this
+    cost_factor: float = 1.0
+    # memory the job's adapters take on top of the engine's pipe
+    extra_bytes: int = 0
+
+    @property
+    def cost(self) -> float:
+        return sum(self.image_costs)
+
+
+@dataclass
+class WorkUnit:
+    entry: BacklogEntry
+    # how many of the job's remaining images are sent to the generator
+    images: int
+    cost: float
+
+
+def image_cost(
+    width: int | None, height: int | None, steps: int | None, engine: EngineSchema
+) -> float:
+    """Expected cost of an image in megapixel-steps."""
+    width = width or engine.width
+    height = height or engine.height
+    steps = steps or engine.steps
+    return steps * width * height / 1_000_000
+
+
+def job_cost_factor(job: JobSchema, engine: EngineSchema) -> float:
+    return cost_factor(engine, len(job.lora_models), job.ip_adapter_config is not None)
+
+
+def job_memory_bytes(job: JobSchema) -> int:
+    return job_extra_bytes(len(job.lora_models), job.ip_adapter_config is not None)
+
+
+def image_costs(job: JobSchema, engine: EngineSchema) -> list[float]:
+    """Expected cost of each image of the job, the images that are already ready are skipped."""
+    factor = job_cost_factor(job, engine)
+    return [
+        image_cost(img.width, img.height, img.steps, engine) * factor
+        for img in job.images
+        if not img.ready
+    ]
+
+
+def job_cost(job: JobSchema, engine: EngineSchema) -> float:
+    return sum(image_costs(job, engine))
+
+
+class JobBacklog:
+    """
+    Queue of WAITING jobs per engine.
+
+    Higher priority jobs always go first. Jobs of the same priority are
+    shared between tenants by weighted fair queuing, accounted in
+    megapixel-steps scaled by the job's cost factor, and each tenant's jobs
+    are served in FIFO order.
+    Jobs are handed out in work units of a few images, so a big batch
+    doesn't hold a generator for its whole length.
+
+    A job pinned to a generator can only be taken by that generator,
+    the rest go to whichever generator of the engine asks first. Among
+    the jobs of the chosen tenant, a generator gets the oldest one that
+    needs the LoRAs it has active, if there is any.
+    The Job table is the durable copy of the backlog.
+    """
+
+    _queues: dict[int, list[BacklogEntry]]
+    # cost served per engine and tenant, divided by the tenant's weight
+    _served: dict[int, dict[str, float]]
+    _weights: dict[str, float]
+    _unit_images: int
+    _lock: Lock
+
+    def __init__(self, weights: dict[str, float] | None = None, unit_images: int = 1):
+        self._queues = {}
+        self._served = {}
+        self._weights = weights or {}
+        self._unit_images = max(1, unit_images)
+        self._lock = Lock()
+
+    def push(self, engine_id: int, entry: BacklogEntry):
+        with self._lock:
+            queue = self._queues.setdefault(engine_id, [])
+            if any(e.job_id == entry.job_id for e in queue):
+                return
+
+            served = self._served.setdefault(engine_id, {})
+            active = {e.tenant for e in queue}
+            if entry.tenant not in active:
+                # a tenant coming back from idle doesn't get credit for the idle time
+                floor = min((served.get(t, 0.0) for t in active), default=0.0)
+                served[entry.tenant] = max(served.get(entry.tenant, 0.0), floor)
+            queue.append(entry)
+
+    def pop_for(
+        self,
+        engine_id: int,
+        generator_id: int,
+        batch_size: int = 1,
+        lora_key: tuple[Any, ...] = (),
+    ) -> WorkUnit | None:
+        """
+        The next work unit for the generator, never smaller than one batch of it.
+        lora_key is the adapter set the generator has active.
+        """
+        with self._lock:
+            queue = self._queues.get(engine_id)
+            if not queue:
+                return None
+
+            eligible = [
+                e
+                for e in queue
+                if e.generator_id is None or e.generator_id == generator_id
+            ]
+            if len(eligible) == 0:
+                return None
+
+            top = max(e.priority for e in eligible)
+            eligible = [e for e in eligible if e.priority == top]
+            served = self._served.setdefault(engine_id, {})
+            tenant = min(
+                {e.tenant for e in eligible}, key=lambda t: (served.get(t, 0.0), t)
+            )
+            entry = min(
+                (e for e in eligible if e.tenant == tenant),
+                # switching adapters is skipped when a job can use the active ones
+                key=lambda e: (e.lora_key != lora_key, e.queued_at),
+            )
+            queue.remove(entry)
+
+            images = min(max(self._unit_images, batch_size), len(entry.image_costs))
+            cost = sum(entry.image_costs[:images])
+            served[tenant] = served.get(tenant, 0.0) + cost / self._weight(tenant)
+            return WorkUnit(entry=entry, images=images, cost=cost)
+
+    def remove(self, job_id: int) -> bool:
+        with self._lock:
+            for queue in self._queues.values():
+                for entry in queue:
+                    if entry.job_id == job_id:
+                        queue.remove(entry)
+                        return True
+            return False
+
+    def depth(self, engine_id: int) -> int:
+        with self._lock:
+            return len(self._queues.get(engine_id, ()))
+
+    def oldest_age(self, engine_id: int) -> float:
+        """Seconds the oldest job of the engine has been waiting."""
+        with self._lock:
+            queue = self._queues.get(engine_id)
+            if not queue:
+                return 0.0
+            return time.monotonic() - min(e.queued_at for e in queue)
+
+    def total_cost(self, engine_id: int) -> float:
+        with self._lock:
+            return sum(e.cost for e in self._queues.get(engine_id, ()))
+
+    def pinned_cost(self, engine_id: int, generator_id: int) -> float:
+        with self._lock:
+            return sum(
+                e.cost
+                for e in self._queues.get(engine_id, ())
+                if e.generator_id == generator_id
+            )
+
+    def _weight(self, tenant: str) -> float:
+        return max(self._weights.get(tenant, 1.0), 1e-6)
@@ -0,0 +1,193 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+from dataclasses import dataclass
+
+from src.api.v1.engines.schemas import EngineSchema
+from src.core.enums import AIModelBase, MemoryMode, Variant
+
+from .process.memory import estimate_peak_bytes
+
+_GB = 1024**3
+
+# fp16 weights of the models of a pipe, by the checkpoint's base
+_PIPE_WEIGHTS = {
+    AIModelBase.SD: {
+        "unet": int(1.72 * _GB),
+        "text_encoder": int(0.25 * _GB),
+        "vae": int(0.17 * _GB),
+    },
+    AIModelBase.SDXL: {
+        "unet": int(5.14 * _GB),
+        "text_encoder": int(1.64 * _GB),
+        "vae": int(0.17 * _GB),
+    },
+}
+_CONTROLNET_BYTES = {AIModelBase.SD: int(0.72 * _GB), AIModelBase.SDXL: int(2.5 * _GB)}
+# the CLIP image encoder and the adapter's layers
+_IP_ADAPTER_BYTES = int(1.3 * _GB)
+# each LoRA of a job that is loaded as an adapter
+_LORA_BYTES = int(0.15 * _GB)
+
+# extra time of an image, relative to plain denoising
+_CONTROLNET_TIME = 0.3
+_IP_ADAPTER_TIME = 0.15
+_LORA_TIME = 0.05
+
+# the largest image a batch is sized for, in megapixels
+_MAX_MEGAPIXELS = 64.0
+
+
+def cost_factor(engine: EngineSchema, loras: int, ip_adapter: bool) -> float:
+    """How many times plain denoising a megapixel-step of the engine takes for the job."""
+    return (
+        1
+        + _CONTROLNET_TIME * len(engine.control_net_models)
+        + (_IP_ADAPTER_TIME if ip_adapter else 0)
+        + _LORA_TIME * loras
+    )
+
+
+def job_extra_bytes(loras: int, ip_adapter: bool) -> int:
+    """Memory a job's adapters take on top of the engine's pipe."""
+    return _LORA_BYTES * loras + (_IP_ADAPTER_BYTES if ip_adapter else 0)
+
+
+def engine_weights(engine: EngineSchema) -> dict[str, int]:
+    """Expected weights of the engine's pipe on the device, by model."""
+    base = engine.checkpoint_model.model_base
+    if base not in _PIPE_WEIGHTS:
+        base = AIModelBase.SD
+    weights = dict(_PIPE_WEIGHTS[base])
+    for n in range(len(engine.control_net_models)):
+        weights[f"controlnet_{n}"] = _CONTROLNET_BYTES[base]
+    if engine.checkpoint_model.variant == Variant.FP32:
+        weights = {k: v * 2 for k, v in weights.items()}
+    return weights
+
+
+@dataclass
+class _MemoryFit:
+    """Least squares line of the measured peaks over megapixels times batch size."""
+
+    n: int = 0
+    sx: float = 0.0
+    sy: float = 0.0
+    sxx: float = 0.0
+    sxy: float = 0.0
+
+    def add(self, x: float, y: float):
+        self.n += 1
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.sxy += x * y
+
+
+class CostModel:
+    """
+    Predicts the wall time and the peak memory of images before they run.
+
+    Time is counted in megapixel-steps scaled by the job's cost_factor,
+    with the seconds per unit of each engine averaged from the images its
+    generators finish. Memory starts from the weights of the engine's
+    models and the usual activation sizes, and once a generator reports
+    peaks of an engine, it follows a line fitted to them. With peaks of a
+    single size only, the estimate is shifted to go through them.
+    """
+
+    _default_seconds_per_cost: float
+    _alpha: float
+    _seconds_per_cost: dict[int, float]
+    _memory: dict[int, _MemoryFit]
+
+    def __init__(self, default_seconds_per_cost: float, alpha: float = 0.2):
+        self._default_seconds_per_cost = default_seconds_per_cost
+        self._alpha = alpha
+        self._seconds_per_cost = {}
+        self._memory = {}
+
+    def seconds_per_cost(self, engine_id: int) -> float:
+        return self._seconds_per_cost.get(engine_id, self._default_seconds_per_cost)
+
+    def time_calibrated(self, engine_id: int) -> bool:
+        return engine_id in self._seconds_per_cost
+
+    def memory_calibrated(self, engine_id: int) -> bool:
+        return engine_id in self._memory
+
+    def record_time(self, engine_id: int, cost: float, seconds: float):
+        if cost <= 0:
+            return
+        sample = seconds / cost
+        prev = self._seconds_per_cost.get(engine_id)
+        self._seconds_per_cost[engine_id] = (
+            sample if prev is None else prev + self._alpha * (sample - prev)
+        )
+
+    def record_memory(
+        self,
+        engine_id: int,
+        megapixels: float,
+        batch_size: int,
+        extra_bytes: int,
+        peak_bytes: int,
+    ):
+        fit = self._memory.setdefault(engine_id, _MemoryFit())
+        fit.add(megapixels * batch_size, peak_bytes - extra_bytes)
+
+    def image_seconds(self, engine: EngineSchema, cost: float) -> float:
+        assert engine.id is not None
+        return cost * self.seconds_per_cost(engine.id)
+
+    def peak_bytes(
+        self,
+        engine: EngineSchema,
+        megapixels: float,
+        batch_size: int,
+        extra_bytes: int = 0,
+    ) -> int:
+        """Peak device memory of a batch of images of the size."""
+        x = megapixels * batch_size
+        fit = self._memory.get(engine.id) if engine.id is not None else None
+        if fit is None:
+            return self._prior(engine, megapixels, batch_size) + extra_bytes
+
+        mean_x = fit.sx / fit.n
+        mean_y = fit.sy / fit.n
+        var = fit.sxx - fit.sx * fit.sx / fit.n
+        if var <= 1e-9 * max(1.0, fit.sxx):
+            prior_at_mean = self._prior(engine, mean_x, 1)
+            predicted = self._prior(engine, x, 1) + mean_y - prior_at_mean
+        else:
+            slope = max(0.0, (fit.sxy - fit.sx * fit.sy / fit.n) / var)
+            predicted = mean_y + slope * (x - mean_x)
+        return max(0, int(predicted)) + extra_bytes
+
+    def max_batch_megapixels(self, engine: EngineSchema, budget_bytes: int) -> float:
+        """The most megapixels times batch size expected to fit in the budget."""
+        if self.peak_bytes(engine, _MAX_MEGAPIXELS, 1) <= budget_bytes:
+            return _MAX_MEGAPIXELS
+        lo, hi = 0.0, _MAX_MEGAPIXELS
+        for _ in range(30):
+            mid = (lo + hi) / 2
+            if self.peak_bytes(engine, mid, 1) <= budget_bytes:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def _prior(self, engine: EngineSchema, megapixels: float, batch_size: int) -> int:
+        mode = engine.memory_mode
+        if mode is None or mode == MemoryMode.AUTO:
+            mode = MemoryMode.FULL
+        return estimate_peak_bytes(mode, engine_weights(engine), megapixels, batch_size)
+
+
+def batch_size_for(
+    megapixels: float, max_batch_megapixels: float | None, max_batch_size: int
+) -> int:
+    """Images of the size a denoising batch takes, at least one."""
+    if max_batch_megapixels is None or megapixels <= 0:
+        return max_batch_size
+    return max(1, min(max_batch_size, int(max_batch_megapixels // megapixels)))
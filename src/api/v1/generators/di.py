@@ -8,6 +8,7 @@ from dishka import Provider, Scope, provide
 from src.api.v1.engines.repositories import EngineRepo
 from src.api.v1.images.repositories import ImageRepo
 from src.api.v1.jobs.repositories import JobRepo
+from src.core.config import Config
 
 from .manager import GeneratorManager
 from .repositories import GeneratorRepo
@@ -37,8 +38,15 @@ class GeneratorManagerProvider(Provider):
 
     @provide
     def process_manager(
-        self, generator_repo: GeneratorRepo, job_repo: JobRepo, image_repo: ImageRepo
+        self,
+        generator_repo: GeneratorRepo,
+        engine_repo: EngineRepo,
+        job_repo: JobRepo,
+        image_repo: ImageRepo,
+        config: Config,
     ) -> Iterable[GeneratorManager]:
-        manager = GeneratorManager(generator_repo, job_repo, image_repo)
+        manager = GeneratorManager(
+            generator_repo, engine_repo, job_repo, image_repo, config
+        )
         yield manager
-        # No cleanup: thread has no stop, runs until process exit
+        # No cleanup: the lifespan starts and closes the manager
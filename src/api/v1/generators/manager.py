@@ -3,14 +3,27 @@
 
 import asyncio
 import multiprocessing
-from dataclasses import dataclass
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from multiprocessing.process import BaseProcess
 from multiprocessing.queues import Queue
-from threading import Lock, Thread
-from typing import Any
+from threading import Lock
+from typing import Any, Coroutine
 
+from pytsterrors import TSTError
+
+from src.api.v1.engines.repositories import EngineRepo
+from src.api.v1.engines.schemas import AutoscalePolicy, EngineSchema
+from src.api.v1.gpus.schemas import GPUSchema
+from src.api.v1.gpus.services import GPUService
 from src.api.v1.images.repositories import ImageRepo
 from src.api.v1.jobs.repositories import JobRepo
+from src.api.v1.jobs.schemas import JobSchema
+from src.core.config import Config
 from src.core.enums import (
+    Device,
     GeneratorCommandType,
     GeneratorEventType,
     GeneratorStatus,
@@ -18,16 +31,36 @@ from src.core.enums import (
     ManagerSignalType,
 )
 
+from .backlog import (
+    BacklogEntry,
+    JobBacklog,
+    WorkUnit,
+    image_cost,
+    image_costs,
+    job_cost_factor,
+    job_memory_bytes,
+)
+from .cost_model import CostModel
+from .process.device import is_cuda, resolve_device
 from .process.generator import start_generator
+from .process.lora import lora_key
 from .process.types import (
     GeneratorCommand,
     GeneratorEvent,
+    GeneratorOptions,
+    GeneratorStartup,
     ImageFinished,
+    JobCancelled,
+    JobFailed,
     JobFinished,
     generator_event_to_json,
 )
 from .repositories import GeneratorRepo
-from .schemas import GeneratorSchema
+from .schemas import GeneratorSchema, GeneratorStartupSchema
+
+
+# weight of the newest image in the per-engine timing average
+_TIMING_ALPHA = 0.2
 
 
 @dataclass
@@ -35,6 +68,14 @@ class GeneratorProcess:
     generator: GeneratorSchema
     commands_queue: Queue[GeneratorCommand]
     status: GeneratorStatus
+    process: BaseProcess | None = None
+    last_heartbeat: float = field(default_factory=time.monotonic)
+    # the work units the generator is running, by job ID
+    units: dict[int, WorkUnit] = field(default_factory=dict)
+    # when the generator last ran out of work, None while it has a job
+    idle_since: float | None = None
+    # the LoRAs of the last job sent to the generator, which it keeps active
+    lora_key: tuple[Any, ...] = ()
 
 
 @dataclass
@@ -43,87 +84,602 @@ class ManagerSignal:
     value: int | None
 
 
-async def _on_process_manager_init(generator_repo: GeneratorRepo):
-    gens = await generator_repo.get_all()
-    for gen in gens:
-        if gen.status != GeneratorStatus.CLOSED:
-            assert gen.id is not None
-            _ = await generator_repo.update_status(
-                id=gen.id, status=GeneratorStatus.CLOSED
-            )
-
-
 class GeneratorManager:
     _procs: dict[int, GeneratorProcess]
     _lock: Lock
-    _generator_event_queue: Queue[GeneratorEvent]
-    _signal_queue: Queue[ManagerSignal]
-    _event_listener_thread: Thread
-    _signal_listener_thread: Thread
+    _generator_event_queue: Queue[GeneratorEvent | None]
+    _signal_queue: asyncio.Queue[ManagerSignal]
+    _event_reader: ThreadPoolExecutor
+    _event_locks: dict[int, asyncio.Lock]
+    _tasks: set[asyncio.Task[None]]
     _generator_repo: GeneratorRepo
+    _engine_repo: EngineRepo
     _job_repo: JobRepo
     _image_repo: ImageRepo
+    _backlog: JobBacklog
+    _config: Config
+    # crashes per generator within the restart window, with when the last one was
+    _restarts: dict[int, tuple[int, float]]
+    # generators left closed after too many crashes, autoscaling doesn't start them
+    _given_up: set[int]
+    # crashes and errors of each job that is still waiting or processing
+    _job_attempts: dict[int, int]
+    # jobs cancelled while a work unit of them was running, until they are done
+    _cancelled: set[int]
+    # images of each job the generators failed to write
+    _write_failures: dict[int, int]
+    # time and memory of images, calibrated from the ones the generators finish
+    _cost_model: CostModel
+    # the GPUs and their memory, read once when the manager starts
+    _gpus: list[GPUSchema]
     websocket_event_queue: Queue[str]
 
     def __init__(
-        self, generator_repo: GeneratorRepo, job_repo: JobRepo, image_repo: ImageRepo
+        self,
+        generator_repo: GeneratorRepo,
+        engine_repo: EngineRepo,
+        job_repo: JobRepo,
+        image_repo: ImageRepo,
+        config: Config,
     ):
+        self._config = config
+        self._restarts = {}
+        self._given_up = set()
+        self._job_attempts = {}
+        self._cancelled = set()
+        self._write_failures = {}
+        self._cost_model = CostModel(
+            config.admission.default_seconds_per_megapixel_step, _TIMING_ALPHA
+        )
+        self._gpus = []
         self._generator_repo = generator_repo
+        self._engine_repo = engine_repo
         self._job_repo = job_repo
         self._image_repo = image_repo
         self._procs = {}
         self._lock = Lock()
+        self._backlog = JobBacklog(
+            config.queue.tenant_weights, config.queue.work_unit_images
+        )
         self._generator_event_queue = multiprocessing.Queue()
-        self._signal_queue = multiprocessing.Queue()
+        self._signal_queue = asyncio.Queue()
+        self._event_reader = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="generator-events"
+        )
+        self._event_locks = {}
+        self._tasks = set()
         self.websocket_event_queue = multiprocessing.Queue()
 
-        self._signal_listener_thread = Thread(
-            target=self._listen_for_signals, daemon=True
-        )
-        self._signal_listener_thread.start()
-        self._event_listener_thread = Thread(
-            target=self._listen_for_results, daemon=True
-        )
-        self._event_listener_thread.start()
+    async def start(self):
+        """Starts listening for generator events and signals on the running event loop."""
+        self._gpus = GPUService().list_gpus()
+        await self._on_init()
+        self._spawn(self._listen_for_signals())
+        self._spawn(self._listen_for_results())
+        self._spawn(self._supervise())
+        self._spawn(self._autoscale())
 
-    def _listen_for_results(self):
-        asyncio.run(_on_process_manager_init(self._generator_repo))
+    async def close(self):
+        # wakes up the reader that is blocked on the queue
+        self._generator_event_queue.put(None)
+        for task in list(self._tasks):
+            _ = task.cancel()
+        _ = await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._event_reader.shutdown(wait=False)
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task[None]):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        err = task.exception()
+        if err is not None:
+            # nothing awaits the spawned tasks, their errors would go unseen
+            print(f"manager task {task.get_coro()} failed: {err!r}")
+
+    async def _listen_for_results(self):
+        loop = asyncio.get_running_loop()
         while True:
-            res = self._generator_event_queue.get()
+            res = await loop.run_in_executor(
+                self._event_reader, self._generator_event_queue.get
+            )
+            if res is None:
+                return
+
+            with self._lock:
+                proc = self._procs.get(res.generator_id)
+                if proc is not None:
+                    proc.last_heartbeat = time.monotonic()
+
+            if res.event == GeneratorEventType.HEARTBEAT:
+                continue
+
+            # the generator finishes work units, the clients hear of the job
+            # once the manager has marked it as done
+            if res.event not in (
+                GeneratorEventType.JOB_FINISHED,
+                GeneratorEventType.JOB_CANCELLED,
+            ):
+                try:
+                    self._publish(res)
+                except Exception as e:
+                    print(f"failed to forward {res.event} of {res.generator_id}: {e!r}")
+            if res.event == GeneratorEventType.IMAGE_PROGRESS:
+                # only for the clients, the manager learns nothing from it
+                continue
+
             print(
                 f"generator {res.generator_name} with ID {res.generator_id} received {res.event}"
             )
+            # events of different generators are handled concurrently
+            self._spawn(self._handle_event(res))
+
+    async def _handle_event(self, res: GeneratorEvent):
+        # but the events of one generator keep their order
+        lock = self._event_locks.setdefault(res.generator_id, asyncio.Lock())
+        async with lock:
+            try:
+                await self._dispatch_event(res)
+            except Exception as e:
+                # e.g. the job was deleted meanwhile, the next events still count
+                print(f"handling {res.event} of {res.generator_id} failed: {e!r}")
 
-            json_str = generator_event_to_json(res)
-            self.websocket_event_queue.put(json_str)
-
-            match res.event:
-                case GeneratorEventType.JOB_STARTING:
-                    asyncio.run(self.on_job_starting(res.generator_id))
-                case GeneratorEventType.JOB_FINISHED:
-                    assert isinstance(res.value, JobFinished)
-                    asyncio.run(self.on_job_finished(res.generator_id, res.value))
-                case GeneratorEventType.IMAGE_FINISHED:
-                    assert isinstance(res.value, ImageFinished)
-                    asyncio.run(self.on_image_finished(res.generator_id, res.value))
-                case GeneratorEventType.READY:
-                    asyncio.run(self.on_ready(res.generator_id))
-                case GeneratorEventType.CLOSED:
-                    asyncio.run(self.on_closed(res.generator_id))
-
-    def _listen_for_signals(self):
+    async def _dispatch_event(self, res: GeneratorEvent):
+        match res.event:
+            case GeneratorEventType.JOB_STARTING:
+                await self.on_job_starting(res.generator_id)
+            case GeneratorEventType.JOB_FINISHED:
+                assert isinstance(res.value, JobFinished)
+                await self.on_job_finished(res.generator_id, res.value)
+            case GeneratorEventType.JOB_CANCELLED:
+                assert isinstance(res.value, JobCancelled)
+                await self.on_job_cancelled(res.generator_id, res.value)
+            case GeneratorEventType.IMAGE_FINISHED:
+                assert isinstance(res.value, ImageFinished)
+                await self.on_image_finished(res.generator_id, res.value)
+            case GeneratorEventType.READY:
+                startup = res.value
+                assert startup is None or isinstance(startup, GeneratorStartup)
+                await self.on_ready(res.generator_id, startup)
+            case GeneratorEventType.CLOSED:
+                await self.on_closed(res.generator_id)
+            case GeneratorEventType.ERROR:
+                assert isinstance(res.value, TSTError)
+                await self.on_error(res.generator_id, res.value)
+
+    async def _listen_for_signals(self):
         while True:
-            signal = self._signal_queue.get()
+            signal = await self._signal_queue.get()
             print(f"received new signal {signal.signal}")
-            match signal.signal:
-                case ManagerSignalType.NEW_JOB:
-                    job_id = signal.value
-                    if isinstance(job_id, int):
-                        asyncio.run(self.on_new_job(job_id))
+            try:
+                await self._handle_signal(signal)
+            except Exception as e:
+                # one failed signal must not stop the dispatching of the others
+                print(f"handling signal {signal.signal} {signal.value} failed: {e!r}")
+
+    async def _handle_signal(self, signal: ManagerSignal):
+        match signal.signal:
+            case ManagerSignalType.NEW_JOB:
+                job_id = signal.value
+                if isinstance(job_id, int):
+                    await self.on_new_job(job_id)
+            case ManagerSignalType.CHECK_WAITING_JOBS:
+                generator_id = signal.value
+                if isinstance(generator_id, int):
+                    await self.on_check_waiting_jobs(generator_id)
+
+    async def _supervise(self):
+        cfg = self._config.supervisor
+        while True:
+            await asyncio.sleep(cfg.check_interval)
+            try:
+                self._check_processes()
+            except Exception as e:
+                print(f"supervising the generators failed: {e!r}")
+
+    def _check_processes(self):
+        cfg = self._config.supervisor
+        now = time.monotonic()
+        crashed: list[tuple[GeneratorProcess, str]] = []
+        with self._lock:
+            for gen_id, proc in list(self._procs.items()):
+                if proc.process is None:
+                    continue
+
+                if not proc.process.is_alive():
+                    reason = f"process exited with code {proc.process.exitcode}"
+                elif now - proc.last_heartbeat > cfg.heartbeat_timeout:
+                    reason = f"no heartbeat for {now - proc.last_heartbeat:.0f} seconds"
+                    proc.process.kill()
+                else:
+                    continue
+
+                del self._procs[gen_id]
+                crashed.append((proc, reason))
+
+        for proc, reason in crashed:
+            self._spawn(self._on_crash(proc, reason))
+
+    async def _on_crash(self, proc: GeneratorProcess, reason: str):
+        gen = proc.generator
+        assert gen.id is not None
+        lock = self._event_locks.setdefault(gen.id, asyncio.Lock())
+        async with lock:
+            if proc.status == GeneratorStatus.CLOSING:
+                # exited on CLOSE before its CLOSED event was handled
+                _ = await self._generator_repo.update_status(
+                    id=gen.id, status=GeneratorStatus.CLOSED
+                )
+                return
+
+            print(f"generator {gen.name} with ID {gen.id} crashed: {reason}")
+            self._publish(
+                GeneratorEvent(
+                    generator_name=gen.name,
+                    generator_id=gen.id,
+                    event=GeneratorEventType.CRASH,
+                    value=TSTError("generator-crashed", reason),
+                )
+            )
+
+            for unit in proc.units.values():
+                await self._on_job_attempt_failed(gen, unit.entry, reason)
+
+            cfg = self._config.supervisor
+            now = time.monotonic()
+            restarts, last_crash = self._restarts.get(gen.id, (0, now))
+            if now - last_crash > cfg.restart_window:
+                restarts = 0
+            if restarts >= cfg.max_restarts:
+                print(f"generator {gen.id} crashed {restarts} times, leaving it closed")
+                _ = self._restarts.pop(gen.id, None)
+                self._given_up.add(gen.id)
+                _ = await self._generator_repo.update_status(
+                    id=gen.id, status=GeneratorStatus.CLOSED
+                )
+                return
+
+            self._restarts[gen.id] = (restarts + 1, now)
+            delay = min(cfg.restart_backoff * 2**restarts, cfg.restart_backoff_max)
+            _ = await self._generator_repo.update_status(
+                id=gen.id, status=GeneratorStatus.STARTING
+            )
+
+        self._spawn(self._restart_later(gen, delay))
+
+    async def _restart_later(self, gen: GeneratorSchema, delay: float):
+        assert gen.id is not None
+        print(f"restarting generator {gen.id} in {delay} seconds")
+        await asyncio.sleep(delay)
+        if not await self._generator_repo.exists(id=gen.id):
+            return
+
+        current = await self._generator_repo.get_one(gen.id)
+        if current.status != GeneratorStatus.STARTING:
+            # closed by the user while waiting, the manager had nothing to stop
+            if current.status == GeneratorStatus.CLOSING:
+                _ = await self._generator_repo.update_status(
+                    id=gen.id, status=GeneratorStatus.CLOSED
+                )
+            return
+
+        await self.start_generator(current)
+
+    async def _on_job_attempt_failed(
+        self, gen: GeneratorSchema, entry: BacklogEntry, reason: str
+    ):
+        """Requeues the job after a crash or an error, until it runs out of attempts."""
+        if entry.job_id in self._cancelled:
+            await self._cancel_stopped_job(entry.job_id)
+            return
+
+        attempts = self._job_attempts.get(entry.job_id, 0) + 1
+        if attempts < self._config.supervisor.max_job_attempts:
+            self._job_attempts[entry.job_id] = attempts
+            await self._requeue_job(entry)
+            return
+
+        print(f"job {entry.job_id} failed {attempts} times, giving up on it")
+        await self._fail_job(gen, entry.job_id, reason)
+
+    async def _fail_job(self, gen: GeneratorSchema, job_id: int, reason: str):
+        self._forget_job(job_id)
+        job = await self._job_repo.get_or_none(id=job_id)
+        if job is None or job.status not in (JobStatus.WAITING, JobStatus.PROCESSING):
+            return
+        _ = await self._job_repo.update_status(job_id, JobStatus.FAILED)
+        assert gen.id is not None
+        self._publish(
+            GeneratorEvent(
+                generator_name=gen.name,
+                generator_id=gen.id,
+                event=GeneratorEventType.JOB_FAILED,
+                value=JobFailed(job_id=job_id, reason=reason),
+            )
+        )
+
+    def _forget_job(self, job_id: int):
+        """Drops what the manager tracks of a job that is done."""
+        _ = self._job_attempts.pop(job_id, None)
+        _ = self._write_failures.pop(job_id, None)
+        self._cancelled.discard(job_id)
+
+    async def _requeue_job(self, entry: BacklogEntry):
+        job = await self._job_repo.get_or_none(id=entry.job_id)
+        if job is None or job.status != JobStatus.PROCESSING:
+            return
+
+        # keeps its place among the jobs of its tenant,
+        # and the generator skips the images that are already ready
+        job = await self._job_repo.update_status(entry.job_id, JobStatus.WAITING)
+        _ = await self._push_to_backlog(job, entry.queued_at)
+        await self.send_signal_new_job(entry.job_id)
+
+    async def _autoscale(self):
+        while True:
+            await asyncio.sleep(self._config.autoscale.check_interval)
+            for engine in await self._engine_repo.get_all():
+                if engine.autoscale is None:
+                    continue
+                try:
+                    await self._autoscale_engine(engine, engine.autoscale)
+                except Exception as e:
+                    print(f"autoscaling engine {engine.id} failed: {e}")
+
+    async def _autoscale_engine(self, engine: EngineSchema, policy: AutoscalePolicy):
+        assert engine.id is not None
+        with self._lock:
+            live = [
+                p
+                for p in self._procs.values()
+                if p.generator.engine.id == engine.id
+                and p.status != GeneratorStatus.CLOSING
+            ]
+
+        depth = self._backlog.depth(engine.id)
+        too_old = (
+            policy.scale_up_oldest_job_age is not None
+            and depth > 0
+            and self._backlog.oldest_age(engine.id) > policy.scale_up_oldest_job_age
+        )
+        if len(live) < policy.max_generators and (
+            len(live) < policy.min_generators
+            or depth > policy.scale_up_backlog * len(live)
+            or too_old
+        ):
+            # one generator per round, the next round sees it as live
+            await self._scale_up(engine)
+            return
+
+        if len(live) <= policy.min_generators or depth > 0:
+            return
+
+        now = time.monotonic()
+        for proc in live:
+            if (
+                proc.status == GeneratorStatus.READY
+                and proc.idle_since is not None
+                and now - proc.idle_since > policy.idle_timeout
+            ):
+                assert proc.generator.id is not None
+                print(f"closing idle generator {proc.generator.id}")
+                _ = await self._generator_repo.update_status(
+                    proc.generator.id, GeneratorStatus.CLOSING
+                )
+                await self.stop_generator(proc.generator.id)
+                return
+
+    async def _scale_up(self, engine: EngineSchema):
+        assert engine.id is not None
+        with self._lock:
+            per_gpu: dict[int, int] = {}
+            for p in self._procs.values():
+                per_gpu[p.generator.gpu_id] = per_gpu.get(p.generator.gpu_id, 0) + 1
+
+        # the least used device first, the bigger one on a tie
+        gpus = sorted(
+            self._gpus, key=lambda g: (per_gpu.get(g.id, 0), -g.total_vram_gb)
+        )
+        gpu_ids = [g.id for g in gpus] or [0]
+
+        closed = [
+            g
+            for g in await self._generator_repo.filter(
+                engine_id=engine.id, status=GeneratorStatus.CLOSED
+            )
+            # crashed too often, only the user starts them again
+            if g.id not in self._given_up
+        ]
+        if len(closed) > 0:
+            closed.sort(
+                key=lambda g: (
+                    gpu_ids.index(g.gpu_id) if g.gpu_id in gpu_ids else len(gpu_ids)
+                )
+            )
+            gen = closed[0]
+        else:
+            count = len(await self._generator_repo.filter(engine_id=engine.id))
+            gen = await self._generator_repo.create(
+                GeneratorSchema(
+                    name=f"{engine.name}-auto-{count + 1}",
+                    engine=engine,
+                    status=GeneratorStatus.CLOSED,
+                    gpu_id=gpu_ids[0],
+                )
+            )
+
+        assert gen.id is not None
+        print(f"autoscaling engine {engine.id}: starting generator {gen.id}")
+        gen = await self._generator_repo.update_status(gen.id, GeneratorStatus.STARTING)
+        await self.start_generator(gen)
+
+    async def _on_init(self):
+        gens = await self._generator_repo.get_all()
+        for gen in gens:
+            if gen.status != GeneratorStatus.CLOSED:
+                assert gen.id is not None
+                _ = await self._generator_repo.update_status(
+                    id=gen.id, status=GeneratorStatus.CLOSED
+                )
+
+        # No generator survives a restart, so jobs that were processing
+        # go back to the backlog together with the waiting ones.
+        jobs = await self._job_repo.filter(
+            status__in=[JobStatus.WAITING, JobStatus.PROCESSING]
+        )
+        jobs.sort(key=lambda j: j.id or 0)
+        for job in jobs:
+            assert job.id is not None
+            if job.status == JobStatus.PROCESSING:
+                job = await self._job_repo.update_status(job.id, JobStatus.WAITING)
+            _ = await self._push_to_backlog(job)
+
+    async def _job_engine(self, job: JobSchema) -> EngineSchema | None:
+        if job.engine_id is not None:
+            if not await self._engine_repo.exists(id=job.engine_id):
+                return None
+            return await self._engine_repo.get_one(job.engine_id)
+
+        if job.generator_id is None:
+            return None
+
+        with self._lock:
+            proc = self._procs.get(job.generator_id)
+        if proc is not None:
+            return proc.generator.engine
+
+        if not await self._generator_repo.exists(id=job.generator_id):
+            return None
+        gen = await self._generator_repo.get_one(job.generator_id)
+        return gen.engine
+
+    async def _push_to_backlog(
+        self, job: JobSchema, queued_at: float | None = None
+    ) -> int | None:
+        assert job.id is not None
+        engine = await self._job_engine(job)
+        if engine is None or engine.id is None:
+            print(f"Job {job.id} has no generator or engine to run on")
+            return None
+
+        entry = BacklogEntry(
+            job_id=job.id,
+            # a requeued engine job may go to any generator again
+            generator_id=job.generator_id if job.engine_id is None else None,
+            tenant=job.tenant,
+            priority=job.priority,
+            image_costs=image_costs(job, engine),
+            lora_key=lora_key(job.lora_models),
+            cost_factor=job_cost_factor(job, engine),
+            extra_bytes=job_memory_bytes(job),
+        )
+        if queued_at is not None:
+            entry.queued_at = queued_at
+        self._backlog.push(engine.id, entry)
+        return engine.id
+
+    def _generator_load(self, proc: GeneratorProcess) -> float:
+        assert proc.generator.id is not None
+        assert proc.generator.engine.id is not None
+        pinned = self._backlog.pinned_cost(
+            proc.generator.engine.id, proc.generator.id
+        )
+        return sum(u.cost for u in proc.units.values()) + pinned
+
+    def _has_capacity(self, proc: GeneratorProcess) -> bool:
+        if proc.status not in (GeneratorStatus.READY, GeneratorStatus.BUSY):
+            return False
+        return len(proc.units) < max(1, self._config.batching.max_jobs_per_generator)
 
     async def on_image_finished(self, generator_id: int, img_finished: ImageFinished):
         print(f"Image finished {img_finished.image_id}")
-        _ = await self._image_repo.update_ready(img_finished.image_id, True)
+        img = await self._image_repo.update_ready(img_finished.image_id, True)
+        with self._lock:
+            proc = self._procs.get(generator_id)
+        if proc is None:
+            return
+
+        peak = img_finished.peak_memory_bytes
+        if peak is not None and peak > (proc.generator.peak_memory_bytes or 0):
+            proc.generator.peak_memory_bytes = peak
+            _ = await self._generator_repo.update_peak_memory(generator_id, peak)
+
+        engine = proc.generator.engine
+        if engine.id is None:
+            return
+        unit = proc.units.get(img.job_id)
+        factor = unit.entry.cost_factor if unit is not None else 1.0
+        extra_bytes = unit.entry.extra_bytes if unit is not None else 0
+
+        if img_finished.seconds is not None:
+            cost = image_cost(img.width, img.height, img.steps, engine) * factor
+            self._cost_model.record_time(engine.id, cost, img_finished.seconds)
+
+        # the RSS of a CPU generator only grows, it says nothing about one batch
+        device = resolve_device(
+            proc.generator.device or engine.device, proc.generator.gpu_id
+        )
+        if (
+            peak is not None
+            and img_finished.batch_size is not None
+            and is_cuda(device)
+        ):
+            megapixels = (img.width or engine.width) * (img.height or engine.height)
+            self._cost_model.record_memory(
+                engine.id,
+                megapixels / 1_000_000,
+                img_finished.batch_size,
+                extra_bytes,
+                peak,
+            )
+
+    @property
+    def cost_model(self) -> CostModel:
+        return self._cost_model
+
+    def seconds_per_cost(self, engine_id: int) -> float:
+        """Seconds a generator of the engine needs for one megapixel-step."""
+        return self._cost_model.seconds_per_cost(engine_id)
+
+    def memory_capacity(self, engine: EngineSchema) -> int | None:
+        """
+        The most memory one generator of the engine could have, with the
+        whole configured share of the largest GPU or of the CPU's RAM.
+        None when the device has no known limit.
+        """
+        if is_cuda(resolve_device(engine.device, 0)):
+            if len(self._gpus) == 0:
+                return None
+            total_vram_gb = max(g.total_vram_gb for g in self._gpus)
+            return int(
+                total_vram_gb * 1024**3 * self._config.memory.gpu_budget_fraction
+            )
+        if self._config.memory.cpu_budget_mb is None:
+            return None
+        return self._config.memory.cpu_budget_mb * 1024**2
+
+    def estimate_drain_seconds(self, engine_id: int, extra_cost: float = 0.0) -> float:
+        """
+        Seconds until the engine's generators get through the backlog, the jobs
+        they are running and extra_cost more. Engines without a live generator
+        are counted as one, the job waits for a generator to be started anyway.
+        """
+        with self._lock:
+            live = [
+                p
+                for p in self._procs.values()
+                if p.generator.engine.id == engine_id
+                and p.status != GeneratorStatus.CLOSING
+            ]
+            # the rest of a running job goes back to the backlog after its unit
+            running = sum(u.entry.cost for p in live for u in p.units.values())
+
+        cost = self._backlog.total_cost(engine_id) + running + extra_cost
+        return cost * self.seconds_per_cost(engine_id) / max(1, len(live))
 
     async def on_new_job(self, job_id: int):
         print(f"New Job with ID {job_id} created")
@@ -131,54 +687,376 @@ class GeneratorManager:
         if job is None:
             return
 
-        if job.generator_id in self._procs.keys():
-            proc = self._procs[job.generator_id]
-            if proc.status == GeneratorStatus.READY:
-                proc.commands_queue.put(
-                    GeneratorCommand(command=GeneratorCommandType.JOB, value=job)
+        if job.status != JobStatus.WAITING:
+            return
+
+        engine_id = await self._push_to_backlog(job)
+        if engine_id is None:
+            return
+
+        # offer the job to the generators that have its LoRAs active first,
+        # then to the least loaded ones
+        key = lora_key(job.lora_models)
+        with self._lock:
+            ready = [
+                p
+                for p in self._procs.values()
+                if p.generator.engine.id == engine_id and self._has_capacity(p)
+            ]
+        ready.sort(key=lambda p: (p.lora_key != key, self._generator_load(p)))
+        for proc in ready:
+            assert proc.generator.id is not None
+            await self.on_check_waiting_jobs(proc.generator.id)
+
+    async def on_check_waiting_jobs(self, generator_id: int):
+        # Runs only on the signal listener task, so concurrent drains
+        # can't give a generator more work units than it takes.
+        dispatched = False
+        while True:
+            with self._lock:
+                proc = self._procs.get(generator_id)
+                if proc is None or not self._has_capacity(proc):
+                    break
+
+                engine_id = proc.generator.engine.id
+                assert engine_id is not None
+                unit = self._backlog.pop_for(
+                    engine_id,
+                    generator_id,
+                    proc.generator.engine.max_batch_size,
+                    proc.lora_key,
+                )
+                if unit is None:
+                    break
+
+                entry = unit.entry
+                proc.lora_key = entry.lora_key
+                proc.status = GeneratorStatus.BUSY
+                proc.units[entry.job_id] = unit
+                proc.idle_since = None
+
+            if entry.job_id in self._cancelled:
+                job = None
+                await self._cancel_stopped_job(entry.job_id)
+            else:
+                job = await self._job_repo.get_or_none(id=entry.job_id)
+            # a job stays PROCESSING between its work units
+            if job is None or job.status not in (
+                JobStatus.WAITING,
+                JobStatus.PROCESSING,
+            ):
+                # deleted or already handled while it was waiting
+                self._release_unit(proc, entry.job_id)
+                continue
+
+            print(
+                f"Dispatching {unit.images} images of job {entry.job_id} to generator {generator_id}"
+            )
+            if job.generator_id != generator_id:
+                await self._job_repo.assign_generator(entry.job_id, generator_id)
+            job = await self._job_repo.update_status(
+                entry.job_id, JobStatus.PROCESSING
+            )
+            if entry.job_id in self._cancelled:
+                # cancelled during the awaits above, its CANCEL reached the
+                # generator before the job did and got dropped there
+                self._release_unit(proc, entry.job_id)
+                await self._cancel_stopped_job(entry.job_id)
+                continue
+            proc.commands_queue.put(
+                GeneratorCommand(
+                    command=GeneratorCommandType.JOB, value=_work_unit_job(job, unit)
                 )
+            )
+            dispatched = True
+
+        if dispatched:
+            _ = await self._generator_repo.update_status(
+                generator_id, GeneratorStatus.BUSY
+            )
+
+    def _release_unit(self, proc: GeneratorProcess, job_id: int):
+        """Takes back a work unit that was never sent to the generator."""
+        with self._lock:
+            _ = proc.units.pop(job_id, None)
+            if len(proc.units) == 0:
+                if proc.status == GeneratorStatus.BUSY:
+                    proc.status = GeneratorStatus.READY
+                proc.idle_since = time.monotonic()
 
     async def on_job_starting(self, generator_id: int):
         print("on job starting")
         with self._lock:
-            self._procs[generator_id].status = GeneratorStatus.BUSY
+            proc = self._procs.get(generator_id)
+            if proc is None:
+                return
+            proc.status = GeneratorStatus.BUSY
 
         _ = await self._generator_repo.update_status(generator_id, GeneratorStatus.BUSY)
 
     async def on_job_finished(self, generator_id: int, job_finished: JobFinished):
         print("on job finished")
-        with self._lock:
-            self._procs[generator_id].status = GeneratorStatus.READY
+        await self._on_job_done(generator_id, job_finished.job_id, JobStatus.FINISHED)
 
-        job = await self._job_repo.update_status(
-            job_finished.job_id, JobStatus.FINISHED
+    async def on_job_cancelled(self, generator_id: int, job_cancelled: JobCancelled):
+        print("on job cancelled")
+        await self._on_job_done(
+            generator_id, job_cancelled.job_id, JobStatus.CANCELLED
         )
-        print("finished job ", job)
-        _ = await self._generator_repo.update_status(
-            generator_id, GeneratorStatus.READY
+
+    async def on_error(self, generator_id: int, err: TSTError):
+        print(f"generator {generator_id} reported an error: {err.message()}")
+        meta = err.metadata() or {}
+        job_id = meta.get("job_id")
+        if not isinstance(job_id, int):
+            return
+
+        if "image_id" in meta:
+            # the image stays not ready and is run again with the rest of the job,
+            # unless its images keep failing to be written
+            failures = self._write_failures.get(job_id, 0) + 1
+            self._write_failures[job_id] = failures
+            if failures >= self._config.supervisor.max_write_failures:
+                with self._lock:
+                    proc = self._procs.get(generator_id)
+                if proc is not None:
+                    print(f"job {job_id} failed to write {failures} images")
+                    await self._fail_job(proc.generator, job_id, err.message())
+                    # the rest of its images would be denoised for nothing
+                    proc.commands_queue.put(
+                        GeneratorCommand(
+                            command=GeneratorCommandType.CANCEL, value=job_id
+                        )
+                    )
+            return
+
+        # the job's work unit is over, the generator goes on with the others
+        await self._on_job_done(generator_id, job_id, JobStatus.FAILED, err.message())
+
+    async def _on_job_done(
+        self,
+        generator_id: int,
+        job_id: int,
+        status: JobStatus,
+        reason: str | None = None,
+    ):
+        with self._lock:
+            proc = self._procs.get(generator_id)
+            if proc is None or job_id not in proc.units:
+                # left over from a process that crashed, the job was requeued
+                return
+            entry = proc.units.pop(job_id).entry
+            gen = proc.generator
+            idle = len(proc.units) == 0
+            if idle:
+                proc.idle_since = time.monotonic()
+            closing = proc.status == GeneratorStatus.CLOSING
+            if not closing and idle:
+                proc.status = GeneratorStatus.READY
+
+        job = await self._job_repo.get_or_none(id=job_id)
+        if job is not None and job.status == JobStatus.FAILED:
+            # given up on while the unit was running, nothing of it is requeued
+            job = None
+        unit_only = (
+            job is not None
+            and status == JobStatus.FINISHED
+            and entry is not None
+            and any(not img.ready for img in job.images)
         )
+        if job_id in self._cancelled and (unit_only or status == JobStatus.FAILED):
+            # cancelled after the generator was done with the unit
+            status = JobStatus.CANCELLED
+            unit_only = False
+        if status == JobStatus.FAILED:
+            await self._on_job_attempt_failed(gen, entry, reason or "job failed")
+        elif unit_only:
+            # only a work unit finished, the rest of the job queues again
+            assert job is not None and entry is not None
+            engine_id = await self._push_to_backlog(job, entry.queued_at)
+            if engine_id is not None:
+                self._signal_ready_generators(engine_id)
+        elif job is not None:
+            job = await self._job_repo.update_status(job_id, status)
+            self._forget_job(job_id)
+            print(f"{status} job ", job)
+            if status == JobStatus.FINISHED:
+                event = GeneratorEventType.JOB_FINISHED
+                value = JobFinished(job_id=job_id)
+            else:
+                event = GeneratorEventType.JOB_CANCELLED
+                value = JobCancelled(job_id=job_id)
+            self._publish(
+                GeneratorEvent(
+                    generator_name=gen.name,
+                    generator_id=generator_id,
+                    event=event,
+                    value=value,
+                )
+            )
+        if not unit_only:
+            self._cancelled.discard(job_id)
+        if closing:
+            return
 
-    async def on_ready(self, generator_id: int):
+        if idle:
+            _ = await self._generator_repo.update_status(
+                generator_id, GeneratorStatus.READY
+            )
+        self._send_signal_check_waiting_jobs(generator_id)
+
+    async def on_ready(self, generator_id: int, startup: GeneratorStartup | None):
         print(f"on ready generator {generator_id}")
         with self._lock:
-            self._procs[generator_id].status = GeneratorStatus.READY
+            proc = self._procs.get(generator_id)
+            if proc is None:
+                return
+            proc.status = GeneratorStatus.READY
+            proc.idle_since = time.monotonic()
+            proc.generator.peak_memory_bytes = None
 
+        if startup is not None:
+            if startup.memory_mode is not None:
+                print(
+                    f"generator {generator_id} runs in memory mode {startup.memory_mode}"
+                )
+            print(f"generator {generator_id} started in {startup.seconds:.1f} seconds")
+            _ = await self._generator_repo.update_startup(
+                generator_id, GeneratorStartupSchema.model_validate(asdict(startup))
+            )
         _ = await self._generator_repo.update_status(
             id=generator_id, status=GeneratorStatus.READY
         )
+        self._send_signal_check_waiting_jobs(generator_id)
 
     async def on_closed(self, generator_id: int):
         print(f"on generator closed {generator_id}")
         with self._lock:
-            del self._procs[generator_id]
+            _ = self._procs.pop(generator_id, None)
 
         _ = await self._generator_repo.update_status(
             id=generator_id, status=GeneratorStatus.CLOSED
         )
 
+    async def _cpu_threads(
+        self, gen: GeneratorSchema, device: Device | None
+    ) -> int | None:
+        """
+        The generator's share of the cores, when it runs on the CPU. The cores
+        left by the generators with their own threads are split evenly between
+        every other generator configured for the CPU, whether it runs or not,
+        and autoscaled engines count with their most generators. So starting
+        one more generator never takes more than its share.
+        """
+        if gen.threads is not None:
+            return gen.threads
+        if resolve_device(device, gen.gpu_id) != "cpu":
+            return None
+
+        reserved = 0
+        per_engine: dict[int | None, int] = {}
+        for other in await self._generator_repo.get_all():
+            other_device = other.device or other.engine.device
+            if resolve_device(other_device, other.gpu_id) != "cpu":
+                continue
+            if other.threads is not None:
+                reserved += other.threads
+                continue
+            engine_id = other.engine.id
+            per_engine[engine_id] = per_engine.get(engine_id, 0) + 1
+        for engine in await self._engine_repo.get_all():
+            if engine.autoscale is None or resolve_device(engine.device, 0) != "cpu":
+                continue
+            per_engine[engine.id] = max(
+                per_engine.get(engine.id, 0), engine.autoscale.max_generators
+            )
+
+        shared = max(1, sum(per_engine.values()))
+        return max(1, ((os.cpu_count() or 1) - reserved) // shared)
+
+    def _memory_budget(self, gen: GeneratorSchema, device: Device | None) -> int | None:
+        """
+        Bytes the generator may use, the configured share of its device minus
+        the peaks of the other generators running on it. The ones that haven't
+        measured a peak yet are counted with the peak the cost model expects.
+        None when the device has no known limit.
+        """
+        resolved = resolve_device(device, gen.gpu_id)
+        if is_cuda(resolved):
+            gpu = next((g for g in self._gpus if g.id == gen.gpu_id), None)
+            if gpu is None:
+                return None
+            total = int(
+                gpu.total_vram_gb * 1024**3 * self._config.memory.gpu_budget_fraction
+            )
+        else:
+            if self._config.memory.cpu_budget_mb is None:
+                return None
+            total = self._config.memory.cpu_budget_mb * 1024**2
+
+        with self._lock:
+            others = [
+                p.generator
+                for p in self._procs.values()
+                if p.generator.id != gen.id
+                and resolve_device(
+                    p.generator.device or p.generator.engine.device,
+                    p.generator.gpu_id,
+                )
+                == resolved
+            ]
+        used = 0
+        for other in others:
+            if other.peak_memory_bytes is not None:
+                used += other.peak_memory_bytes
+                continue
+            engine = other.engine
+            used += self._cost_model.peak_bytes(
+                engine, engine.width * engine.height / 1_000_000, engine.max_batch_size
+            )
+        return max(0, total - used)
+
+    async def _generator_options(self, gen: GeneratorSchema) -> GeneratorOptions:
+        cfg = self._config
+        device = gen.device or gen.engine.device
+        memory_mode = gen.memory_mode or gen.engine.memory_mode
+        budget = self._memory_budget(gen, device)
+        return GeneratorOptions(
+            heartbeat_interval=cfg.supervisor.heartbeat_interval,
+            progress_interval=cfg.events.progress_interval,
+            batch_window=cfg.batching.window_ms / 1000,
+            max_jobs=max(1, cfg.batching.max_jobs_per_generator),
+            prefetch_workers=cfg.batching.prefetch_workers,
+            writer_workers=cfg.batching.writer_workers,
+            prompt_cache_bytes=cfg.cache.prompt_embeds_mb * 1024**2,
+            conditioning_path=cfg.cache.conditioning_path
+            or os.path.join(cfg.poses_path, "conditioning"),
+            conditioning_memory_bytes=cfg.cache.conditioning_memory_mb * 1024**2,
+            conditioning_disk_bytes=cfg.cache.conditioning_disk_mb * 1024**2,
+            lora_memory_bytes=cfg.cache.lora_memory_mb * 1024**2,
+            loaded_loras=cfg.cache.loaded_loras,
+            checkpoint_cache_path=cfg.cache.converted_models_path,
+            compile_cache_path=cfg.cache.compiled_path
+            or os.path.join(cfg.hugging_face_path, "compiled"),
+            device=device,
+            threads=await self._cpu_threads(gen, device),
+            memory_mode=memory_mode,
+            memory_budget_bytes=budget,
+            max_batch_megapixels=self._cost_model.max_batch_megapixels(
+                gen.engine, budget
+            )
+            if budget is not None
+            else None,
+        )
+
     async def start_generator(self, gen: GeneratorSchema):
         if gen.id in self._procs.keys():
             return
+        if gen.id is not None:
+            # started again by the user, autoscaling may use it again
+            self._given_up.discard(gen.id)
+
+        options = await self._generator_options(gen)
 
         def _start_generator(gen: GeneratorSchema):
             assert gen.id is not None
@@ -194,6 +1072,7 @@ class GeneratorManager:
                     gen.engine,
                     commandq,
                     self._generator_event_queue,
+                    options,
                 ),
             )
             p.start()
@@ -202,20 +1081,95 @@ class GeneratorManager:
                     generator=gen,
                     commands_queue=commandq,
                     status=GeneratorStatus.STARTING,
+                    process=p,
                 )
 
         loop = asyncio.get_running_loop()
         await loop.run_in_executor(None, _start_generator, gen)
 
     async def stop_generator(self, id: int):
-        if id not in self._procs.keys():
-            return
+        with self._lock:
+            proc = self._procs.get(id)
+            if proc is None:
+                return
+            # stop draining the backlog into a generator that is closing
+            proc.status = GeneratorStatus.CLOSING
 
-        self._procs[id].commands_queue.put(
+        proc.commands_queue.put(
             GeneratorCommand(command=GeneratorCommandType.CLOSE, value=None)
         )
 
     async def send_signal_new_job(self, job_id: int):
-        self._signal_queue.put(
+        self._signal_queue.put_nowait(
             ManagerSignal(signal=ManagerSignalType.NEW_JOB, value=job_id)
         )
+
+    async def cancel_job(self, job_id: int):
+        if self._backlog.remove(job_id):
+            _ = await self._job_repo.update_status(job_id, JobStatus.CANCELLED)
+            self._forget_job(job_id)
+            return
+
+        with self._lock:
+            proc = next((p for p in self._procs.values() if job_id in p.units), None)
+
+        if proc is None:
+            # neither waiting in the backlog nor running anywhere
+            _ = await self._job_repo.update_status(job_id, JobStatus.CANCELLED)
+            return
+
+        # the generator stops within one step and answers with JOB_CANCELLED,
+        # unless it already finished the unit, then the rest is dropped here
+        self._cancelled.add(job_id)
+        proc.commands_queue.put(
+            GeneratorCommand(command=GeneratorCommandType.CANCEL, value=job_id)
+        )
+
+    async def _cancel_stopped_job(self, job_id: int):
+        """Cancels a job that has no work unit running, instead of queueing the rest."""
+        self._forget_job(job_id)
+        job = await self._job_repo.get_or_none(id=job_id)
+        if job is not None and job.status in (JobStatus.WAITING, JobStatus.PROCESSING):
+            _ = await self._job_repo.update_status(job_id, JobStatus.CANCELLED)
+
+    def _publish(self, event: GeneratorEvent):
+        self.websocket_event_queue.put(generator_event_to_json(event))
+
+    def discard_waiting_job(self, job_id: int):
+        _ = self._backlog.remove(job_id)
+        self._forget_job(job_id)
+
+    def _signal_ready_generators(self, engine_id: int):
+        with self._lock:
+            ready = [
+                p
+                for p in self._procs.values()
+                if p.generator.engine.id == engine_id and self._has_capacity(p)
+            ]
+        ready.sort(key=self._generator_load)
+        for proc in ready:
+            assert proc.generator.id is not None
+            self._send_signal_check_waiting_jobs(proc.generator.id)
+
+    def _send_signal_check_waiting_jobs(self, generator_id: int):
+        self._signal_queue.put_nowait(
+            ManagerSignal(
+                signal=ManagerSignalType.CHECK_WAITING_JOBS, value=generator_id
+            )
+        )
+
+
+def _work_unit_job(job: JobSchema, unit: WorkUnit) -> JobSchema:
+    """
+    The job cut after the unit's last image. The ready images before it stay,
+    the generator skips them but uses them as IP-Adapter references.
+    """
+    images = []
+    remaining = 0
+    for img in job.images:
+        images.append(img)
+        if not img.ready:
+            remaining += 1
+            if remaining == unit.images:
+                break
+    return job.model_copy(update={"images": images})
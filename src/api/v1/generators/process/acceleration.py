@@ -0,0 +1,106 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import os
+
+import torch
+from diffusers.models.attention_processor import AttnProcessor, AttnProcessor2_0
+
+from src.api.v1.engines.schemas import AccelerationOptions, EngineSchema
+from src.core.enums import AttentionProcessor, PipeType
+
+
+def engine_fingerprint(engine: EngineSchema, device: str) -> str:
+    """Everything that changes the graphs torch.compile builds for the engine's pipe."""
+    payload = json.dumps(
+        {
+            "checkpoint": engine.checkpoint_model.path,
+            "vae": engine.vae_model.path if engine.vae_model else None,
+            "controlnets": [m.path for m in engine.control_net_models],
+            "pipe_type": engine.pipe_type,
+            "acceleration": engine.acceleration.model_dump(mode="json")
+            if engine.acceleration
+            else None,
+            "device": device,
+            "torch": torch.__version__,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def use_compile_cache(path: str, engine: EngineSchema, device: str):
+    """
+    Points the inductor and triton caches of the process to the engine's
+    directory, so only the first start of the engine compiles from scratch.
+    """
+    # only the generators that compile pay for importing inductor
+    import torch._inductor.config as inductor_config
+
+    fingerprint = engine_fingerprint(engine, device)
+    cache_dir = os.path.join(path, f"engine-{engine.id}-{fingerprint}")
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    os.environ["TRITON_CACHE_DIR"] = os.path.join(cache_dir, "triton")
+    inductor_config.fx_graph_cache = True
+    print(f"torch.compile cache in {cache_dir}")
+
+
+def apply_acceleration(pipe, options: AccelerationOptions):  # pyright: ignore[reportMissingParameterType]
+    """Sets the attention processors, the memory format and compiles the pipe's models."""
+    controlnets = []
+    if hasattr(pipe, "controlnet"):
+        controlnet = pipe.controlnet
+        controlnets = getattr(controlnet, "nets", [controlnet])
+
+    match options.attention:
+        case AttentionProcessor.XFORMERS:
+            pipe.enable_xformers_memory_efficient_attention()
+        case AttentionProcessor.SDPA | AttentionProcessor.CLASSIC:
+            processor_class = (
+                AttnProcessor2_0
+                if options.attention == AttentionProcessor.SDPA
+                else AttnProcessor
+            )
+            for model in [pipe.unet, pipe.vae, *controlnets]:
+                model.set_attn_processor(processor_class())
+
+    if options.channels_last:
+        for model in [pipe.unet, pipe.vae, *controlnets]:
+            model.to(memory_format=torch.channels_last)
+
+    if options.compile_mode is not None:
+        # in place, so LoRA and IP-Adapter loading still find the modules
+        pipe.unet.compile(mode=str(options.compile_mode))
+        if options.compile_vae:
+            pipe.vae.decoder.compile(mode=str(options.compile_mode))
+
+
+def warm_up(pipe, engine: EngineSchema):  # pyright: ignore[reportMissingParameterType]
+    """
+    Runs the pipe at the engine's size and batch sizes, so the first job
+    doesn't wait for the compiled graphs to be built or loaded.
+    """
+    batch_sizes = sorted({1, engine.max_batch_size})
+    for batch_size in batch_sizes:
+        kwargs = {}
+        if engine.pipe_type == PipeType.IMG2IMG or len(engine.control_net_models) > 0:
+            image = torch.zeros(
+                (1, 3, engine.height, engine.width),
+                device=pipe._execution_device,
+                dtype=pipe.dtype,
+            )
+            kwargs["image"] = image
+            if len(engine.control_net_models) > 1:
+                kwargs["image"] = [image] * len(engine.control_net_models)
+        _ = pipe(
+            prompt=[""] * batch_size,
+            negative_prompt=[""] * batch_size,
+            width=engine.width,
+            height=engine.height,
+            guidance_scale=engine.guidance_scale,
+            num_inference_steps=2,
+            **kwargs,
+        )
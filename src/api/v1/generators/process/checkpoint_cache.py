@@ -0,0 +1,169 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from threading import Lock
+from typing import Any, Callable
+
+# bumped when the layout of the entries changes, old entries are not used anymore
+_FORMAT_VERSION = 1
+_META_FILE = "converted.json"
+_HASHES_FILE = "hashes.json"
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(16 * 1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class CheckpointCache:
+    """
+    Diffusers-layout copies of single-file models, so a generator start
+    loads safetensors that need no conversion instead of converting the
+    original state dict again.
+
+    An entry is keyed by the content hash, size and mtime of the source
+    file, the dtype and the kind of model it was converted to. Hashing a
+    checkpoint takes a while, so the hash of each source file is kept
+    and only computed again when its size or mtime change.
+    """
+
+    _path: str
+    _lock: Lock
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _read_hashes(self) -> dict[str, Any]:
+        try:
+            with open(os.path.join(self._path, _HASHES_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _source_hash(self, source: str) -> tuple[str, int, int]:
+        st = os.stat(source)
+        source = os.path.abspath(source)
+        with self._lock:
+            known = self._read_hashes().get(source)
+        if (
+            known is not None
+            and known["size"] == st.st_size
+            and known["mtime_ns"] == st.st_mtime_ns
+        ):
+            return known["sha256"], st.st_size, st.st_mtime_ns
+
+        print(f"hashing {source}")
+        digest = _sha256(source)
+        with self._lock:
+            hashes = self._read_hashes()
+            hashes[source] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "sha256": digest,
+            }
+            tmp = os.path.join(self._path, _HASHES_FILE + f".{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(hashes, f)
+            os.replace(tmp, os.path.join(self._path, _HASHES_FILE))
+        return digest, st.st_size, st.st_mtime_ns
+
+    def entry_path(self, source: str, kind: str, torch_dtype: str) -> str:
+        digest, size, mtime_ns = self._source_hash(source)
+        payload = json.dumps(
+            {
+                "version": _FORMAT_VERSION,
+                "sha256": digest,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "kind": kind,
+                "dtype": torch_dtype,
+            },
+            sort_keys=True,
+        )
+        key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return os.path.join(self._path, f"{kind}-{key}")
+
+    def ensure(
+        self,
+        source: str,
+        kind: str,
+        torch_dtype: str,
+        convert: Callable[[], Any],
+    ) -> str:
+        """
+        The directory of the converted model. On a miss, convert loads the
+        model from the source file and it is saved with save_pretrained.
+        """
+        entry = self.entry_path(source, kind, torch_dtype)
+        if os.path.isfile(os.path.join(entry, _META_FILE)):
+            return entry
+
+        started = time.perf_counter()
+        model = convert()
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        model.save_pretrained(tmp, safe_serialization=True)
+        del model
+
+        with open(os.path.join(tmp, _META_FILE), "w") as f:
+            json.dump(
+                {
+                    "source": os.path.abspath(source),
+                    "kind": kind,
+                    "torch_dtype": torch_dtype,
+                    "created_at": time.time(),
+                },
+                f,
+            )
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another generator converted the same model at the same time
+            shutil.rmtree(tmp, ignore_errors=True)
+        print(
+            f"converted {source} to {entry} in {time.perf_counter() - started:.1f} seconds"
+        )
+        return entry
+
+    def entries(self, source: str | None = None) -> list[dict[str, Any]]:
+        """The converted models, only the ones of the source file when it is given."""
+        res = []
+        for name in sorted(os.listdir(self._path)):
+            entry = os.path.join(self._path, name)
+            try:
+                with open(os.path.join(entry, _META_FILE)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if source is not None and meta["source"] != os.path.abspath(source):
+                continue
+            meta["path"] = entry
+            meta["size_bytes"] = _dir_size(entry)
+            res.append(meta)
+        return res
+
+    def purge(self, source: str | None = None) -> int:
+        """Deletes the converted models of the source file, or all of them. Returns how many."""
+        removed = 0
+        for meta in self.entries(source):
+            shutil.rmtree(meta["path"], ignore_errors=True)
+            removed += 1
+        return removed
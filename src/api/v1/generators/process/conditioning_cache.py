@@ -0,0 +1,150 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+from PIL import Image
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def conditioning_key(image_hash: str, detector: str, params: dict[str, Any]) -> str:
+    """Content address of a conditioning image, params must hold everything that changes it."""
+    payload = json.dumps(
+        {"image": image_hash, "detector": detector, "params": params}, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ConditioningCache:
+    """
+    Preprocessed ControlNet conditioning images by content address.
+
+    Recently used images stay in memory, every image is also written as a
+    PNG under the cache directory so they survive restarts. Both tiers drop
+    the least recently used images once they grow past their byte budget.
+    """
+
+    _memory: OrderedDict[str, Image.Image]
+    _memory_bytes: int
+    _max_memory_bytes: int
+    _path: str | None
+    # file sizes of the disk tier in least recently used order
+    _disk: OrderedDict[str, int]
+    _disk_bytes: int
+    _max_disk_bytes: int
+    _lock: Lock
+    hits: int
+    misses: int
+
+    def __init__(self, path: str | None, max_memory_bytes: int, max_disk_bytes: int):
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._max_memory_bytes = max_memory_bytes
+        self._path = path
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._max_disk_bytes = max_disk_bytes
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            entries = []
+            for name in os.listdir(path):
+                if not name.endswith(".png"):
+                    continue
+                st = os.stat(os.path.join(path, name))
+                entries.append((st.st_mtime, name[: -len(".png")], st.st_size))
+            for _, key, size in sorted(entries):
+                self._disk[key] = size
+                self._disk_bytes += size
+
+    def _file(self, key: str) -> str:
+        assert self._path is not None
+        return os.path.join(self._path, key + ".png")
+
+    def get(self, key: str) -> Image.Image | None:
+        with self._lock:
+            img = self._memory.get(key)
+            if img is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return img
+
+            if key not in self._disk:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+
+        try:
+            with Image.open(self._file(key)) as f:
+                img = f.convert("RGB")
+            # the access time tells the next process which files are still used
+            os.utime(self._file(key))
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._remember(key, img)
+        return img
+
+    def put(self, key: str, img: Image.Image):
+        with self._lock:
+            self._remember(key, img)
+            if self._path is None or key in self._disk:
+                return
+
+        file = self._file(key)
+        tmp = file + ".tmp"
+        img.save(tmp, format="PNG")
+        os.replace(tmp, file)
+        size = os.path.getsize(file)
+
+        with self._lock:
+            self._disk[key] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self._max_disk_bytes and len(self._disk) > 1:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                try:
+                    os.remove(self._file(old_key))
+                except OSError:
+                    pass
+
+    def _remember(self, key: str, img: Image.Image):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+
+        size = img.width * img.height * len(img.getbands())
+        if size > self._max_memory_bytes:
+            return
+        self._memory[key] = img
+        self._memory_bytes += size
+        while self._memory_bytes > self._max_memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= old.width * old.height * len(old.getbands())
+
+    def stats(self) -> str:
+        return (
+            f"conditioning cache: {self.hits} hits, {self.misses} misses, "
+            f"{self._memory_bytes / 1024**2:.1f} MB in memory, "
+            f"{self._disk_bytes / 1024**2:.1f} MB on disk"
+        )
@@ -0,0 +1,72 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import resource
+
+import torch
+
+from src.core.enums import Device, Variant
+
+
+def resolve_device(device: Device | None, gpu_id: int) -> str:
+    """The torch device a generator runs on, auto takes its GPU when there is one."""
+    match device or Device.AUTO:
+        case Device.CUDA:
+            return f"cuda:{gpu_id}"
+        case Device.CPU:
+            return "cpu"
+        case Device.AUTO:
+            if torch.cuda.is_available() and gpu_id < torch.cuda.device_count():
+                return f"cuda:{gpu_id}"
+            return "cpu"
+
+
+def is_cuda(device: str) -> bool:
+    return device.startswith("cuda")
+
+
+def _cpu_has_bf16() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def model_dtype(variant: Variant, device: str) -> torch.dtype:
+    """
+    The dtype models are loaded in. CPUs compute fp16 slowly, so there the
+    models run in bf16 when the CPU supports it and in fp32 otherwise.
+    """
+    if variant == Variant.FP32:
+        return torch.float32
+    if is_cuda(device):
+        return torch.float16
+    if _cpu_has_bf16():
+        return torch.bfloat16
+    return torch.float32
+
+
+def reset_peak_memory(device: str):
+    if is_cuda(device):
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory_bytes(device: str) -> int | None:
+    """Peak memory allocated on the device since the last reset, None for the CPU."""
+    if is_cuda(device):
+        return torch.cuda.max_memory_allocated(device)
+    return None
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident memory of the process, it never goes down."""
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_working_bytes(device: str) -> int:
+    """The peak memory the pipe needs, of the GPU or of the whole process on the CPU."""
+    peak = peak_memory_bytes(device)
+    if peak is None:
+        return peak_rss_bytes()
+    return peak
@@ -2,7 +2,12 @@
 # SPDX-License-Identifier: MIT
 
 import logging
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from multiprocessing.queues import Queue
+from threading import Lock, Thread
+from typing import Callable
 
 import torch
 from diffusers import DiffusionPipeline
@@ -10,24 +15,63 @@ from PIL import Image
 from pytsterrors import TSTError
 
 from src.api.v1.engines.schemas import EngineSchema
+from src.api.v1.images.schemas import ImageSchema
+from src.api.v1.jobs.schemas import JobSchema
 from src.core.enums import (
     GeneratorCommandType,
     GeneratorEventType,
+    MemoryMode,
 )
 
+from ..cost_model import batch_size_for
+from .acceleration import apply_acceleration, use_compile_cache, warm_up
+from .checkpoint_cache import CheckpointCache
+from .conditioning_cache import ConditioningCache
+from .device import (
+    peak_memory_bytes,
+    peak_working_bytes,
+    reset_peak_memory,
+    resolve_device,
+)
+from .ip_adapter import IPAdapterResidency
+from .lora import LoraAdapters, lora_key
+from .memory import (
+    apply_memory_mode,
+    choose_memory_mode,
+    is_offloaded,
+    pipe_model_bytes,
+)
 from .pipe import (
+    PreparedBatch,
+    batch_key,
     create_controlnets,
     create_pipe,
     create_vae,
+    denoise_batch,
     load_embeddings,
-    load_ip_adapter,
     load_loras,
-    run_pipe,
-    set_ip_adapter_scale,
+    prepare_batch,
     set_scheduler,
-    unload_ip_adapter,
 )
-from .types import GeneratorCommand, GeneratorEvent, ImageFinished, JobFinished
+from .pose import set_conditioning_cache, warm_up_detectors
+from .prompt_cache import PromptEmbedsCache
+from .startup import StartupTimer
+from .types import (
+    GeneratorCommand,
+    GeneratorEvent,
+    GeneratorOptions,
+    GeneratorStartup,
+    ImageFinished,
+    ImageProgress,
+    JobCancelled,
+    JobFinished,
+)
+from .writer import ImageWriter, when_all
+
+
+def _read_rgb(path: str) -> Image.Image:
+    with Image.open(path) as f:
+        return f.convert("RGB")
 
 
 class GeneratorProcess:
@@ -37,6 +81,25 @@ class GeneratorProcess:
     _event_queue: Queue[GeneratorEvent]
     _engine: EngineSchema
     _gpu_id: int
+    # the torch device the pipe runs on
+    _device: str
+    # how the pipe is kept on the device, decided once it is loaded
+    _memory_mode: MemoryMode
+    _options: GeneratorOptions
+    _pending_commands: queue.Queue[GeneratorCommand]
+    _prompt_cache: PromptEmbedsCache
+    _ip_adapters: IPAdapterResidency
+    _loras: LoraAdapters
+    _prefetcher: ThreadPoolExecutor
+    _writer: ImageWriter
+    # writes of each job that is running, its JOB_FINISHED waits for them
+    _job_writes: dict[int, list[Future[None]]]
+    # jobs received and not done yet, a CANCEL of any other job is stale
+    _active_jobs: set[int]
+    _cancelled_jobs: set[int]
+    _jobs_lock: Lock
+    # when the last IMAGE_PROGRESS was sent
+    _last_progress: float
 
     def __init__(
         self,
@@ -46,6 +109,7 @@ class GeneratorProcess:
         engine: EngineSchema,
         commands_queue: Queue[GeneratorCommand],
         event_queue: Queue[GeneratorEvent],
+        options: GeneratorOptions | None = None,
     ):
         self._name = generator_name
         self._generator_id = generator_id
@@ -53,17 +117,61 @@ class GeneratorProcess:
         self._event_queue = event_queue
         self._engine = engine
         self._gpu_id = gpu_id
+        self._options = options or GeneratorOptions()
+        self._device = resolve_device(self._options.device, gpu_id)
+        self._memory_mode = MemoryMode.FULL
+        self._prompt_cache = PromptEmbedsCache(self._options.prompt_cache_bytes)
+        self._ip_adapters = IPAdapterResidency()
+        self._loras = LoraAdapters(
+            self._options.lora_memory_bytes, self._options.loaded_loras
+        )
+        self._prefetcher = ThreadPoolExecutor(
+            max_workers=max(1, self._options.prefetch_workers),
+            thread_name_prefix="prefetch",
+        )
+        self._writer = ImageWriter(self._engine, self._options.writer_workers)
+        self._job_writes = {}
+        self._pending_commands = queue.Queue()
+        self._active_jobs = set()
+        self._cancelled_jobs = set()
+        self._jobs_lock = Lock()
+        self._last_progress = 0.0
+
+    def _heartbeat(self, interval: float):
+        # keeps beating while the main thread loads models or denoises,
+        # it only goes silent when the whole process hangs or dies
+        while True:
+            self._event_queue.put(
+                GeneratorEvent(
+                    generator_name=self._name,
+                    generator_id=self._generator_id,
+                    event=GeneratorEventType.HEARTBEAT,
+                    value=None,
+                )
+            )
+            time.sleep(interval)
+
+    def _create_pipe(self, timer: StartupTimer) -> DiffusionPipeline:
+        checkpoint_cache = None
+        if self._options.checkpoint_cache_path is not None:
+            checkpoint_cache = CheckpointCache(self._options.checkpoint_cache_path)
 
-    def _create_pipe(self) -> DiffusionPipeline:
         vae = None
         if self._engine.vae_model is not None:
-            vae = create_vae(self._engine.vae_model)
+            with timer.phase("vae"):
+                vae = create_vae(self._engine.vae_model, checkpoint_cache, self._device)
 
         controlnets = []
         if len(self._engine.control_net_models) > 0:
-            controlnets = create_controlnets(self._engine.control_net_models)
+            with timer.phase("controlnets"):
+                controlnets = create_controlnets(
+                    self._engine.control_net_models, checkpoint_cache, self._device
+                )
 
-        pipe = create_pipe(self._engine, vae, controlnets)
+        with timer.phase("pipeline"):
+            pipe = create_pipe(
+                self._engine, vae, controlnets, checkpoint_cache, self._device
+            )
         if self._engine.clip_skip is not None:
             clip_skip = self._engine.clip_skip
             pipe.text_encoder.text_model.encoder.layers = (
@@ -79,103 +187,602 @@ class GeneratorProcess:
                 )
 
         if len(self._engine.lora_models) > 0:
-            load_loras(pipe, self._engine.lora_models)
+            with timer.phase("loras"):
+                load_loras(pipe, self._engine.lora_models)
 
         if len(self._engine.embedding_models) > 0:
-            load_embeddings(pipe, self._engine.embedding_models)
+            with timer.phase("embeddings"):
+                load_embeddings(pipe, self._engine.embedding_models)
 
         scheduler_config = {}
         if self._engine.scheduler_config is not None:
             scheduler_config = self._engine.scheduler_config
 
         print(self._engine.scheduler, scheduler_config)
-        set_scheduler(pipe, self._engine.scheduler, scheduler_config)
-        pipe = pipe.to("cuda:" + str(self._gpu_id))
+        with timer.phase("scheduler"):
+            set_scheduler(pipe, self._engine.scheduler, scheduler_config)
         pipe.safety_checker = None
 
+        acceleration = self._engine.acceleration
+        if acceleration is not None:
+            if (
+                acceleration.compile_mode is not None
+                and self._options.compile_cache_path is not None
+            ):
+                use_compile_cache(
+                    self._options.compile_cache_path, self._engine, self._device
+                )
+            with timer.phase("acceleration"):
+                apply_acceleration(pipe, acceleration)
+
+        # after the acceleration, attention slicing replaces its processors
+        self._memory_mode = self._options.memory_mode or MemoryMode.FULL
+        if self._memory_mode == MemoryMode.AUTO:
+            self._memory_mode = choose_memory_mode(
+                pipe_model_bytes(pipe),
+                self._engine,
+                self._device,
+                self._options.memory_budget_bytes,
+            )
+        print(f"Generator {self._generator_id} runs in memory mode {self._memory_mode}")
+        with timer.phase("to_device"):
+            apply_memory_mode(pipe, self._memory_mode, self._device)
+
         return pipe
 
-    def listening(self):
-        pipe = self._create_pipe()
+    def _read_commands(self):
+        # CANCEL is handled here so that it is seen while a job is running,
+        # everything else is passed to the main loop in order
+        while True:
+            cmd = self._command_queue.get()
+            if cmd.command == GeneratorCommandType.CANCEL:
+                job_id = cmd.value
+                if isinstance(job_id, int):
+                    with self._jobs_lock:
+                        # the manager handles a cancel of a job that is done here
+                        if job_id in self._active_jobs:
+                            print(f"Generator {self._generator_id} cancels {job_id}")
+                            self._cancelled_jobs.add(job_id)
+                continue
+
+            if cmd.command == GeneratorCommandType.JOB and isinstance(
+                cmd.value, JobSchema
+            ):
+                assert cmd.value.id is not None
+                with self._jobs_lock:
+                    self._active_jobs.add(cmd.value.id)
+
+            self._pending_commands.put(cmd)
+            if cmd.command == GeneratorCommandType.CLOSE:
+                return
+
+    def _is_cancelled(self, job_id: int) -> bool:
+        return job_id in self._cancelled_jobs
+
+    def _forget_job(self, job_id: int):
+        with self._jobs_lock:
+            self._active_jobs.discard(job_id)
+            self._cancelled_jobs.discard(job_id)
+
+    def _max_batch_size(self, img: ImageSchema) -> int:
+        """The engine's batch size, or less when the image is too big for it to fit."""
+        width = img.width or self._engine.width
+        height = img.height or self._engine.height
+        return batch_size_for(
+            width * height / 1_000_000,
+            self._options.max_batch_megapixels,
+            self._engine.max_batch_size,
+        )
+
+    def _batches(self, job: JobSchema) -> list[list[ImageSchema]]:
+        """
+        Groups the images that are not ready yet into consecutive runs
+        that share a batch_key, up to the max batch size of their size.
+        """
+        batches: list[list[ImageSchema]] = []
+        key = None
+        for img in job.images:
+            if img.ready:
+                continue
+            # with an IP-Adapter the images after the first depend on it
+            max_size = (
+                1 if job.ip_adapter_config is not None else self._max_batch_size(img)
+            )
+            img_key = batch_key(self._engine, img)
+            if len(batches) > 0 and img_key == key and len(batches[-1]) < max_size:
+                batches[-1].append(img)
+            else:
+                batches.append([img])
+                key = img_key
+        return batches
+
+    def _prefetch(
+        self, pipe: DiffusionPipeline, job: JobSchema, imgs: list[ImageSchema]
+    ) -> Future[list[PreparedBatch]]:
+        """
+        Builds the conditioning images and prompt embeddings while the GPU is
+        busy, the LoRAs of the job must be active by then.
+        """
+        if not is_offloaded(self._memory_mode):
+            return self._prefetcher.submit(
+                prepare_batch,
+                pipe,
+                self._engine,
+                imgs,
+                self._prompt_cache,
+                job.lora_models,
+            )
+
+        # the offload hooks move the models between the devices as they are
+        # called, so the encoders must not run beside the denoising
+        future: Future[list[PreparedBatch]] = Future()
+        try:
+            future.set_result(
+                prepare_batch(
+                    pipe, self._engine, imgs, self._prompt_cache, job.lora_models
+                )
+            )
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _progress(self, batch: PreparedBatch) -> Callable[[int, int], None] | None:
+        """
+        Step callback that sends IMAGE_PROGRESS for the batch, at most once per
+        progress_interval whatever the number of steps of the engine.
+        """
+        interval = self._options.progress_interval
+        if interval is None:
+            return None
+        started = time.perf_counter()
+        job_ids = sorted({img.job_id for img in batch.img_schs})
+        image_ids = [img.id for img in batch.img_schs if img.id is not None]
+
+        def on_step(step: int, total_steps: int):
+            now = time.perf_counter()
+            # the last step is followed by IMAGE_FINISHED
+            if step >= total_steps or now - self._last_progress < interval:
+                return
+            self._last_progress = now
+            elapsed = now - started
+            self._put_event(
+                GeneratorEventType.IMAGE_PROGRESS,
+                ImageProgress(
+                    job_ids=job_ids,
+                    image_ids=image_ids,
+                    step=step,
+                    total_steps=total_steps,
+                    elapsed_seconds=elapsed,
+                    eta_seconds=elapsed / step * (total_steps - step),
+                ),
+            )
+
+        return on_step
+
+    def _denoise(
+        self,
+        pipe: DiffusionPipeline,
+        prepared: list[PreparedBatch],
+        ip_adapter_image_embeds: list[torch.Tensor] | None,
+        should_stop: Callable[[], bool],
+    ) -> tuple[list[tuple[ImageSchema, Image.Image]], int] | None:
+        """The images with the size of the largest batch, None when it got stopped."""
+        # the peak the images report is the one of this batch
+        reset_peak_memory(self._device)
+        results = []
+        batch_size = 0
+        for batch in prepared:
+            batch_size = max(batch_size, len(batch.img_schs))
+            images = denoise_batch(
+                pipe,
+                self._engine,
+                batch,
+                should_stop=should_stop,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                on_step=self._progress(batch),
+            )
+            if images is None:
+                return None
+            results.extend(zip(batch.img_schs, images))
+        peak = peak_memory_bytes(self._device)
+        if peak is not None:
+            print("VRAM used size:", peak / 1024**3)
+        return results, batch_size
+
+    def _write(
+        self,
+        job_id: int,
+        img_sch: ImageSchema,
+        image: Image.Image,
+        seconds: float,
+        batch_size: int,
+    ):
+        """Saves the image in the background, IMAGE_FINISHED is sent once it is on disk."""
+        peak = peak_working_bytes(self._device)
+
+        def on_written(img_sch: ImageSchema):
+            assert img_sch.id
+            self._put_event(
+                GeneratorEventType.IMAGE_FINISHED,
+                ImageFinished(
+                    job_id=job_id,
+                    image_id=img_sch.id,
+                    seconds=seconds,
+                    peak_memory_bytes=peak,
+                    batch_size=batch_size,
+                ),
+            )
+
+        def on_done(future: Future[None]):
+            err = future.exception()
+            if err is not None:
+                # the image stays not ready, so the manager queues it again
+                self._put_event(
+                    GeneratorEventType.ERROR,
+                    TSTError(
+                        "image-write-failed",
+                        f"Failed to write {img_sch.file_path}: {err}",
+                        metadata={"job_id": job_id, "image_id": img_sch.id},
+                    ),
+                )
+
+        future = self._writer.write(img_sch, image, on_written)
+        future.add_done_callback(on_done)
+        self._job_writes.setdefault(job_id, []).append(future)
+
+    def _run_job(self, pipe: DiffusionPipeline, job: JobSchema) -> bool:
+        """Runs the images of the job, returns False when the job got cancelled."""
+        assert job.id
+        job_id = job.id
+
+        # every image after the first runs with the job's first image as its
+        # reference, whichever work unit or batch it is in
+        first = job.images[0] if len(job.images) > 0 else None
+        reference: Image.Image | None = None
+
+        self._loras.activate(pipe, job.lora_models)
+        batches = self._batches(job)
+        next_prepared = (
+            self._prefetch(pipe, job, batches[0]) if len(batches) > 0 else None
+        )
+        completed = True
+        for n, batch in enumerate(batches):
+            if self._is_cancelled(job_id):
+                completed = False
+                break
+
+            assert next_prepared is not None
+            prepared = next_prepared
+            next_prepared = None
+            if n + 1 < len(batches):
+                next_prepared = self._prefetch(pipe, job, batches[n + 1])
+
+            self._ip_adapters.activate(pipe, job)
+            guidance_scale = batch[0].guidance_scale or self._engine.guidance_scale
+            do_cfg = guidance_scale > 1
+            assert first is not None and first.id is not None
+            if batch[0].id == first.id:
+                # the first image of the job has no reference
+                ip_adapter_image_embeds = self._ip_adapters.mute(pipe, do_cfg)
+            else:
+                # read only when its embeddings are not cached, an image finished
+                # by an earlier unit is on the disk by now
+                ip_adapter_image_embeds = self._ip_adapters.reference(
+                    pipe,
+                    first.id,
+                    lambda: reference or _read_rgb(first.file_path),
+                    do_cfg,
+                )
+
+            started = time.perf_counter()
+            denoised = self._denoise(
+                pipe,
+                prepared.result(),
+                ip_adapter_image_embeds,
+                lambda: self._is_cancelled(job_id),
+            )
+            if denoised is None:
+                completed = False
+                break
+
+            results, batch_size = denoised
+            # the batch time is shared evenly between its images
+            seconds = (time.perf_counter() - started) / len(results)
+            for img, image in results:
+                self._write(job_id, img, image, seconds, batch_size)
+                # it may still be on its way to the disk
+                if img.id == first.id:
+                    reference = image.convert("RGB")
+
+        return completed
+
+    def _put_event(
+        self,
+        event: GeneratorEventType,
+        value: JobFinished
+        | JobCancelled
+        | ImageFinished
+        | ImageProgress
+        | GeneratorStartup
+        | TSTError
+        | None,
+    ):
         self._event_queue.put(
             GeneratorEvent(
                 generator_name=self._name,
                 generator_id=self._generator_id,
-                event=GeneratorEventType.READY,
-                value=None,
+                event=event,
+                value=value,
             )
         )
+
+    def _collect_jobs(
+        self, first: JobSchema
+    ) -> tuple[list[JobSchema], GeneratorCommand | None]:
+        """
+        Waits up to the batching window for more jobs to run together with
+        the first one. Returns them with the command that ended the wait
+        early, if any, which is handled after the jobs.
+        """
+        jobs = [first]
+        deadline = time.monotonic() + self._options.batch_window
+        while len(jobs) < self._options.max_jobs:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    cmd = self._pending_commands.get(timeout=remaining)
+                else:
+                    # whatever is queued already doesn't cost any latency
+                    cmd = self._pending_commands.get_nowait()
+            except queue.Empty:
+                break
+
+            if cmd.command != GeneratorCommandType.JOB or not isinstance(
+                cmd.value, JobSchema
+            ):
+                return jobs, cmd
+            jobs.append(cmd.value)
+        return jobs, None
+
+    def _run_jobs(self, pipe: DiffusionPipeline, jobs: list[JobSchema]):
+        """
+        Runs the images of several jobs together, each denoising batch takes
+        the images of any job that share its batch_key.
+        """
+        for job in jobs:
+            if job.ip_adapter_config is not None:
+                # each image waits for the one before it, nothing to share
+                assert job.id
+                try:
+                    completed = self._run_job(pipe, job)
+                except Exception as e:
+                    self._fail_job(job.id, e)
+                    continue
+                self._finish_job(job.id, completed)
+
+        pending = [
+            (job, img)
+            for job in jobs
+            if job.ip_adapter_config is None
+            for img in job.images
+            if not img.ready
+        ]
+        if len(pending) > 0 and self._memory_mode != MemoryMode.FULL:
+            # the adapter stays loaded for the next job using it, unless memory is tight
+            self._ip_adapters.deactivate(pipe)
+        remaining = {job.id: 0 for job in jobs if job.ip_adapter_config is None}
+        for job, _ in pending:
+            remaining[job.id] += 1
+        for job_id, count in remaining.items():
+            if count == 0:
+                assert job_id
+                self._finish_job(job_id, True)
+
+        prefetched: tuple[set[int | None], Future[list[PreparedBatch]]] | None = None
+        while len(pending) > 0:
+            for job_id in {job.id for job, _ in pending}:
+                assert job_id
+                if self._is_cancelled(job_id):
+                    pending = [(j, img) for j, img in pending if j.id != job_id]
+                    self._finish_job(job_id, False)
+            if len(pending) == 0:
+                break
+
+            batch = self._next_batch(pending)
+            batch_job = batch[0][0]
+            done = {img.id for _, img in batch}
+            job_ids = {job.id for job, _ in batch}
+            try:
+                self._loras.activate(pipe, batch_job.lora_models)
+                if prefetched is not None and prefetched[0] == done:
+                    prepared = prefetched[1]
+                else:
+                    # a job of the prefetched batch got cancelled,
+                    # or it needs other LoRAs
+                    prepared = self._prefetch(
+                        pipe, batch_job, [img for _, img in batch]
+                    )
+
+                rest = [(job, img) for job, img in pending if img.id not in done]
+                prefetched = None
+                if len(rest) > 0:
+                    next_batch = self._next_batch(rest)
+                    next_job = next_batch[0][0]
+                    # the prompts are encoded with the adapters that are active now
+                    if lora_key(next_job.lora_models) == self._loras.active:
+                        prefetched = (
+                            {img.id for _, img in next_batch},
+                            self._prefetch(
+                                pipe, next_job, [img for _, img in next_batch]
+                            ),
+                        )
+
+                # a loaded adapter is turned off rather than unloaded
+                first_img = batch[0][1]
+                guidance_scale = first_img.guidance_scale or self._engine.guidance_scale
+                muted = self._ip_adapters.mute(pipe, guidance_scale > 1)
+                started = time.perf_counter()
+                denoised = self._denoise(
+                    pipe,
+                    prepared.result(),
+                    muted,
+                    lambda: all(
+                        job_id is not None and self._is_cancelled(job_id)
+                        for job_id in job_ids
+                    ),
+                )
+            except Exception as e:
+                # the jobs of the batch fail, the others keep running
+                pending = [(j, img) for j, img in pending if j.id not in job_ids]
+                prefetched = None
+                for job_id in job_ids:
+                    assert job_id
+                    self._fail_job(job_id, e)
+                continue
+            if denoised is None:
+                # every job of the batch got cancelled, handled above
+                continue
+
+            results, batch_size = denoised
+            seconds = (time.perf_counter() - started) / len(batch)
+            pending = rest
+            for img, image in results:
+                self._write(img.job_id, img, image, seconds, batch_size)
+            for job, _ in batch:
+                assert job.id
+                remaining[job.id] -= 1
+                if remaining[job.id] == 0:
+                    self._finish_job(job.id, True)
+
+    def _next_batch(
+        self, pending: list[tuple[JobSchema, ImageSchema]]
+    ) -> list[tuple[JobSchema, ImageSchema]]:
+        """The images that share the batch_key and the LoRAs of the first pending one."""
+        first_job, first_img = pending[0]
+        key = (lora_key(first_job.lora_models), batch_key(self._engine, first_img))
+        return [
+            (job, img)
+            for job, img in pending
+            if (lora_key(job.lora_models), batch_key(self._engine, img)) == key
+        ][: self._max_batch_size(first_img)]
+
+    def _finish_job(self, job_id: int, completed: bool):
+        self._forget_job(job_id)
+
+        def put_job_event():
+            if completed:
+                self._put_event(
+                    GeneratorEventType.JOB_FINISHED, JobFinished(job_id=job_id)
+                )
+            else:
+                self._put_event(
+                    GeneratorEventType.JOB_CANCELLED, JobCancelled(job_id=job_id)
+                )
+
+        # sent after the IMAGE_FINISHED of every image the job wrote
+        when_all(self._job_writes.pop(job_id, []), put_job_event)
+
+    def _fail_job(self, job_id: int, err: Exception):
+        """Reports the job as failed instead of letting the error end the process."""
+        print(f"Generator {self._generator_id} failed job {job_id}: {err!r}")
+        self._forget_job(job_id)
+
+        def put_error_event():
+            # the job ID tells the manager that the job's work unit is over
+            self._put_event(
+                GeneratorEventType.ERROR,
+                TSTError(
+                    "job-failed",
+                    f"Job {job_id} failed: {err!r}",
+                    metadata={"job_id": job_id},
+                ),
+            )
+
+        when_all(self._job_writes.pop(job_id, []), put_error_event)
+
+    def listening(self):
+        if self._options.heartbeat_interval is not None:
+            Thread(
+                target=self._heartbeat,
+                args=(self._options.heartbeat_interval,),
+                daemon=True,
+            ).start()
+        Thread(target=self._read_commands, daemon=True).start()
+        if self._options.threads is not None:
+            # generators sharing the CPU don't fight over its cores
+            torch.set_num_threads(self._options.threads)
+        print(
+            f"Generator {self._generator_id} runs on {self._device} "
+            f"with {torch.get_num_threads()} threads"
+        )
+        timer = StartupTimer(self._device)
+        pipe = self._create_pipe(timer)
+        # the first control image doesn't pay for loading the annotators
+        with timer.phase("detectors"):
+            warm_up_detectors(self._engine, self._device)
+        if self._engine.acceleration is not None and self._engine.acceleration.warm_up:
+            # compiles the graphs, or loads them from the cache
+            with timer.phase("warm_up"):
+                warm_up(pipe, self._engine)
+        conditioning_cache = ConditioningCache(
+            self._options.conditioning_path,
+            self._options.conditioning_memory_bytes,
+            self._options.conditioning_disk_bytes,
+        )
+        set_conditioning_cache(conditioning_cache)
+
+        startup = timer.report()
+        startup.memory_mode = self._memory_mode
+        # the images report the peak of serving jobs, not of loading the models
+        reset_peak_memory(self._device)
+        for phase in startup.phases:
+            print(
+                f"startup phase {phase.name} took {phase.seconds:.2f} seconds, "
+                f"raised the peak RSS by {phase.peak_rss_growth_bytes / 1024**3:.2f} "
+                f"to {phase.peak_rss_bytes / 1024**3:.2f} GB, "
+                f"peak device memory {(phase.peak_device_bytes or 0) / 1024**3:.2f} GB"
+            )
+        self._put_event(GeneratorEventType.READY, startup)
+        deferred = None
         while True:
-            cmd = self._command_queue.get()
+            if deferred is not None:
+                cmd, deferred = deferred, None
+            else:
+                cmd = self._pending_commands.get()
             print(f"Generator {self._generator_id} received new command {cmd.command}")
             match cmd.command:
                 case GeneratorCommandType.JOB:
                     logging.debug("received job")
-                    if cmd.value is None:
-                        self._event_queue.put(
-                            GeneratorEvent(
-                                generator_name=self._name,
-                                generator_id=self._generator_id,
-                                event=GeneratorEventType.ERROR,
-                                value=TSTError(
-                                    "command-value-was-none",
-                                    "Command value was None on JOB command type",
-                                ),
-                            )
+                    if not isinstance(cmd.value, JobSchema):
+                        self._put_event(
+                            GeneratorEventType.ERROR,
+                            TSTError(
+                                "command-value-was-none",
+                                "Command value was None on JOB command type",
+                            ),
                         )
                         continue
 
-                    job = cmd.value
-                    assert job.id
-
-                    prv_img_path = None
-                    ip_adapter_image = None
-                    ip_adapter_loaded = False
-                    for img in job.images:
-                        assert img.id
-
-                        if (
-                            prv_img_path is not None
-                            and ip_adapter_loaded is False
-                            and job.ip_adapter_config is not None
-                        ):
-                            print("ip adapter config", job.ip_adapter_config)
-                            load_ip_adapter(pipe, job)
-                            set_ip_adapter_scale(pipe, job)
-                            ip_adapter_loaded = True
-                            ip_adapter_image = Image.open(prv_img_path).convert("RGB")
-
-                        run_pipe(pipe, self._engine, img, ip_adapter_image)
+                    jobs, deferred = self._collect_jobs(cmd.value)
+                    if len(jobs) > 1:
                         print(
-                            "VRAM used size:",
-                            torch.cuda.max_memory_allocated() / 1024**3,
+                            f"Generator {self._generator_id} batches jobs {[j.id for j in jobs]}"
                         )
-                        prv_img_path = img.file_path
-
-                        self._event_queue.put(
-                            GeneratorEvent(
-                                generator_name=self._name,
-                                generator_id=self._generator_id,
-                                event=GeneratorEventType.IMAGE_FINISHED,
-                                value=ImageFinished(job_id=job.id, image_id=img.id),
-                            )
-                        )
-
-                    if ip_adapter_loaded:
-                        unload_ip_adapter(pipe, job)
-
-                    self._event_queue.put(
-                        GeneratorEvent(
-                            generator_name=self._name,
-                            generator_id=self._generator_id,
-                            event=GeneratorEventType.JOB_FINISHED,
-                            value=JobFinished(job_id=job.id),
-                        )
-                    )
+                    self._run_jobs(pipe, jobs)
+                    if self._engine.long_prompt_technique is not None:
+                        print(self._prompt_cache.stats())
+                    if len(self._engine.control_net_models) > 0:
+                        print(conditioning_cache.stats())
+                    if any(len(job.lora_models) > 0 for job in jobs):
+                        print(self._loras.stats())
                 case GeneratorCommandType.CLOSE:
                     logging.debug("closing")
                     break
 
+        # every image is on disk before CLOSED
+        self._prefetcher.shutdown(wait=True)
+        self._writer.close()
+
         self._event_queue.put(
             GeneratorEvent(
                 generator_name=self._name,
@@ -193,9 +800,16 @@ def start_generator(
     engine: EngineSchema,
     commands_queue: Queue[GeneratorCommand],
     result_queue: Queue[GeneratorEvent],
+    options: GeneratorOptions | None = None,
 ):
     generator = GeneratorProcess(
-        generator_name, generator_id, gpu_id, engine, commands_queue, result_queue
+        generator_name,
+        generator_id,
+        gpu_id,
+        engine,
+        commands_queue,
+        result_queue,
+        options,
     )
     logging.debug(f"start generator with engine named {engine.name} and id {engine.id}")
     generator.listening()
@@ -0,0 +1,125 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+from typing import Any, Callable
+
+import torch
+from PIL import Image
+
+from src.api.v1.jobs.schemas import JobSchema
+
+from .pipe import load_ip_adapter, set_ip_adapter_scale
+
+
+def ip_adapter_key(job: JobSchema) -> tuple[Any, ...] | None:
+    if job.ip_adapter_config is None:
+        return None
+    config = job.ip_adapter_config
+    return (config["model"], config["subfolder"], config["weight_name"])
+
+
+class IPAdapterResidency:
+    """
+    Keeps the IP-Adapter of the last job loaded in the pipe, so back to back
+    jobs with the same adapter only change its scale.
+
+    The UNet of a pipe with an IP-Adapter refuses to run without image
+    embeddings, so images that don't use one run with the adapter muted:
+    a zero scale and zero embeddings. It is only unloaded for another
+    adapter, or when the generator is short of memory.
+
+    The embeddings of the last reference image are kept too, the work
+    units of a job share them instead of encoding the reference again.
+    """
+
+    _loaded: tuple[Any, ...] | None
+    # embeddings of muted images, by whether they run with classifier free guidance
+    _zero_embeds: dict[bool, list[torch.Tensor]]
+    # embeddings of a reference, by its image id and classifier free guidance
+    _reference_embeds: dict[tuple[int, bool], list[torch.Tensor]]
+
+    def __init__(self):
+        self._loaded = None
+        self._zero_embeds = {}
+        self._reference_embeds = {}
+
+    def activate(self, pipe, job: JobSchema):  # pyright: ignore[reportMissingParameterType]
+        key = ip_adapter_key(job)
+        if key is None:
+            return
+
+        if key != self._loaded:
+            self.deactivate(pipe)
+            print("ip adapter config", job.ip_adapter_config)
+            load_ip_adapter(pipe, job)
+            self._loaded = key
+        set_ip_adapter_scale(pipe, job)
+
+    def mute(
+        self,
+        pipe,  # pyright: ignore[reportMissingParameterType]
+        do_classifier_free_guidance: bool,
+    ) -> list[torch.Tensor] | None:
+        """
+        Turns the loaded adapter off for images without a reference, returns
+        the embeddings they run with, None when no adapter is loaded.
+        """
+        if self._loaded is None:
+            return None
+
+        pipe.set_ip_adapter_scale(0.0)
+        if do_classifier_free_guidance not in self._zero_embeds:
+            # shaped like the embeddings of a reference, whichever the adapter
+            embeds = ip_adapter_image_embeds(
+                pipe, Image.new("RGB", (224, 224)), do_classifier_free_guidance
+            )
+            self._zero_embeds[do_classifier_free_guidance] = [
+                torch.zeros_like(e) for e in embeds
+            ]
+        return self._zero_embeds[do_classifier_free_guidance]
+
+    def reference(
+        self,
+        pipe,  # pyright: ignore[reportMissingParameterType]
+        image_id: int,
+        load: Callable[[], Image.Image],
+        do_classifier_free_guidance: bool,
+    ) -> list[torch.Tensor]:
+        """
+        The embeddings of the reference image with the id, load reads the
+        image on a miss. Only the embeddings of one reference are kept.
+        """
+        key = (image_id, do_classifier_free_guidance)
+        if key not in self._reference_embeds:
+            if not any(k[0] == image_id for k in self._reference_embeds):
+                self._reference_embeds = {}
+            self._reference_embeds[key] = ip_adapter_image_embeds(
+                pipe, load(), do_classifier_free_guidance
+            )
+        return self._reference_embeds[key]
+
+    def deactivate(self, pipe):  # pyright: ignore[reportMissingParameterType]
+        if self._loaded is None:
+            return
+        pipe.unload_ip_adapter()
+        self._loaded = None
+        self._zero_embeds = {}
+        self._reference_embeds = {}
+
+
+def ip_adapter_image_embeds(
+    pipe,  # pyright: ignore[reportMissingParameterType]
+    image: Image.Image,
+    do_classifier_free_guidance: bool,
+) -> list[torch.Tensor]:
+    """
+    Encodes the reference image once, the pipe takes the result as
+    ip_adapter_image_embeds for every image that uses the same reference.
+    """
+    return pipe.prepare_ip_adapter_image_embeds(
+        ip_adapter_image=image,
+        ip_adapter_image_embeds=None,
+        device=pipe._execution_device,
+        num_images_per_prompt=1,
+        do_classifier_free_guidance=do_classifier_free_guidance,
+    )
@@ -0,0 +1,122 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import os
+from collections import OrderedDict
+from typing import Any
+
+import torch
+from safetensors.torch import load_file
+
+from src.api.v1.engines.schemas import LoraAndWeight
+
+
+def lora_key(loras: list[LoraAndWeight]) -> tuple[Any, ...]:
+    """The adapter set of a job, jobs with the same key run with the same weights."""
+    return tuple(sorted((lw.aimodel.id or 0, lw.weight) for lw in loras))
+
+
+def adapter_name(lora: LoraAndWeight) -> str:
+    return f"lora_{lora.aimodel.id}"
+
+
+def _state_dict_size(state_dict: dict[str, torch.Tensor]) -> int:
+    return sum(t.element_size() * t.nelement() for t in state_dict.values())
+
+
+class LoraAdapters:
+    """
+    Applies the LoRAs of each job as named adapters on the loaded pipe,
+    instead of fusing them at startup.
+
+    The state dicts of LoRA files are kept in CPU memory, least recently
+    used first out once they grow past max_cpu_bytes, so switching back to
+    a LoRA doesn't read it from the disk again. At most max_loaded adapters
+    stay in the pipe, the ones that are not active get deleted first.
+    """
+
+    _state_dicts: OrderedDict[str, dict[str, torch.Tensor]]
+    _state_dicts_bytes: int
+    _max_cpu_bytes: int
+    # adapters in the pipe in least recently used order
+    _loaded: OrderedDict[str, None]
+    _max_loaded: int
+    _active: tuple[Any, ...]
+    hits: int
+    misses: int
+
+    def __init__(self, max_cpu_bytes: int, max_loaded: int):
+        self._state_dicts = OrderedDict()
+        self._state_dicts_bytes = 0
+        self._max_cpu_bytes = max_cpu_bytes
+        self._loaded = OrderedDict()
+        self._max_loaded = max(1, max_loaded)
+        self._active = ()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def active(self) -> tuple[Any, ...]:
+        return self._active
+
+    def activate(self, pipe, loras: list[LoraAndWeight]):  # pyright: ignore[reportMissingParameterType]
+        key = lora_key(loras)
+        if key == self._active:
+            return
+
+        if len(loras) == 0:
+            pipe.disable_lora()
+            self._active = key
+            return
+
+        names = [adapter_name(lw) for lw in loras]
+        for lw, name in zip(loras, names):
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                continue
+            self._evict(pipe, keep=set(names))
+            print(f"loading lora {lw.aimodel.name} as adapter {name}")
+            pipe.load_lora_weights(self._weights(lw.aimodel.path), adapter_name=name)
+            self._loaded[name] = None
+
+        pipe.enable_lora()
+        pipe.set_adapters(names, adapter_weights=[lw.weight for lw in loras])
+        self._active = key
+
+    def _evict(self, pipe, keep: set[str]):  # pyright: ignore[reportMissingParameterType]
+        while len(self._loaded) >= self._max_loaded:
+            name = next((n for n in self._loaded if n not in keep), None)
+            if name is None:
+                return
+            del self._loaded[name]
+            pipe.delete_adapters(name)
+
+    def _weights(self, path: str) -> str | dict[str, torch.Tensor]:
+        """The cached state dict of a LoRA file, what load_lora_weights takes otherwise."""
+        if not (os.path.isfile(path) and path.endswith(".safetensors")):
+            return path
+
+        state_dict = self._state_dicts.get(path)
+        if state_dict is not None:
+            self.hits += 1
+            self._state_dicts.move_to_end(path)
+        else:
+            self.misses += 1
+            state_dict = load_file(path, device="cpu")
+            size = _state_dict_size(state_dict)
+            if size <= self._max_cpu_bytes:
+                self._state_dicts[path] = state_dict
+                self._state_dicts_bytes += size
+                while self._state_dicts_bytes > self._max_cpu_bytes:
+                    _, old = self._state_dicts.popitem(last=False)
+                    self._state_dicts_bytes -= _state_dict_size(old)
+
+        # load_lora_weights renames the keys of the dict it gets
+        return dict(state_dict)
+
+    def stats(self) -> str:
+        return (
+            f"lora cache: {self.hits} hits, {self.misses} misses, "
+            f"{len(self._loaded)} adapters loaded, "
+            f"{self._state_dicts_bytes / 1024**2:.1f} MB in memory"
+        )
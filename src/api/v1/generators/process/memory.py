@@ -0,0 +1,114 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+from src.api.v1.engines.schemas import EngineSchema
+from src.core.enums import MemoryMode
+
+from .device import is_cuda
+
+# fastest first, each mode also applies the savings of the modes before it
+_LADDER = [
+    MemoryMode.FULL,
+    MemoryMode.VAE_SLICING,
+    MemoryMode.VAE_TILING,
+    MemoryMode.ATTENTION_SLICING,
+    MemoryMode.MODEL_OFFLOAD,
+    MemoryMode.SEQUENTIAL_OFFLOAD,
+]
+_OFFLOAD = (MemoryMode.MODEL_OFFLOAD, MemoryMode.SEQUENTIAL_OFFLOAD)
+
+# rough activation sizes of fp16 models, per megapixel of the image
+_UNET_BYTES_PER_MEGAPIXEL = 1.0 * 1024**3
+_VAE_DECODE_BYTES_PER_MEGAPIXEL = 3.0 * 1024**3
+_VAE_TILE_BYTES = 0.5 * 1024**3
+# what sequential offload keeps on the device besides the activations
+_SEQUENTIAL_RESIDENT_BYTES = 0.5 * 1024**3
+
+
+def _applies(mode: MemoryMode, saving: MemoryMode) -> bool:
+    return _LADDER.index(mode) >= _LADDER.index(saving)
+
+
+def is_offloaded(mode: MemoryMode) -> bool:
+    """Whether hooks move the pipe's models to the device as they are called."""
+    return mode in _OFFLOAD
+
+
+def model_bytes(model) -> int:  # pyright: ignore[reportMissingParameterType]
+    return sum(p.element_size() * p.nelement() for p in model.parameters())
+
+
+def pipe_model_bytes(pipe) -> dict[str, int]:  # pyright: ignore[reportMissingParameterType]
+    """Bytes of the weights of each model of the pipe."""
+    res = {}
+    for name, component in pipe.components.items():
+        if hasattr(component, "parameters"):
+            res[name] = model_bytes(component)
+    return res
+
+
+def estimate_peak_bytes(
+    mode: MemoryMode, weights: dict[str, int], megapixels: float, batch_size: int
+) -> int:
+    """
+    Rough peak device memory of a denoising batch in the mode, scaled from
+    fp16 SD/SDXL measurements. Good enough to rank the modes, the measured
+    peak of the generator is recorded to check it.
+    """
+    # the negative prompt doubles the batch of the UNet
+    unet = _UNET_BYTES_PER_MEGAPIXEL * megapixels * batch_size * 2
+    if _applies(mode, MemoryMode.ATTENTION_SLICING):
+        unet /= 2
+
+    vae = _VAE_DECODE_BYTES_PER_MEGAPIXEL * megapixels * batch_size
+    if _applies(mode, MemoryMode.VAE_SLICING):
+        vae /= batch_size
+    if _applies(mode, MemoryMode.VAE_TILING):
+        vae = min(vae, _VAE_TILE_BYTES)
+
+    match mode:
+        case MemoryMode.MODEL_OFFLOAD:
+            resident = max(weights.values(), default=0)
+        case MemoryMode.SEQUENTIAL_OFFLOAD:
+            resident = _SEQUENTIAL_RESIDENT_BYTES
+        case _:
+            resident = sum(weights.values())
+    return int(resident + max(unet, vae))
+
+
+def choose_memory_mode(
+    weights: dict[str, int],
+    engine: EngineSchema,
+    device: str,
+    budget_bytes: int | None,
+) -> MemoryMode:
+    """The fastest mode expected to fit in the budget, the most frugal one otherwise."""
+    if budget_bytes is None:
+        return MemoryMode.FULL
+
+    # there is nothing to offload to on the CPU
+    ladder = [m for m in _LADDER if is_cuda(device) or m not in _OFFLOAD]
+    megapixels = engine.width * engine.height / 1_000_000
+    for mode in ladder:
+        peak = estimate_peak_bytes(mode, weights, megapixels, engine.max_batch_size)
+        if peak <= budget_bytes:
+            return mode
+    return ladder[-1]
+
+
+def apply_memory_mode(pipe, mode: MemoryMode, device: str):  # pyright: ignore[reportMissingParameterType]
+    """Places the pipe on the device as the mode says, instead of pipe.to(device)."""
+    match mode:
+        case MemoryMode.MODEL_OFFLOAD if is_cuda(device):
+            pipe.enable_model_cpu_offload(device=device)
+        case MemoryMode.SEQUENTIAL_OFFLOAD if is_cuda(device):
+            pipe.enable_sequential_cpu_offload(device=device)
+        case _:
+            pipe.to(device)
+
+    if _applies(mode, MemoryMode.VAE_SLICING):
+        pipe.vae.enable_slicing()
+    if _applies(mode, MemoryMode.VAE_TILING):
+        pipe.vae.enable_tiling()
+    if _applies(mode, MemoryMode.ATTENTION_SLICING):
+        pipe.enable_attention_slicing()
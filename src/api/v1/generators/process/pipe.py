@@ -1,8 +1,10 @@
 # Copyright © 2025-2026 Emmanouil Ragiadakos
 # SPDX-License-Identifier: MIT
 
+import re
+import weakref
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable
 
 import torch
 from compel import Compel, CompelForSD, CompelForSDXL, ReturnedEmbeddingsType
@@ -31,6 +33,7 @@ from diffusers import (
     StableDiffusionXLPipeline,
     UniPCMultistepScheduler,
 )
+from PIL import Image
 from pytsterrors import TSTError
 
 # from transformers import CLIPTextModel, CLIPTokenizer
@@ -39,6 +42,7 @@ from sd_embed.embedding_funcs import (
     get_weighted_text_embeddings_sd15,
     get_weighted_text_embeddings_sdxl,
 )
+from transformers.convert_slow_tokenizer import convert_slow_tokenizer
 
 from src.api.v1.aimodels.schemas import AIModelSchema
 from src.api.v1.engines.schemas import (
@@ -49,26 +53,75 @@ from src.api.v1.images.schemas import ImageSchema
 from src.api.v1.jobs.schemas import JobSchema
 from src.core.enums import (
     AIModelBase,
+    AIModelType,
     LongPromptTechnique,
     PathType,
     PipeType,
     Scheduler,
-    Variant,
 )
 
+from .checkpoint_cache import CheckpointCache
+from .device import model_dtype
+from .lora import lora_key
 from .pose import prepare_pose_images
+from .prompt_cache import PromptEmbedsCache, engine_text_key, text_hash
 
 
-def create_controlnets(cnet_models: list[AIModelSchema]) -> list[ControlNetModel]:
+def converted_model_path(
+    cache: CheckpointCache, aimodel: AIModelSchema, device: str = "cuda"
+) -> str:
+    """
+    The diffusers-layout copy of a single-file model, converted on the first
+    call. Checkpoints are stored as the plain pipeline of their base, the
+    VAE and ControlNets of an engine are added when it is loaded.
+    """
+    torch_dtype = model_dtype(aimodel.variant, device)
+
+    model_class = None
+    match aimodel.model_type:
+        case AIModelType.CHECKPOINT:
+            if aimodel.model_base == AIModelBase.SD:
+                model_class = StableDiffusionPipeline
+            elif aimodel.model_base == AIModelBase.SDXL:
+                model_class = StableDiffusionXLPipeline
+        case AIModelType.VAE:
+            model_class = AutoencoderKL
+        case AIModelType.CONTROLNET:
+            model_class = ControlNetModel
+
+    if model_class is None:
+        raise TSTError(
+            "aimodel-can-not-be-converted",
+            f"AIModel with ID {aimodel.id} of type {aimodel.model_type} can't be converted",
+            metadata={"status_code": 400},
+        )
+
+    return cache.ensure(
+        aimodel.path,
+        model_class.__name__,
+        str(torch_dtype),
+        lambda: model_class.from_single_file(aimodel.path, torch_dtype=torch_dtype),  # pyright: ignore[reportOptionalMemberAccess]
+    )
+
+
+def create_controlnets(
+    cnet_models: list[AIModelSchema],
+    cache: CheckpointCache | None = None,
+    device: str = "cuda",
+) -> list[ControlNetModel]:
     print("cnet_models ", cnet_models)
     cnets = []
     for v in cnet_models:
         variant = str(v.variant)
-        torch_dtype = torch.float16
-        if v.variant == Variant.FP32:
-            torch_dtype = torch.float32
+        torch_dtype = model_dtype(v.variant, device)
 
         match v.path_type:
+            case PathType.FILE if cache is not None:
+                cnm = ControlNetModel.from_pretrained(
+                    converted_model_path(cache, v, device),
+                    torch_dtype=torch_dtype,
+                )
+                cnets.append(cnm)
             case PathType.FILE:
                 cnm = ControlNetModel.from_single_file(
                     v.path,
@@ -86,14 +139,18 @@ def create_controlnets(cnet_models: list[AIModelSchema]) -> list[ControlNetModel
     return cnets
 
 
-def create_vae(vae: AIModelSchema) -> AutoencoderKL:
+def create_vae(
+    vae: AIModelSchema, cache: CheckpointCache | None = None, device: str = "cuda"
+) -> AutoencoderKL:
     variant = str(vae.variant)
-    torch_dtype = torch.float16
-
-    if vae.variant == Variant.FP32:
-        torch_dtype = torch.float32
+    torch_dtype = model_dtype(vae.variant, device)
 
     match vae.path_type:
+        case PathType.FILE if cache is not None:
+            return AutoencoderKL.from_pretrained(
+                converted_model_path(cache, vae, device),
+                torch_dtype=torch_dtype,
+            )
         case PathType.FILE:
             return AutoencoderKL.from_single_file(
                 vae.path,
@@ -111,13 +168,15 @@ def create_vae(vae: AIModelSchema) -> AutoencoderKL:
 
 
 def create_pipe(
-    engine: EngineSchema, vae: AutoencoderKL | None, cnets: list[ControlNetModel]
+    engine: EngineSchema,
+    vae: AutoencoderKL | None,
+    cnets: list[ControlNetModel],
+    cache: CheckpointCache | None = None,
+    device: str = "cuda",
 ) -> DiffusionPipeline:
     checkpoint = engine.checkpoint_model
     variant = str(checkpoint.variant)
-    torch_dtype = torch.float16
-    if checkpoint.variant == Variant.FP32:
-        torch_dtype = torch.float32
+    torch_dtype = model_dtype(checkpoint.variant, device)
 
     pipeline = None
     match engine.pipe_type:
@@ -155,7 +214,13 @@ def create_pipe(
             kwargs["controlnet"] = cnets
 
     pipe = None
-    if checkpoint.path_type == PathType.FILE:
+    if checkpoint.path_type == PathType.FILE and cache is not None:
+        # saved without a variant suffix
+        del kwargs["variant"]
+        pipe = pipeline.from_pretrained(
+            converted_model_path(cache, checkpoint, device), **kwargs
+        )
+    elif checkpoint.path_type == PathType.FILE:
         pipe = pipeline.from_single_file(checkpoint.path, **kwargs)  # pyright: ignore[reportOptionalMemberAccess]
     elif checkpoint.path_type == PathType.HUGGING_FACE:
         pipe = pipeline.from_pretrained(checkpoint.path, **kwargs)  # pyright: ignore[reportOptionalMemberAccess]
@@ -173,6 +238,10 @@ def load_loras(pipe: DiffusionPipeline, loras: list[LoraAndWeight]):
             pipe.load_lora_weights(lora_path)
             pipe.fuse_lora(lora_scale=lora_weight)
 
+    if len(loras) > 0:
+        # the fused weights stay, the LoRA layers go so that jobs can add their own
+        pipe.unload_lora_weights()
+
 
 def load_sdxl_embedding(pipe, embed_path: str, token: str):
     # Load the safetensors file
@@ -320,12 +389,120 @@ class PromptEmbeds:
     negative_pooled_prompt_embeds: torch.Tensor | None
 
 
+# tokenizers.Tokenizer of the slow tokenizers, they can't return offsets themselves
+_offset_tokenizers: weakref.WeakKeyDictionary[Any, Any] = weakref.WeakKeyDictionary()
+
+
+def _token_offsets(tokenizer, text: str) -> list[tuple[int, int]]:  # pyright: ignore[reportMissingParameterType]
+    """Character offsets of the tokens of the text, without the special tokens."""
+    if tokenizer.is_fast:
+        return tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )["offset_mapping"]
+
+    backend = _offset_tokenizers.get(tokenizer)
+    if backend is None:
+        # the single file pipes come with CLIP's slow tokenizer, its fast
+        # counterpart is built once from the same vocabulary
+        backend = convert_slow_tokenizer(tokenizer)
+        _offset_tokenizers[tokenizer] = backend
+    return backend.encode(text, add_special_tokens=False).offsets
+
+
+def chunk_long_prompt(tokenizer, prompt: str, max_tokens: int = 75) -> list[str]:  # pyright: ignore[reportMissingParameterType]
+    """
+    Splits the prompt into chunks of at most max_tokens tokens, on commas
+    where it can.
+
+    The prompt is tokenized once, the boundaries are placed on the positions
+    of the comma tokens and the chunks are cut from the prompt by the token
+    offsets. A run of more than max_tokens tokens without a comma is split
+    between words instead, so no text gets truncated by the encoders.
+    """
+    offsets = _token_offsets(tokenizer, prompt)
+    n = len(offsets)
+    if n <= max_tokens:
+        return [prompt]
+
+    # the last comma token and the last token that starts a word, up to each token
+    last_comma = [-1] * n
+    last_word = [0] * n
+    comma = -1
+    word = 0
+    for i, (start, end) in enumerate(offsets):
+        if prompt[start:end] == ",":
+            comma = i
+        if i > 0 and start > offsets[i - 1][1]:
+            word = i
+        last_comma[i] = comma
+        last_word[i] = word
+
+    chunks: list[str] = []
+    begin = 0
+    while n - begin > max_tokens:
+        # the first token that doesn't fit in the chunk
+        limit = begin + max_tokens
+        if last_comma[limit] > begin:
+            # the comma itself goes with neither chunk
+            end, next_begin = last_comma[limit], last_comma[limit] + 1
+        elif last_word[limit] > begin:
+            end = next_begin = last_word[limit]
+        else:
+            # a single word longer than a chunk
+            end = next_begin = limit
+        chunks.append(prompt[offsets[begin][0] : offsets[end - 1][1]].strip())
+        begin = next_begin
+
+    if begin < n:
+        chunks.append(prompt[offsets[begin][0] :].strip())
+    return [chunk for chunk in chunks if chunk != ""]
+
+
+# Compel's weighting, blending and conjunction syntax, only Compel can encode it
+_COMPEL_SYNTAX = re.compile(r"[()]|[+\-]+(?=[\s,]|$)|\.(?:and|blend|swap)\(")
+
+
+def _encode_sdxl_chunks(
+    pipe,  # pyright: ignore[reportMissingParameterType]
+    chunks: list[str],
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Encodes plain text chunks with one forward of each text encoder. The chunks
+    are tokenized together into [n_chunks, 77] input IDs, the penultimate hidden
+    states of both encoders are joined as the SDXL pipe does, and the chunks
+    are laid one after the other. The pooled embeddings are the last chunk's.
+    """
+    device = pipe._execution_device
+    hidden_states = []
+    pooled = None
+    for tokenizer, text_encoder in (
+        (pipe.tokenizer, pipe.text_encoder),
+        (pipe.tokenizer_2, pipe.text_encoder_2),
+    ):
+        input_ids = tokenizer(
+            chunks,
+            padding="max_length",
+            max_length=tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt",
+        ).input_ids
+        with torch.no_grad():
+            output = text_encoder(input_ids.to(device), output_hidden_states=True)
+        hidden_states.append(output.hidden_states[-2])
+        # the projected text embeddings of the second encoder
+        pooled = output[0]
+
+    assert pooled is not None
+    embeds = torch.cat(hidden_states, dim=-1)
+    return embeds.reshape(1, -1, embeds.shape[-1]), pooled[-1:]
+
+
 def build_long_prompt_embeds_for_sdxl(
     pipe,
     compel_instance,
     prompt: str,
     max_tokens: int = 75,
-    verbose: bool = True,
+    verbose: bool = False,
 ):
     """
     Automatically split a long prompt into chunks and build embeddings.
@@ -341,88 +518,45 @@ def build_long_prompt_embeds_for_sdxl(
     Returns:
         tuple of (conditioning tensor, pooled embeddings)
     """
-
-    tokenizer = pipe.tokenizer
-
-    # Tokenize the full prompt to check length
-    full_tokens = tokenizer(prompt, truncation=False, add_special_tokens=False)
-    token_count = len(full_tokens["input_ids"])
-
-    if token_count <= max_tokens:
-        if verbose:
-            print(f"✓ Prompt fits in {token_count} tokens (under {max_tokens})")
-
+    chunks = chunk_long_prompt(pipe.tokenizer, prompt, max_tokens)
+    if len(chunks) == 1:
         result = compel_instance(prompt)  # Returns (conditioning, pooled)
         return result.embeds, result.pooled_embeds
 
     if verbose:
-        print(f"⚠ Prompt is {token_count} tokens (over {max_tokens})")
-        print("→ Splitting into chunks...")
-
-    # Split prompt by commas for intelligent chunking
-    parts = [p.strip() for p in prompt.split(",")]
-
-    chunks = []
-    current_chunk = []
-    current_tokens = 0
-
-    for part in parts:
-        # Count tokens for this part
-        part_tokens = tokenizer(part, truncation=False, add_special_tokens=False)
-        part_token_count = len(part_tokens["input_ids"])
-
-        # If adding this part would exceed limit, save current chunk
-        if current_tokens + part_token_count > max_tokens and current_chunk:
-            chunk_text = ", ".join(current_chunk)
-            chunks.append(chunk_text)
-            if verbose:
-                chunk_len = len(tokenizer(chunk_text, truncation=False)["input_ids"])
-                print(f"  Chunk {len(chunks)}: {chunk_len} tokens")
-            current_chunk = [part]
-            current_tokens = part_token_count
-        else:
-            current_chunk.append(part)
-            current_tokens += part_token_count
-
-    # Add the last chunk
-    if current_chunk:
-        chunk_text = ", ".join(current_chunk)
-        chunks.append(chunk_text)
-        if verbose:
-            chunk_len = len(tokenizer(chunk_text, truncation=False)["input_ids"])
-            print(f"  Chunk {len(chunks)}: {chunk_len} tokens")
+        print(f"Split the prompt into {len(chunks)} chunks of up to {max_tokens} tokens")
 
-    if verbose:
-        print(f"✓ Created {len(chunks)} chunks\n")
+    if not any(_COMPEL_SYNTAX.search(chunk) for chunk in chunks):
+        return _encode_sdxl_chunks(pipe, chunks)
 
-    # SDXL returns (conditioning, pooled) for each chunk
+    # Compel runs the text encoders once per chunk
     chunk_results = [compel_instance(chunk) for chunk in chunks]
-    # CompelForSDXL returns LabelledConditioning objects
-    conditioning_list = [result.embeds for result in chunk_results]
-    pooled_list = [result.pooled_embeds for result in chunk_results]
-
-    if hasattr(compel_instance, "pad_conditioning_tensors_to_same_length"):
-        padded_conditionings = compel_instance.pad_conditioning_tensors_to_same_length(
-            conditioning_list
-        )
-        final_conditioning = torch.cat(padded_conditionings, dim=1)
-    else:
-        # Legacy concat method or manual concat
-        if hasattr(compel_instance, "concat_conditioning"):
-            final_conditioning = compel_instance.concat_conditioning(conditioning_list)
-        else:
-            # Manual concatenation as fallback
-            final_conditioning = torch.cat(conditioning_list, dim=-2)
+    final_conditioning = torch.cat([r.embeds for r in chunk_results], dim=1)
 
     # For pooled embeddings, use the last chunk's pooled embeddings
-    final_pooled = pooled_list[-1]
+    final_pooled = chunk_results[-1].pooled_embeds
 
     return (final_conditioning, final_pooled)
 
 
 def enable_long_prompt(
-    pipe, prompt: str, negative_prompt: str, engine: EngineSchema
+    pipe,
+    prompt: str,
+    negative_prompt: str,
+    engine: EngineSchema,
+    cache: PromptEmbedsCache | None = None,
+    loras: list[LoraAndWeight] | None = None,
 ) -> PromptEmbeds:
+    """
+    Encodes the prompts with the engine's long prompt technique. With a cache,
+    texts encoded before are reused and only new ones run the text encoders.
+    loras are the job's adapters that are active on the pipe, they change
+    the text encoders too.
+    """
+    if cache is None:
+        cache = PromptEmbedsCache(max_bytes=0)
+    engine_key = engine_text_key(engine) + (lora_key(loras or []),)
+
     emb = PromptEmbeds(
         prompt_embeds=None,
         prompt_neg_embeds=None,
@@ -433,13 +567,17 @@ def enable_long_prompt(
     match engine.long_prompt_technique:
         case LongPromptTechnique.COMPEL:
             if engine.checkpoint_model.model_base == AIModelBase.SDXL:
-                compel = CompelForSDXL(pipe)
+                compel = cache.compel("sdxl", lambda: CompelForSDXL(pipe))
 
-                prompt_embeds, pooled_prompt_embeds = build_long_prompt_embeds_for_sdxl(
-                    pipe, compel, prompt
-                )
-                prompt_neg_embeds, negative_pooled_prompt_embeds = (
-                    build_long_prompt_embeds_for_sdxl(pipe, compel, negative_prompt)
+                def encode_sdxl(text: str):
+                    return cache.get_or_encode(
+                        (engine_key, "compel-sdxl", text_hash(text)),
+                        lambda: build_long_prompt_embeds_for_sdxl(pipe, compel, text),
+                    )
+
+                prompt_embeds, pooled_prompt_embeds = encode_sdxl(prompt)
+                prompt_neg_embeds, negative_pooled_prompt_embeds = encode_sdxl(
+                    negative_prompt
                 )
 
                 emb.prompt_embeds = prompt_embeds
@@ -448,31 +586,53 @@ def enable_long_prompt(
                 emb.negative_pooled_prompt_embeds = negative_pooled_prompt_embeds  # pyright: ignore[reportAttributeAccessIssue]
 
             if engine.checkpoint_model.model_base == AIModelBase.SD:
-                compel = Compel(
-                    tokenizer=pipe.tokenizer, text_encoder=pipe.text_encoder
+                compel = cache.compel(
+                    "sd",
+                    lambda: Compel(
+                        tokenizer=pipe.tokenizer, text_encoder=pipe.text_encoder
+                    ),
                 )
-                prompt_embeds = compel.build_conditioning_tensor(prompt)
-                prompt_neg_embeds = compel.build_conditioning_tensor(negative_prompt)
-                emb.prompt_embeds = prompt_embeds  # pyright: ignore[reportAttributeAccessIssue]
-                emb.prompt_neg_embeds = prompt_neg_embeds  # pyright: ignore[reportAttributeAccessIssue]
+
+                def encode_sd(text: str):
+                    return cache.get_or_encode(
+                        (engine_key, "compel-sd", text_hash(text)),
+                        lambda: compel.build_conditioning_tensor(text),
+                    )
+
+                emb.prompt_embeds = encode_sd(prompt)  # pyright: ignore[reportAttributeAccessIssue]
+                emb.prompt_neg_embeds = encode_sd(negative_prompt)  # pyright: ignore[reportAttributeAccessIssue]
 
         case LongPromptTechnique.SDEMBED:
+            # sd_embed pads the prompt and the negative prompt to each other,
+            # so they are cached as a pair
+            pair_key = (
+                engine_key,
+                "sdembed",
+                text_hash(prompt),
+                text_hash(negative_prompt),
+            )
             if engine.checkpoint_model.model_base == AIModelBase.SDXL:
                 (
                     emb.prompt_embeds,
                     emb.prompt_neg_embeds,
                     emb.pooled_prompt_embeds,
                     emb.negative_pooled_prompt_embeds,
-                ) = get_weighted_text_embeddings_sdxl(
-                    pipe, prompt=prompt, neg_prompt=negative_prompt
+                ) = cache.get_or_encode(
+                    pair_key,
+                    lambda: get_weighted_text_embeddings_sdxl(
+                        pipe, prompt=prompt, neg_prompt=negative_prompt
+                    ),
                 )
 
             if engine.checkpoint_model.model_base == AIModelBase.SD:
                 (
                     emb.prompt_embeds,
                     emb.prompt_neg_embeds,
-                ) = get_weighted_text_embeddings_sd15(
-                    pipe, prompt=prompt, neg_prompt=negative_prompt
+                ) = cache.get_or_encode(
+                    pair_key,
+                    lambda: get_weighted_text_embeddings_sd15(
+                        pipe, prompt=prompt, neg_prompt=negative_prompt
+                    ),
                 )
 
     return emb
@@ -498,40 +658,137 @@ def set_ip_adapter_scale(pipe, job: JobSchema):
     pipe.set_ip_adapter_scale(config["scale"])
 
 
-def unload_ip_adapter(pipe, job: JobSchema):
-    if job.ip_adapter_config is None:
-        return
+def on_step_end(
+    should_stop: Callable[[], bool] | None,
+    on_step: Callable[[int, int], None] | None,
+):
+    """
+    Step callback that stops the denoising loop of the pipe once should_stop
+    returns True, and tells on_step the steps done and the steps in total.
+    """
 
-    pipe.unload_ip_adapter()
+    def callback(pipe, step: int, timestep, callback_kwargs: dict[str, Any]):  # pyright: ignore[reportMissingParameterType]
+        if should_stop is not None and should_stop():
+            pipe._interrupt = True
+        if on_step is not None:
+            on_step(step + 1, pipe.num_timesteps)
+        return callback_kwargs
 
+    return callback
 
-def run_pipe(pipe, engine: EngineSchema, img_sch: ImageSchema, ip_adapter_image=None):  # pyright: ignore[reportMissingParameterType,reportUnknownParameterType]
-    seed = img_sch.seed or engine.seed
-    guidance_scale = img_sch.guidance_scale or engine.guidance_scale
-    num_inference_steps = img_sch.steps or engine.steps
-    control_guidance_start = (
-        img_sch.control_guidance_start or engine.control_guidance_start
-    )
-    control_guidance_end = img_sch.control_guidance_end or engine.control_guidance_end
-    height = img_sch.height or engine.height
-    width = img_sch.width or engine.width
 
-    prompt = img_sch.prompt
-    negative_prompt = img_sch.negative_prompt
-    kwargs = {}
+def batch_key(engine: EngineSchema, img_sch: ImageSchema) -> tuple[Any, ...]:
+    """Images with the same key can be denoised together in one pipe call."""
+    control_layout = tuple(
+        (
+            ci.aimodel.id if ci.aimodel is not None else None,
+            ci.controlnet_conditioning_scale,
+        )
+        for ci in img_sch.control_images
+    )
+    return (
+        img_sch.width or engine.width,
+        img_sch.height or engine.height,
+        img_sch.steps or engine.steps,
+        img_sch.guidance_scale or engine.guidance_scale,
+        img_sch.control_guidance_start or engine.control_guidance_start,
+        img_sch.control_guidance_end or engine.control_guidance_end,
+        control_layout,
+    )
 
-    if ip_adapter_image is not None:
-        kwargs["ip_adapter_image"] = ip_adapter_image
 
-    if len(img_sch.control_images) > 0:
-        conditioning_images, controlnet_conditioning_scale = prepare_pose_images(
-            engine, img_sch
+def _stack_prompt_embeds(embeds: list[PromptEmbeds]) -> PromptEmbeds | None:
+    """Concatenates the embeddings along the batch, None when their shapes differ."""
+
+    def stack(tensors: list[torch.Tensor | None]) -> torch.Tensor | None:
+        if any(t is None for t in tensors):
+            return None
+        if len({t.shape for t in tensors}) > 1:  # pyright: ignore[reportOptionalMemberAccess]
+            raise ValueError("embeddings of different shapes")
+        return torch.cat(tensors, dim=0)  # pyright: ignore[reportArgumentType]
+
+    try:
+        return PromptEmbeds(
+            prompt_embeds=stack([e.prompt_embeds for e in embeds]),
+            prompt_neg_embeds=stack([e.prompt_neg_embeds for e in embeds]),
+            pooled_prompt_embeds=stack([e.pooled_prompt_embeds for e in embeds]),
+            negative_pooled_prompt_embeds=stack(
+                [e.negative_pooled_prompt_embeds for e in embeds]
+            ),
         )
+    except ValueError:
+        return None
+
+
+@dataclass
+class PreparedBatch:
+    """The arguments of a pipe call that can be built before the GPU is free."""
+
+    img_schs: list[ImageSchema]
+    kwargs: dict[str, Any]
+
+
+def prepare_batch(
+    pipe,  # pyright: ignore[reportMissingParameterType]
+    engine: EngineSchema,
+    img_schs: list[ImageSchema],
+    prompt_cache: PromptEmbedsCache | None = None,
+    loras: list[LoraAndWeight] | None = None,
+) -> list[PreparedBatch]:
+    """
+    Builds the conditioning images and the prompt embeddings of the images.
+    Usually one batch, one per image when their long prompts can't be stacked.
+    The job's LoRAs must be active on the pipe already.
+    """
+    first = img_schs[0]
+    guidance_scale = first.guidance_scale or engine.guidance_scale
+    num_inference_steps = first.steps or engine.steps
+    control_guidance_start = first.control_guidance_start or engine.control_guidance_start
+    control_guidance_end = first.control_guidance_end or engine.control_guidance_end
+    height = first.height or engine.height
+    width = first.width or engine.width
+
+    prompts = [img.prompt for img in img_schs]
+    negative_prompts = [img.negative_prompt for img in img_schs]
+    kwargs = {}
 
-        if len(conditioning_images) == 1:
-            kwargs["image"] = conditioning_images[0]
+    prompt_embeddings = None
+    if engine.long_prompt_technique is not None:
+        prompt_embeddings = _stack_prompt_embeds(
+            [
+                enable_long_prompt(
+                    pipe, prompt, negative_prompt, engine, prompt_cache, loras
+                )
+                for prompt, negative_prompt in zip(prompts, negative_prompts)
+            ]
+        )
+        if prompt_embeddings is None and len(img_schs) > 1:
+            # long prompts split into different numbers of chunks
+            return [
+                batch
+                for img_sch in img_schs
+                for batch in prepare_batch(
+                    pipe, engine, [img_sch], prompt_cache, loras
+                )
+            ]
+
+    if len(first.control_images) > 0:
+        per_image = [prepare_pose_images(engine, img) for img in img_schs]
+        # the layout is the same for every image of the batch
+        controlnet_conditioning_scale = per_image[0][1]
+
+        if len(img_schs) == 1:
+            conditioning_images = per_image[0][0]
+            if len(conditioning_images) == 1:
+                kwargs["image"] = conditioning_images[0]
+            else:
+                kwargs["image"] = conditioning_images
+        elif len(controlnet_conditioning_scale) == 1:
+            # one image per sample
+            kwargs["image"] = [images[0] for images, _ in per_image]
         else:
-            kwargs["image"] = conditioning_images
+            # one list of images per sample, one image per controlnet
+            kwargs["image"] = [images for images, _ in per_image]
 
         if len(controlnet_conditioning_scale) == 1:
             kwargs["controlnet_conditioning_scale"] = controlnet_conditioning_scale[0]
@@ -541,9 +798,7 @@ def run_pipe(pipe, engine: EngineSchema, img_sch: ImageSchema, ip_adapter_image=
         kwargs["control_guidance_start"] = control_guidance_start
         kwargs["control_guidance_end"] = control_guidance_end
 
-    if engine.long_prompt_technique is not None:
-        prompt_embeddings = enable_long_prompt(pipe, prompt, negative_prompt, engine)
-
+    if prompt_embeddings is not None:
         kwargs["prompt_embeds"] = prompt_embeddings.prompt_embeds
         kwargs["prompt_neg_embeds"] = prompt_embeddings.prompt_neg_embeds
         if prompt_embeddings.pooled_prompt_embeds is not None:
@@ -554,17 +809,52 @@ def run_pipe(pipe, engine: EngineSchema, img_sch: ImageSchema, ip_adapter_image=
                 prompt_embeddings.negative_pooled_prompt_embeds
             )
 
+    elif len(img_schs) == 1:
+        kwargs["prompt"] = prompts[0]
+        kwargs["negative_prompt"] = negative_prompts[0]
     else:
-        kwargs["prompt"] = prompt
-        kwargs["negative_prompt"] = negative_prompt
+        kwargs["prompt"] = prompts
+        kwargs["negative_prompt"] = negative_prompts
 
-    generator = torch.Generator(device="cuda").manual_seed(seed)
-    kwargs["generator"] = generator
     kwargs["height"] = height
     kwargs["width"] = width
     kwargs["guidance_scale"] = guidance_scale
     kwargs["num_inference_steps"] = num_inference_steps
-
-    image = pipe(**kwargs).images[0]
-    print(f"saved image to {img_sch.file_path}")
-    image.save(img_sch.file_path)
+    return [PreparedBatch(img_schs=img_schs, kwargs=kwargs)]
+
+
+def denoise_batch(
+    pipe,  # pyright: ignore[reportMissingParameterType]
+    engine: EngineSchema,
+    prepared: PreparedBatch,
+    ip_adapter_image=None,  # pyright: ignore[reportMissingParameterType]
+    should_stop: Callable[[], bool] | None = None,
+    ip_adapter_image_embeds: list[torch.Tensor] | None = None,
+    on_step: Callable[[int, int], None] | None = None,
+) -> list[Image.Image] | None:
+    """Runs the pipe on a prepared batch, returns None when should_stop interrupted it."""
+    kwargs = dict(prepared.kwargs)
+    if ip_adapter_image is not None:
+        kwargs["ip_adapter_image"] = ip_adapter_image
+    if ip_adapter_image_embeds is not None:
+        kwargs["ip_adapter_image_embeds"] = ip_adapter_image_embeds
+
+    # one generator per sample, so every image gets the latents of its own seed
+    generators = [
+        # with CPU offload the pipe's modules sit on the CPU between uses
+        torch.Generator(device=pipe._execution_device).manual_seed(
+            img.seed or engine.seed
+        )
+        for img in prepared.img_schs
+    ]
+    kwargs["generator"] = generators[0] if len(generators) == 1 else generators
+    if should_stop is not None or on_step is not None:
+        kwargs["callback_on_step_end"] = on_step_end(should_stop, on_step)
+
+    images = pipe(**kwargs).images
+    if should_stop is not None and should_stop():
+        print(
+            f"interrupted {len(prepared.img_schs)} images of job {prepared.img_schs[0].job_id}"
+        )
+        return None
+    return images
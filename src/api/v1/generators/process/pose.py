@@ -1,6 +1,11 @@
 # Copyright © 2025-2026 Emmanouil Ragiadakos
 # SPDX-License-Identifier: MIT
 
+import importlib.metadata
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Iterator
+
 import cv2
 import mediapipe as mp
 import numpy as np  # For blank image creation
@@ -13,9 +18,146 @@ from src.api.v1.engines.schemas import EngineSchema
 from src.api.v1.images.schemas import ControlNetImageSchema, ImageSchema
 from src.core.enums import ControlNetType
 
+from .conditioning_cache import ConditioningCache, conditioning_key, file_hash
+
+# Detectors are loaded once per process and reused by every control image.
+# Each one has its own lock, MediaPipe's graph can't run two images at once.
+_detectors: dict[ControlNetType, Any] = {}
+_detector_locks: dict[ControlNetType, Lock] = {t: Lock() for t in ControlNetType}
+_registry_lock = Lock()
+_detector_device: str | None = None
+
+# bump when the preprocessing below changes, cached conditioning images
+# of older versions are not used anymore
+_CONDITIONING_VERSION = 1
+_conditioning_cache: ConditioningCache | None = None
+
+
+def _controlnet_aux_version() -> str:
+    try:
+        return importlib.metadata.version("controlnet_aux")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _load_detector(cn_type: ControlNetType) -> Any:
+    detector = None
+    match cn_type:
+        case ControlNetType.OPENPOSE:
+            detector = OpenposeDetector.from_pretrained("lllyasviel/Annotators")
+        case ControlNetType.MIDAS:
+            detector = MidasDetector.from_pretrained("lllyasviel/Annotators")
+        case ControlNetType.CANNY:
+            detector = CannyDetector()
+        case ControlNetType.MEDIAPIPE:
+            detector = mp.solutions.pose.Pose(  # pyright: ignore[reportAttributeAccessIssue]
+                static_image_mode=True,  # For single images
+                model_complexity=2,  # Higher accuracy for complex poses like crossed legs
+                enable_segmentation=False,
+                min_detection_confidence=0.5,
+            )
+
+    if _detector_device is not None and hasattr(detector, "to"):
+        detector = detector.to(_detector_device)  # pyright: ignore[reportOptionalMemberAccess]
+    return detector
+
+
+@contextmanager
+def use_detector(cn_type: ControlNetType) -> Iterator[Any]:
+    """Holds the detector of the type, loading it on first use."""
+    with _detector_locks[cn_type]:
+        with _registry_lock:
+            detector = _detectors.get(cn_type)
+        if detector is None:
+            print(f"loading the {cn_type} detector")
+            detector = _load_detector(cn_type)
+            with _registry_lock:
+                _detectors[cn_type] = detector
+        yield detector
+
+
+def warm_up_detectors(engine: EngineSchema, device: str | None = None):
+    """Loads the detectors of the engine's ControlNets, on the device when one is given."""
+    global _detector_device
+    _detector_device = device
+    for model in engine.control_net_models:
+        if model.control_net_type is None:
+            continue
+        with use_detector(model.control_net_type):
+            pass
+
+
+def set_conditioning_cache(cache: ConditioningCache | None):
+    global _conditioning_cache
+    _conditioning_cache = cache
+
+
+def _detector_params(
+    cn_type: ControlNetType, ci: ControlNetImageSchema
+) -> dict[str, Any]:
+    """Everything that changes the output of the detector for the same reference image."""
+    params: dict[str, Any] = {
+        "version": _CONDITIONING_VERSION,
+        "controlnet_aux": _controlnet_aux_version(),
+    }
+    match cn_type:
+        case ControlNetType.OPENPOSE:
+            params["include_hand"] = True
+            params["include_face"] = True
+        case ControlNetType.MIDAS:
+            params["contrast"] = [0.2, 0.6]
+        case ControlNetType.MEDIAPIPE:
+            params["mediapipe"] = mp.__version__
+            params["model_complexity"] = 2
+        case ControlNetType.CANNY:
+            params["low_threshold"] = ci.canny_low_threshold
+            params["high_threshold"] = ci.canny_high_threshold
+    return params
+
+
+def _detect(
+    cn_type: ControlNetType,
+    reference_pose_image: Image.Image,
+    ci: ControlNetImageSchema,
+) -> Image.Image:
+    match cn_type:
+        case ControlNetType.OPENPOSE:
+            with use_detector(ControlNetType.OPENPOSE) as openpose:
+                return openpose(
+                    reference_pose_image, include_hand=True, include_face=True
+                )
+        case ControlNetType.MIDAS:
+            with use_detector(ControlNetType.MIDAS) as midas:
+                depth_image = midas(reference_pose_image)
+
+            # Convert to numpy for processing
+            depth_array = (
+                np.array(depth_image).astype(np.float32) / 255.0
+            )  # Normalize to [0,1]
+
+            # Optional: Invert if needed (test visually)
+            # depth_array = 1.0 - depth_array
+
+            # Enhance contrast for better hand distinction (optional, adjust params)
+            depth_array = np.clip((depth_array - 0.2) / 0.6, 0, 1)  # Stretch contrast
+
+            # Back to PIL for ControlNet
+            return Image.fromarray((depth_array * 255).astype(np.uint8))
+        case ControlNetType.MEDIAPIPE:
+            return get_mediapipe_pose(ci.image_file_path)
+        case ControlNetType.CANNY:
+            assert ci.canny_low_threshold is not None
+            assert ci.canny_high_threshold is not None
+            input_image = Image.open(ci.image_file_path).convert("RGB")
+            with use_detector(ControlNetType.CANNY) as canny_detector:
+                return canny_detector(
+                    input_image,
+                    low_threshold=ci.canny_low_threshold,
+                    high_threshold=ci.canny_high_threshold,
+                )
+
 
 def poses_from_reference_image(engine: EngineSchema, ci: ControlNetImageSchema):
-    reference_pose_image = load_image(ci.image_file_path)
     controlnet_conditioning_scales = []
     conditioning_images = []
     scale = engine.controlnet_conditioning_scale
@@ -23,65 +165,34 @@ def poses_from_reference_image(engine: EngineSchema, ci: ControlNetImageSchema):
         scale = ci.controlnet_conditioning_scale
 
     assert scale is not None
+    cache = _conditioning_cache
+    image_hash = file_hash(ci.image_file_path) if cache is not None else None
+    # only loaded when a detector has to run
+    reference_pose_image = None
     for pose_model in engine.control_net_models:
-        if pose_model.control_net_type is None:
+        cn_type = pose_model.control_net_type
+        if cn_type is None:
             raise TSTError(
                 "no-contron-net-type-in-model",
                 f"control net type of aimodel with ID {pose_model.id} is empty",
             )
 
-        match pose_model.control_net_type:
-            case ControlNetType.OPENPOSE:
-                openpose = OpenposeDetector.from_pretrained("lllyasviel/Annotators")
-                pose_image = openpose(
-                    reference_pose_image, include_hand=True, include_face=True
-                )
-                _ = pose_image.save(ci.image_file_path + "_openpose.png")
-                conditioning_images.append(pose_image)
-                controlnet_conditioning_scales.append(scale)
-            case ControlNetType.MIDAS:
-                midas = MidasDetector.from_pretrained("lllyasviel/Annotators")
-                depth_image = midas(reference_pose_image)
+        key = None
+        pose_image = None
+        if cache is not None:
+            assert image_hash is not None
+            key = conditioning_key(image_hash, cn_type, _detector_params(cn_type, ci))
+            pose_image = cache.get(key)
 
-                # Convert to numpy for processing
-                depth_array = (
-                    np.array(depth_image).astype(np.float32) / 255.0
-                )  # Normalize to [0,1]
-
-                # Optional: Invert if needed (test visually)
-                # depth_array = 1.0 - depth_array
-
-                # Enhance contrast for better hand distinction (optional, adjust params)
-                depth_array = np.clip(
-                    (depth_array - 0.2) / 0.6, 0, 1
-                )  # Stretch contrast
-
-                # Back to PIL for ControlNet
-                processed_depth = Image.fromarray((depth_array * 255).astype(np.uint8))
-                _ = processed_depth.save(ci.image_file_path + "_midas.png")  # pyright: ignore[reportAttributeAccessIssue]
-
-                conditioning_images.append(processed_depth)
-                controlnet_conditioning_scales.append(scale)
-
-            case ControlNetType.MEDIAPIPE:
-                pose_image = get_mediapipe_pose(ci.image_file_path)
-                _ = pose_image.save(ci.image_file_path + "_mediapipe.png")
-                conditioning_images.append(pose_image)
-                controlnet_conditioning_scales.append(scale)
-            case ControlNetType.CANNY:
-                canny_detector = CannyDetector()
-                assert ci.canny_low_threshold is not None
-                assert ci.canny_high_threshold is not None
-                input_image = Image.open(ci.image_file_path).convert("RGB")
-                pose_image = canny_detector(
-                    input_image,
-                    low_threshold=ci.canny_low_threshold,
-                    high_threshold=ci.canny_high_threshold,
-                )
-                _ = pose_image.save(ci.image_file_path + "_canny.png")
+        if pose_image is None:
+            if reference_pose_image is None:
+                reference_pose_image = load_image(ci.image_file_path)
+            pose_image = _detect(cn_type, reference_pose_image, ci)
+            if cache is not None and key is not None:
+                cache.put(key, pose_image)
 
-                conditioning_images.append(pose_image)
-                controlnet_conditioning_scales.append(scale)
+        conditioning_images.append(pose_image)
+        controlnet_conditioning_scales.append(scale)
 
     return conditioning_images, controlnet_conditioning_scales
 
@@ -109,12 +220,6 @@ def get_mediapipe_pose(reference_image_path: str):
     mp_pose = mp.solutions.pose  # pyright: ignore[reportAttributeAccessIssue]
     mp_drawing = mp.solutions.drawing_utils  # pyright: ignore[reportAttributeAccessIssue]
     mp_drawing_styles = mp.solutions.drawing_styles  # pyright: ignore[reportAttributeAccessIssue]
-    pose_detector = mp_pose.Pose(
-        static_image_mode=True,  # For single images
-        model_complexity=2,  # Higher accuracy for complex poses like crossed legs
-        enable_segmentation=False,
-        min_detection_confidence=0.5,
-    )
 
     # Load reference image
     reference_pose_image = load_image(reference_image_path).convert("RGB")
@@ -122,7 +227,10 @@ def get_mediapipe_pose(reference_image_path: str):
     reference_pose_cv = cv2.cvtColor(reference_pose_cv, cv2.COLOR_RGB2BGR)
 
     # Detect pose
-    results = pose_detector.process(cv2.cvtColor(reference_pose_cv, cv2.COLOR_BGR2RGB))
+    with use_detector(ControlNetType.MEDIAPIPE) as pose_detector:
+        results = pose_detector.process(
+            cv2.cvtColor(reference_pose_cv, cv2.COLOR_BGR2RGB)
+        )
 
     # Create blank black canvas for skeleton
     height, width, _ = reference_pose_cv.shape
@@ -0,0 +1,108 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+import torch
+
+from src.api.v1.engines.schemas import EngineSchema
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def engine_text_key(engine: EngineSchema) -> tuple[Any, ...]:
+    """Everything of the engine that changes how a text gets encoded."""
+    return (
+        engine.id,
+        engine.checkpoint_model.id,
+        engine.long_prompt_technique,
+        engine.clip_skip,
+        tuple(sorted(m.id or 0 for m in engine.embedding_models)),
+        tuple((lw.aimodel.id, lw.weight) for lw in engine.lora_models),
+    )
+
+
+def _tensors_size(value: Any) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensors_size(v) for v in value)
+    return 0
+
+
+class PromptEmbedsCache:
+    """
+    LRU cache of encoded prompts of a generator process, bounded by the
+    bytes of the tensors it holds. It also keeps the Compel instances,
+    they are built once per pipe instead of once per image.
+
+    The prefetch thread of the generator encodes through it too, so the
+    bookkeeping is locked, but the encoding itself runs outside the lock.
+    """
+
+    _entries: OrderedDict[Hashable, Any]
+    _sizes: dict[Hashable, int]
+    _max_bytes: int
+    _compels: dict[str, Any]
+    _lock: Lock
+    size_bytes: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int):
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._max_bytes = max_bytes
+        self._compels = {}
+        self._lock = Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, key: Hashable, encode: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        value = encode()
+        size = _tensors_size(value)
+        if size > self._max_bytes:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                return value
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.size_bytes += size
+            while self.size_bytes > self._max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self.size_bytes -= self._sizes.pop(old_key)
+        return value
+
+    def compel(self, name: str, create: Callable[[], Any]) -> Any:
+        with self._lock:
+            if name not in self._compels:
+                self._compels[name] = create()
+            return self._compels[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._compels.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> str:
+        return (
+            f"prompt cache: {self.hits} hits, {self.misses} misses, "
+            f"{len(self._entries)} entries, {self.size_bytes / 1024**2:.1f} MB"
+        )
@@ -0,0 +1,51 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from .device import peak_memory_bytes, peak_rss_bytes, reset_peak_memory
+from .types import GeneratorStartup, StartupPhase
+
+
+class StartupTimer:
+    """
+    Records the wall time, the peak RSS of the process and the peak device
+    memory of each phase of a generator's startup. The peak RSS never goes
+    down, so besides the running peak each phase reports how much it raised
+    it: the memory the phase needed beyond any phase before it.
+    """
+
+    _started: float
+    _device: str
+    phases: list[StartupPhase]
+
+    def __init__(self, device: str):
+        self._started = time.perf_counter()
+        self._device = device
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        reset_peak_memory(self._device)
+        rss_before = peak_rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            rss_after = peak_rss_bytes()
+            self.phases.append(
+                StartupPhase(
+                    name=name,
+                    seconds=time.perf_counter() - started,
+                    peak_rss_bytes=rss_after,
+                    peak_device_bytes=peak_memory_bytes(self._device),
+                    peak_rss_growth_bytes=rss_after - rss_before,
+                )
+            )
+
+    def report(self) -> GeneratorStartup:
+        return GeneratorStartup(
+            seconds=time.perf_counter() - self._started, phases=list(self.phases)
+        )
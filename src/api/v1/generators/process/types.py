@@ -9,13 +9,57 @@ from typing import Any
 from pytsterrors import TSTError
 
 from src.api.v1.jobs.schemas import JobSchema
-from src.core.enums import GeneratorCommandType, GeneratorEventType
+from src.core.enums import (
+    Device,
+    GeneratorCommandType,
+    GeneratorEventType,
+    MemoryMode,
+)
+
+
+@dataclass
+class GeneratorOptions:
+    # None disables the heartbeat
+    heartbeat_interval: float | None = None
+    # least seconds between IMAGE_PROGRESS events, None sends none
+    progress_interval: float | None = None
+    # seconds to wait for more jobs to batch together
+    batch_window: float = 0.0
+    # jobs that are batched together at most
+    max_jobs: int = 1
+    # threads that prepare the next batch and that save finished images
+    prefetch_workers: int = 1
+    writer_workers: int = 2
+    # bytes of encoded prompts the generator keeps
+    prompt_cache_bytes: int = 256 * 1024**2
+    # None keeps preprocessed ControlNet images only in memory
+    conditioning_path: str | None = None
+    conditioning_memory_bytes: int = 256 * 1024**2
+    conditioning_disk_bytes: int = 2048 * 1024**2
+    # LoRA files of jobs kept in memory and adapters kept in the pipe
+    lora_memory_bytes: int = 2048 * 1024**2
+    loaded_loras: int = 8
+    # None loads single-file models by converting them on every start
+    checkpoint_cache_path: str | None = None
+    # None keeps torch.compile's cache in the temporary directory
+    compile_cache_path: str | None = None
+    # None is auto, the generator's GPU when there is one and the CPU otherwise
+    device: Device | None = None
+    # intra-op threads of the process, None leaves torch's default
+    threads: int | None = None
+    # None keeps the whole pipe on the device
+    memory_mode: MemoryMode | None = None
+    # device memory the generator may use, None is unlimited
+    memory_budget_bytes: int | None = None
+    # megapixels times batch size that fit in the budget, None is the engine's batch
+    max_batch_megapixels: float | None = None
 
 
 @dataclass
 class GeneratorCommand:
     command: GeneratorCommandType
-    value: JobSchema | None
+    # the job for JOB, the ID of the job to cancel for CANCEL
+    value: JobSchema | int | None
 
 
 @dataclass
@@ -23,10 +67,61 @@ class JobFinished:
     job_id: int
 
 
+@dataclass
+class JobCancelled:
+    job_id: int
+
+
+@dataclass
+class JobFailed:
+    job_id: int
+    reason: str
+
+
 @dataclass
 class ImageFinished:
     job_id: int
     image_id: int
+    # wall time the generator spent on the image
+    seconds: float | None = None
+    # peak device memory of the image's batch, peak RSS of the process on the CPU
+    peak_memory_bytes: int | None = None
+    # images denoised together with it
+    batch_size: int | None = None
+
+
+@dataclass
+class ImageProgress:
+    # the images of the batch, they can belong to different jobs
+    job_ids: list[int]
+    image_ids: list[int]
+    step: int
+    total_steps: int
+    # since the batch started denoising
+    elapsed_seconds: float
+    eta_seconds: float
+
+
+@dataclass
+class StartupPhase:
+    name: str
+    seconds: float
+    # running peak of the whole process up to the end of the phase,
+    # it includes every phase before
+    peak_rss_bytes: int
+    # peak during the phase, None without a GPU
+    peak_device_bytes: int | None = None
+    # how much the phase raised the running peak RSS
+    peak_rss_growth_bytes: int = 0
+
+
+@dataclass
+class GeneratorStartup:
+    # from the start of the process until READY
+    seconds: float
+    phases: list[StartupPhase]
+    # the mode the pipe runs in, chosen by the generator for auto
+    memory_mode: MemoryMode | None = None
 
 
 @dataclass
@@ -34,7 +129,16 @@ class GeneratorEvent:
     generator_name: str
     generator_id: int
     event: GeneratorEventType
-    value: JobFinished | ImageFinished | TSTError | None
+    value: (
+        JobFinished
+        | JobCancelled
+        | JobFailed
+        | ImageFinished
+        | ImageProgress
+        | GeneratorStartup
+        | TSTError
+        | None
+    )
 
 
 # Custom JSON encoder to handle Enums
@@ -73,12 +177,30 @@ def json_to_generator_event(json_str: str) -> GeneratorEvent:
     if event == GeneratorEventType.JOB_FINISHED:
         if value_data is not None:
             value = JobFinished(**value_data)
+    elif event == GeneratorEventType.JOB_CANCELLED:
+        if value_data is not None:
+            value = JobCancelled(**value_data)
+    elif event == GeneratorEventType.JOB_FAILED:
+        if value_data is not None:
+            value = JobFailed(**value_data)
     elif event == GeneratorEventType.IMAGE_FINISHED:
         if value_data is not None:
             value = ImageFinished(**value_data)
+    elif event == GeneratorEventType.IMAGE_PROGRESS:
+        if value_data is not None:
+            value = ImageProgress(**value_data)
     elif event == GeneratorEventType.ERROR:
         if value_data is not None:
             value = TSTError(**value_data)
+    elif event == GeneratorEventType.READY:
+        if value_data is not None:
+            value = GeneratorStartup(
+                seconds=value_data["seconds"],
+                phases=[StartupPhase(**p) for p in value_data["phases"]],
+                memory_mode=MemoryMode(value_data["memory_mode"])
+                if value_data.get("memory_mode") is not None
+                else None,
+            )
     else:
         raise ValueError(f"Unhandled GeneratorEventType: {event}")
 
@@ -0,0 +1,145 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from src.api.v1.engines.schemas import EngineSchema
+from src.api.v1.images.schemas import EncodeSettings, ImageSchema
+from src.core.enums import FileImageType
+
+# EXIF tag of the image description, used for the metadata of JPG and WEBP
+_EXIF_IMAGE_DESCRIPTION = 0x010E
+
+
+def generation_metadata(engine: EngineSchema, img_sch: ImageSchema) -> str:
+    return json.dumps(
+        {
+            "prompt": img_sch.prompt,
+            "negative_prompt": img_sch.negative_prompt,
+            "seed": img_sch.seed or engine.seed,
+            "steps": img_sch.steps or engine.steps,
+            "guidance_scale": img_sch.guidance_scale or engine.guidance_scale,
+            "width": img_sch.width or engine.width,
+            "height": img_sch.height or engine.height,
+            "scheduler": engine.scheduler,
+            "engine": engine.name,
+            "checkpoint": engine.checkpoint_model.name,
+        }
+    )
+
+
+def save_options(
+    engine: EngineSchema, img_sch: ImageSchema, settings: EncodeSettings
+) -> tuple[str, dict[str, Any]]:
+    """The PIL format and save arguments of the image's file type."""
+    metadata = None
+    if settings.embed_metadata:
+        metadata = generation_metadata(engine, img_sch)
+
+    match img_sch.file_type:
+        case FileImageType.JPG:
+            kwargs: dict[str, Any] = {"quality": settings.quality}
+            fmt = "JPEG"
+        case FileImageType.WEBP:
+            if settings.webp_lossless:
+                kwargs = {"lossless": True}
+            else:
+                kwargs = {"quality": settings.quality}
+            fmt = "WEBP"
+        case _:
+            kwargs = {"compress_level": settings.png_compress_level}
+            if metadata is not None:
+                info = PngInfo()
+                info.add_text("parameters", metadata)
+                kwargs["pnginfo"] = info
+            return "PNG", kwargs
+
+    if metadata is not None:
+        exif = Image.Exif()
+        exif[_EXIF_IMAGE_DESCRIPTION] = metadata
+        kwargs["exif"] = exif
+    return fmt, kwargs
+
+
+def write_image(
+    engine: EngineSchema,
+    img_sch: ImageSchema,
+    image: Image.Image,
+    settings: EncodeSettings,
+):
+    """Encodes the image and makes it durable before it shows up under its path."""
+    fmt, kwargs = save_options(engine, img_sch, settings)
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    tmp = img_sch.file_path + ".tmp"
+    with open(tmp, "wb") as f:
+        image.save(f, format=fmt, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, img_sch.file_path)
+
+
+class ImageWriter:
+    """
+    Encodes and saves finished images on worker threads, so that writing an
+    image overlaps with denoising the next one. PIL releases the GIL while
+    it compresses, so the threads encode in parallel.
+    """
+
+    _pool: ThreadPoolExecutor
+    _engine: EngineSchema
+
+    def __init__(self, engine: EngineSchema, workers: int = 2):
+        self._engine = engine
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="image-writer"
+        )
+
+    def write(
+        self,
+        img_sch: ImageSchema,
+        image: Image.Image,
+        on_written: Callable[[ImageSchema], None],
+    ) -> Future[None]:
+        """Saves the image in the background and calls on_written once it is on disk."""
+        settings = (
+            img_sch.encode_settings or self._engine.encode_settings or EncodeSettings()
+        )
+
+        def task():
+            write_image(self._engine, img_sch, image, settings)
+            print(f"saved image to {img_sch.file_path}")
+            on_written(img_sch)
+
+        return self._pool.submit(task)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+def when_all(futures: list[Future[None]], callback: Callable[[], None]):
+    """Calls callback once every future is done, right away when there are none."""
+    if len(futures) == 0:
+        callback()
+        return
+
+    lock = Lock()
+    remaining = [len(futures)]
+
+    def done(_: Future[None]):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for f in futures:
+        f.add_done_callback(done)
@@ -10,7 +10,7 @@ from src.api.v1.engines.repositories import serialize_engine
 from src.core.enums import GeneratorStatus
 from src.db.models import Engine, Generator
 
-from .schemas import GeneratorSchema
+from .schemas import GeneratorSchema, GeneratorStartupSchema
 
 
 class GeneratorRepo:
@@ -20,6 +20,9 @@ class GeneratorRepo:
             status=input.status,
             name=input.name,
             gpu_id=input.gpu_id,
+            device=input.device,
+            threads=input.threads,
+            memory_mode=input.memory_mode,
         )
         input.id = g.id
         return input
@@ -49,6 +52,49 @@ class GeneratorRepo:
         await g.save()
         return await serialize_generator(g)
 
+    async def update_startup(
+        self, id: int, startup: GeneratorStartupSchema
+    ) -> GeneratorSchema:
+        g = await Generator.get_or_none(id=id)
+        if not g:
+            raise TSTError(
+                "generator-is-not-found",
+                f"Generator with ID {id} not found",
+                metadata={"status_code": 404},
+            )
+
+        g.startup = startup.model_dump()
+        # the peak belongs to the run that this startup began
+        g.peak_memory_bytes = None
+
+        await g.save()
+        return await serialize_generator(g)
+
+    async def update_peak_memory(
+        self, id: int, peak_memory_bytes: int
+    ) -> GeneratorSchema:
+        g = await Generator.get_or_none(id=id)
+        if not g:
+            raise TSTError(
+                "generator-is-not-found",
+                f"Generator with ID {id} not found",
+                metadata={"status_code": 404},
+            )
+
+        g.peak_memory_bytes = peak_memory_bytes
+
+        await g.save()
+        return await serialize_generator(g)
+
+    async def filter(self, *args: Q, **kwargs: Any) -> list[GeneratorSchema]:  # pyright: ignore[reportExplicitAny]
+        gls = await Generator.filter(*args, **kwargs)
+
+        gsls = []
+        for g in gls:
+            gsls.append(await serialize_generator(g))
+
+        return gsls
+
     async def get_all(self) -> list[GeneratorSchema]:
         gls = await Generator.all()
 
@@ -80,4 +126,17 @@ async def serialize_generator(g: Generator) -> GeneratorSchema:
             f"Generator with ID {id} has an engine with {g.engine_id} that is missing",
         )
     es = await serialize_engine(e)
-    return GeneratorSchema(id=g.id, name=g.name, status=g.status, engine=es)
+    return GeneratorSchema(
+        id=g.id,
+        name=g.name,
+        status=g.status,
+        gpu_id=g.gpu_id,
+        device=g.device,
+        threads=g.threads,
+        memory_mode=g.memory_mode,
+        engine=es,
+        startup=GeneratorStartupSchema.model_validate(g.startup)
+        if g.startup
+        else None,
+        peak_memory_bytes=g.peak_memory_bytes,
+    )
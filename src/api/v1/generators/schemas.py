@@ -4,7 +4,23 @@
 from pydantic import BaseModel, ConfigDict, Field
 
 from src.api.v1.engines.schemas import EngineSchema
-from src.core.enums import GeneratorStatus
+from src.core.enums import Device, GeneratorStatus, MemoryMode
+
+
+class StartupPhaseSchema(BaseModel):
+    name: str
+    seconds: float
+    # running peak of the process, up to the end of the phase
+    peak_rss_bytes: int
+    peak_device_bytes: int | None = None
+    # what the phase added to the running peak
+    peak_rss_growth_bytes: int = 0
+
+
+class GeneratorStartupSchema(BaseModel):
+    seconds: float
+    phases: list[StartupPhaseSchema]
+    memory_mode: MemoryMode | None = None
 
 
 class GeneratorSchema(BaseModel):
@@ -15,3 +31,13 @@ class GeneratorSchema(BaseModel):
     gpu_id: int = Field(default=0)
     engine: EngineSchema
     status: GeneratorStatus
+    # None uses the engine's device
+    device: Device | None = None
+    # intra-op threads of the generator, None splits the cores between CPU generators
+    threads: int | None = None
+    # None uses the engine's memory mode
+    memory_mode: MemoryMode | None = None
+    # the last start of the generator, None before its first READY
+    startup: GeneratorStartupSchema | None = None
+    # highest memory the generator needed for a job, None before its first image
+    peak_memory_bytes: int | None = None
@@ -41,6 +41,14 @@ class GeneratorService:
                 }
             )
 
+        if input.threads is not None and input.threads < 1:
+            res.append(
+                {
+                    "field": "threads",
+                    "error": "threads must be at least 1",
+                }
+            )
+
         ok = await self.engine_repo.exists(id=input.engine_id)
         if not ok:
             res.append(
@@ -67,6 +75,9 @@ class GeneratorService:
             engine=engine,
             status=GeneratorStatus.CLOSED,
             gpu_id=input.gpu_id,
+            device=input.device,
+            threads=input.threads,
+            memory_mode=input.memory_mode,
         )
         gs = await self.generator_repo.create(gs)
         return gs
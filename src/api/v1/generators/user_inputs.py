@@ -3,8 +3,16 @@
 
 from pydantic import BaseModel, Field
 
+from src.core.enums import Device, MemoryMode
+
 
 class GeneratorUserInput(BaseModel):
     name: str
     engine_id: int
     gpu_id: int = Field(default=0)
+    # None uses the engine's device
+    device: Device | None = None
+    # intra-op threads of the generator, None splits the cores between CPU generators
+    threads: int | None = None
+    # None uses the engine's memory mode
+    memory_mode: MemoryMode | None = None
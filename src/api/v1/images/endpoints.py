@@ -32,8 +32,10 @@ async def show_image(id: int, repo: FromDishka[ImageRepo]):
     media_type = ""
     match img.file_type:
         case FileImageType.PNG:
-            media_type = "images/png"
+            media_type = "image/png"
         case FileImageType.JPG:
-            media_type = "images/jpeg"
+            media_type = "image/jpeg"
+        case FileImageType.WEBP:
+            media_type = "image/webp"
 
     return FileResponse(img.file_path, media_type=media_type)
@@ -9,7 +9,7 @@ from tortoise.expressions import Q
 from src.api.v1.aimodels.schemas import AIModelSchema
 from src.db.models import AIModel, ControlNetImage, Image
 
-from .schemas import ControlNetImageSchema, ImageSchema
+from .schemas import ControlNetImageSchema, EncodeSettings, ImageSchema
 
 
 class ImageRepo:
@@ -78,6 +78,9 @@ async def serialize_image(img_db: Image, cni_dbs: list[ControlNetImage]) -> Imag
         file_type=img_db.file_type,
         control_guidance_start=img_db.control_guidance_start,
         control_guidance_end=img_db.control_guidance_end,
+        encode_settings=EncodeSettings.model_validate(img_db.encode_settings)
+        if img_db.encode_settings
+        else None,
     )
 
     list_cni_sch = []
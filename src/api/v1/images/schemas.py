@@ -7,6 +7,24 @@ from src.api.v1.aimodels.schemas import AIModelSchema
 from src.core.enums import FileImageType
 
 
+class EncodeSettings(BaseModel):
+    # zlib level of PNG, higher is smaller and slower
+    png_compress_level: int = 6
+    # quality of JPG and lossy WEBP
+    quality: int = 90
+    webp_lossless: bool = False
+    # writes the prompts, the seed and the rest of the parameters into the file
+    embed_metadata: bool = False
+
+    def errors(self) -> list[str]:
+        res = []
+        if not 0 <= self.png_compress_level <= 9:
+            res.append("png_compress_level must be between 0 and 9")
+        if not 1 <= self.quality <= 100:
+            res.append("quality must be between 1 and 100")
+        return res
+
+
 class ControlNetImageSchema(BaseModel):
     aimodel: AIModelSchema | None
     image_file_path: str
@@ -18,7 +36,7 @@ class ControlNetImageSchema(BaseModel):
 class ImageSchema(BaseModel):
     id: int | None
     job_id: int
-    generator_id: int
+    generator_id: int | None
     prompt: str
     negative_prompt: str
     ready: bool
@@ -33,3 +51,5 @@ class ImageSchema(BaseModel):
     file_type: FileImageType = Field(default=FileImageType.PNG)
     control_guidance_start: float | None = None
     control_guidance_end: float | None = None
+    # None uses the engine's settings
+    encode_settings: EncodeSettings | None = None
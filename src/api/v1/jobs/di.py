@@ -3,6 +3,8 @@
 
 from dishka import Provider, Scope, provide
 
+from src.api.v1.aimodels.repositories import AIModelRepo
+from src.api.v1.engines.repositories import EngineRepo
 from src.api.v1.generators.manager import GeneratorManager
 from src.api.v1.generators.repositories import GeneratorRepo
 from src.api.v1.images.repositories import ImageRepo
@@ -22,8 +24,12 @@ class JobServiceProvider(Provider):
     def provide_service(
         self,
         generator_repo: GeneratorRepo,
+        engine_repo: EngineRepo,
         job_repo: JobRepo,
         image_repo: ImageRepo,
         manager: GeneratorManager,
+        aimodel_repo: AIModelRepo,
     ) -> JobService:
-        return JobService(generator_repo, job_repo, image_repo, manager)
+        return JobService(
+            generator_repo, engine_repo, job_repo, image_repo, manager, aimodel_repo
+        )
@@ -8,7 +8,7 @@ from src.api.v1.jobs.services import JobService
 from src.core.config import Config
 
 from .repositories import JobRepo
-from .schemas import JobSchema
+from .schemas import JobPlanSchema, JobSchema
 from .user_inputs import JobUserInput
 
 router = APIRouter()
@@ -28,12 +28,26 @@ async def add_job(
     return await svc.create_job(config, payload)
 
 
+@router.post("/plan", response_model=JobPlanSchema)
+@inject
+async def plan_job(payload: JobUserInput, svc: FromDishka[JobService]):
+    return await svc.plan_job(payload)
+
+
 @router.get("/{id}", response_model=JobSchema)
 @inject
 async def get_job(id: int, repo: FromDishka[JobRepo]):
     return await repo.get_one(id)
 
 
+@router.patch(
+    "/{id}/cancel", response_model=JobSchema, status_code=status.HTTP_202_ACCEPTED
+)
+@inject
+async def cancel_job(id: int, svc: FromDishka[JobService]):
+    return await svc.cancel_job(id)
+
+
 @router.delete("/{id}", response_model=None, status_code=status.HTTP_204_NO_CONTENT)
 @inject
 async def delete_job(
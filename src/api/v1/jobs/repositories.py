@@ -9,6 +9,7 @@ from typing import Any
 from pytsterrors import TSTError
 from tortoise.expressions import Q
 
+from src.api.v1.engines.schemas import LoraAndWeight
 from src.api.v1.images.repositories import serialize_image
 from src.api.v1.images.schemas import ImageSchema
 from src.core.config import Config
@@ -95,10 +96,43 @@ class JobRepo:
 
         return serialize_job(job_db, img_sch_list)
 
-    async def create(self, config: Config, input: JobUserInput) -> JobSchema:
+    async def assign_generator(self, id: int, generator_id: int):
+        job_db = await Job.get_or_none(id=id)
+        if not job_db:
+            raise TSTError(
+                "job-is-not-found",
+                f"Job with ID {id} not found",
+                metadata={"status_code": 404},
+            )
+
+        job_db.generator_id = generator_id
+        await job_db.save()
+        _ = await Image.filter(job_id=id).update(generator_id=generator_id)
+
+    async def count_outstanding_images(self, tenant: str) -> int:
+        """Images of the tenant's waiting and processing jobs that are not ready yet."""
+        job_ids = await Job.filter(
+            tenant=tenant, status__in=[JobStatus.WAITING, JobStatus.PROCESSING]
+        ).values_list("id", flat=True)
+        if len(job_ids) == 0:
+            return 0
+        return await Image.filter(job_id__in=job_ids, ready=False).count()
+
+    async def create(
+        self,
+        config: Config,
+        input: JobUserInput,
+        loras: list[LoraAndWeight] | None = None,
+    ) -> JobSchema:
         job_db = await Job.create(
             generator_id=input.generator_id,
+            engine_id=input.engine_id,
+            priority=input.priority,
+            tenant=input.tenant,
             ip_adapter_config=input.ip_adapter_config,
+            lora_models=[lw.model_dump(mode="json") for lw in loras]
+            if loras
+            else None,
         )
         img_sch_list = []
         for img_input in input.images:
@@ -137,6 +171,9 @@ class JobRepo:
             if img_input.control_guidance_end:
                 kwargs["control_guidance_end"] = img_input.control_guidance_end
 
+            if img_input.encode_settings:
+                kwargs["encode_settings"] = img_input.encode_settings.model_dump()
+
             img_db = await Image.create(**kwargs)
 
             ci_dbs = []
@@ -201,7 +238,11 @@ def serialize_job(job_db: Job, img_sch_list: list[ImageSchema]) -> JobSchema:
     return JobSchema(
         id=job_db.id,
         generator_id=job_db.generator_id,
+        engine_id=job_db.engine_id,
+        priority=job_db.priority,
+        tenant=job_db.tenant,
         images=img_sch_list,
         status=job_db.status,
         ip_adapter_config=job_db.ip_adapter_config,
+        lora_models=[LoraAndWeight.model_validate(v) for v in job_db.lora_models or []],
     )
@@ -3,15 +3,50 @@
 
 from typing import Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from src.api.v1.engines.schemas import LoraAndWeight
 from src.api.v1.images.schemas import ImageSchema
 from src.core.enums import JobStatus
 
 
+class ImagePlanSchema(BaseModel):
+    width: int
+    height: int
+    steps: int
+    # images it would be denoised with
+    batch_size: int
+    seconds: float
+    peak_memory_bytes: int
+
+
+class JobPlanSchema(BaseModel):
+    engine_id: int
+    images: list[ImagePlanSchema]
+    # generator time of all the images
+    seconds: float
+    # until the engine's generators get through what is queued now
+    queue_seconds: float
+    # until the job would be finished, queue included
+    finish_seconds: float
+    # the highest of the images
+    peak_memory_bytes: int
+    # None when the device has no known limit
+    memory_capacity_bytes: int | None
+    fits: bool
+    # False while the estimates come from defaults instead of measured images
+    time_calibrated: bool
+    memory_calibrated: bool
+
+
 class JobSchema(BaseModel):
     id: int | None
-    generator_id: int
+    generator_id: int | None
+    engine_id: int | None = None
+    priority: int = 0
+    tenant: str = "default"
     images: list[ImageSchema]
     status: JobStatus
     ip_adapter_config: dict[str, Any] | None = None
+    # applied on top of the engine's LoRAs, without restarting the generator
+    lora_models: list[LoraAndWeight] = Field(default=[])
@@ -1,17 +1,27 @@
 # Copyright © 2025-2026 Emmanouil Ragiadakos
 # SPDX-License-Identifier: MIT
 
+import math
 import os
 
 from pytsterrors import TSTError
 
+from src.api.v1.aimodels.repositories import AIModelRepo
+from src.api.v1.engines.repositories import EngineRepo
+from src.api.v1.engines.schemas import EngineSchema, LoraAndWeight
+from src.api.v1.generators.backlog import image_cost
+from src.api.v1.generators.cost_model import (
+    batch_size_for,
+    cost_factor,
+    job_extra_bytes,
+)
 from src.api.v1.generators.manager import GeneratorManager
 from src.api.v1.generators.repositories import GeneratorRepo
 from src.api.v1.images.repositories import ImageRepo
-from src.api.v1.jobs.schemas import JobSchema
+from src.api.v1.jobs.schemas import ImagePlanSchema, JobPlanSchema, JobSchema
 from src.api.v1.jobs.user_inputs import JobUserInput
 from src.core.config import Config
-from src.core.enums import JobStatus
+from src.core.enums import AIModelType, JobStatus
 
 from .repositories import JobRepo
 
@@ -19,32 +29,82 @@ from .repositories import JobRepo
 class JobService:
     job_repo: JobRepo
     generator_repo: GeneratorRepo
+    engine_repo: EngineRepo
     manager: GeneratorManager
     image_repo: ImageRepo
+    aimodel_repo: AIModelRepo
 
     def __init__(
         self,
         generator_repo: GeneratorRepo,
+        engine_repo: EngineRepo,
         job_repo: JobRepo,
         image_repo: ImageRepo,
         manager: GeneratorManager,
+        aimodel_repo: AIModelRepo,
     ):
         self.job_repo = job_repo
+        self.aimodel_repo = aimodel_repo
         self.image_repo = image_repo
         self.generator_repo = generator_repo
+        self.engine_repo = engine_repo
         self.manager = manager
 
     async def _validate(self, input: JobUserInput) -> list[dict[str, str]]:
         res = []
-        ok = await self.generator_repo.exists(id=input.generator_id)
-        if not ok:
+        if (input.generator_id is None) == (input.engine_id is None):
             res.append(
                 {
                     "field": "generator_id",
-                    "error": f"generator with id {input.generator_id} doesn't exist",
+                    "error": "exactly one of generator_id and engine_id must be set",
                 }
             )
 
+        if input.generator_id is not None:
+            ok = await self.generator_repo.exists(id=input.generator_id)
+            if not ok:
+                res.append(
+                    {
+                        "field": "generator_id",
+                        "error": f"generator with id {input.generator_id} doesn't exist",
+                    }
+                )
+
+        if input.engine_id is not None:
+            ok = await self.engine_repo.exists(id=input.engine_id)
+            if not ok:
+                res.append(
+                    {
+                        "field": "engine_id",
+                        "error": f"engine with id {input.engine_id} doesn't exist",
+                    }
+                )
+
+        if input.tenant == "":
+            res.append(
+                {
+                    "field": "tenant",
+                    "error": "tenant can't be empty",
+                }
+            )
+
+        for lw in input.lora_model_ids:
+            id = lw.lora_model_id
+            ok = await self.aimodel_repo.exists(id=id, model_type=AIModelType.LORA)
+            if not ok:
+                res.append(
+                    {
+                        "field": "lora_model_ids",
+                        "error": f"LORA model with id {id} doesn't exist",
+                    }
+                )
+
+        for i, img in enumerate(input.images):
+            if img.encode_settings is None:
+                continue
+            for err in img.encode_settings.errors():
+                res.append({"field": f"images.{i}.encode_settings", "error": err})
+
         if input.ip_adapter_config is not None:
             if (
                 "model" not in input.ip_adapter_config.keys()
@@ -61,12 +121,167 @@ class JobService:
 
         return res
 
+    async def _validated(self, input: JobUserInput):
+        errs = await self._validate(input)
+        if len(errs) > 0:
+            raise TSTError(
+                "incorrect-input",
+                "Incorrect input",
+                metadata={"error_per_field": errs, "status_code": 400},
+            )
+
     async def create_job(self, config: Config, input: JobUserInput) -> JobSchema:
-        job = await self.job_repo.create(config, input)
+        await self._validated(input)
+
+        # refused before anything is written on disk
+        await self._admit(config, input)
+
+        loras = []
+        for v in input.lora_model_ids:
+            aimodel = await self.aimodel_repo.get_one(v.lora_model_id)
+            loras.append(LoraAndWeight(aimodel=aimodel, weight=v.weight))
+
+        job = await self.job_repo.create(config, input, loras)
         assert job.id is not None
         await self.manager.send_signal_new_job(job.id)
         return job
 
+    async def plan_job(self, input: JobUserInput) -> JobPlanSchema:
+        await self._validated(input)
+        return self._plan(await self._job_engine(input), input)
+
+    async def _job_engine(self, input: JobUserInput) -> EngineSchema:
+        if input.generator_id is not None:
+            return (await self.generator_repo.get_one(input.generator_id)).engine
+        assert input.engine_id is not None
+        return await self.engine_repo.get_one(input.engine_id)
+
+    def _costs(self, engine: EngineSchema, input: JobUserInput) -> list[float]:
+        """Expected cost of each image, scaled like the backlog scales it."""
+        factor = cost_factor(
+            engine, len(input.lora_model_ids), input.ip_adapter_config is not None
+        )
+        return [
+            image_cost(img.width, img.height, img.steps, engine) * factor
+            for img in input.images
+        ]
+
+    def _plan(self, engine: EngineSchema, input: JobUserInput) -> JobPlanSchema:
+        assert engine.id is not None
+        cost_model = self.manager.cost_model
+        capacity = self.manager.memory_capacity(engine)
+        max_batch_megapixels = (
+            cost_model.max_batch_megapixels(engine, capacity)
+            if capacity is not None
+            else None
+        )
+        extra_bytes = job_extra_bytes(
+            len(input.lora_model_ids), input.ip_adapter_config is not None
+        )
+
+        images = []
+        fits = True
+        costs = self._costs(engine, input)
+        for img, cost in zip(input.images, costs):
+            width = img.width or engine.width
+            height = img.height or engine.height
+            megapixels = width * height / 1_000_000
+            batch_size = batch_size_for(
+                megapixels, max_batch_megapixels, engine.max_batch_size
+            )
+            if input.ip_adapter_config is not None:
+                batch_size = 1
+            # the generator shrinks the batch down to a single image before it gives up
+            smallest = cost_model.peak_bytes(engine, megapixels, 1, extra_bytes)
+            if capacity is not None and smallest > capacity:
+                fits = False
+            images.append(
+                ImagePlanSchema(
+                    width=width,
+                    height=height,
+                    steps=img.steps or engine.steps,
+                    batch_size=batch_size,
+                    seconds=cost_model.image_seconds(engine, cost),
+                    peak_memory_bytes=cost_model.peak_bytes(
+                        engine, megapixels, batch_size, extra_bytes
+                    ),
+                )
+            )
+
+        queue_seconds = self.manager.estimate_drain_seconds(engine.id)
+        return JobPlanSchema(
+            engine_id=engine.id,
+            images=images,
+            seconds=sum(img.seconds for img in images),
+            queue_seconds=queue_seconds,
+            finish_seconds=self.manager.estimate_drain_seconds(engine.id, sum(costs)),
+            peak_memory_bytes=max((img.peak_memory_bytes for img in images), default=0),
+            memory_capacity_bytes=capacity,
+            fits=fits,
+            time_calibrated=cost_model.time_calibrated(engine.id),
+            memory_calibrated=cost_model.memory_calibrated(engine.id),
+        )
+
+    async def _admit(self, config: Config, input: JobUserInput):
+        engine = await self._job_engine(input)
+        assert engine.id is not None
+
+        plan = self._plan(engine, input)
+        if not plan.fits:
+            assert plan.memory_capacity_bytes is not None
+            errs = [
+                {
+                    "field": f"images.{i}",
+                    "error": f"needs about {img.peak_memory_bytes / 1024**3:.1f} GB, "
+                    f"the device has {plan.memory_capacity_bytes / 1024**3:.1f} GB",
+                }
+                for i, img in enumerate(plan.images)
+                if img.peak_memory_bytes > plan.memory_capacity_bytes
+            ]
+            raise TSTError(
+                "job-does-not-fit-in-memory",
+                f"Job needs more memory than engine {engine.id} can get",
+                metadata={"error_per_field": errs, "status_code": 400},
+            )
+
+        costs = self._costs(engine, input)
+        seconds_per_cost = self.manager.seconds_per_cost(engine.id)
+
+        max_images = config.admission.max_outstanding_images_per_tenant
+        if max_images is not None:
+            outstanding = await self.job_repo.count_outstanding_images(input.tenant)
+            excess = outstanding + len(costs) - max_images
+            if excess > 0:
+                # about as long as the tenant's excess images take to finish
+                avg_cost = sum(costs) / max(1, len(costs))
+                raise _too_many_requests(
+                    "tenant-has-too-many-images",
+                    f"Tenant {input.tenant} has {outstanding} images waiting, the limit is {max_images}",
+                    excess * avg_cost * seconds_per_cost,
+                )
+
+        max_drain = config.admission.max_drain_seconds
+        if max_drain is not None:
+            drain = self.manager.estimate_drain_seconds(engine.id, sum(costs))
+            if drain > max_drain:
+                raise _too_many_requests(
+                    "queue-is-full",
+                    f"Engine {engine.id} needs {drain:.0f} seconds to get through its queue, the limit is {max_drain:.0f}",
+                    drain - max_drain,
+                )
+
+    async def cancel_job(self, job_id: int) -> JobSchema:
+        job = await self.job_repo.get_one(job_id)
+        if job.status in (JobStatus.FINISHED, JobStatus.CANCELLED, JobStatus.FAILED):
+            raise TSTError(
+                "job-is-done",
+                f"Job with ID {job_id} is {job.status}, it can't be cancelled",
+                metadata={"status_code": 400},
+            )
+
+        await self.manager.cancel_job(job_id)
+        return await self.job_repo.get_one(job_id)
+
     async def delete_job(self, job_id: int):
         job = await self.job_repo.get_or_none(job_id)
         if not job:
@@ -82,6 +297,7 @@ class JobService:
                 f"Job with ID {job_id} is getting processed, can't be deleted yet",
                 metadata={"status_code": 400},
             )
+        self.manager.discard_waiting_job(job_id)
         imgs = await self.image_repo.filter(job_id=job.id)
         for img in imgs:
             for cni in img.control_images:
@@ -92,3 +308,14 @@ class JobService:
                 os.remove(img.file_path)
 
         await self.job_repo.delete(job_id)
+
+
+def _too_many_requests(code: str, msg: str, retry_after: float) -> TSTError:
+    return TSTError(
+        code,
+        msg,
+        metadata={
+            "status_code": 429,
+            "headers": {"Retry-After": str(max(1, math.ceil(retry_after)))},
+        },
+    )
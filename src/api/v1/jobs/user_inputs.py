@@ -5,6 +5,8 @@ from typing import Any
 
 from pydantic import BaseModel, Field
 
+from src.api.v1.engines.user_inputs import LoraIDAndWeightInput
+from src.api.v1.images.schemas import EncodeSettings
 from src.core.enums import FileImageType
 
 
@@ -31,9 +33,18 @@ class ImageUserInput(BaseModel):
     file_type: FileImageType = Field(default=FileImageType.PNG)
     control_guidance_start: float | None = None
     control_guidance_end: float | None = None
+    # None uses the engine's settings
+    encode_settings: EncodeSettings | None = None
 
 
 class JobUserInput(BaseModel):
-    generator_id: int
+    # exactly one of them, with engine_id the manager picks the generator
+    generator_id: int | None = None
+    engine_id: int | None = None
+    # higher runs first, jobs of the same priority are shared fairly between tenants
+    priority: int = 0
+    tenant: str = "default"
     images: list[ImageUserInput]
     ip_adapter_config: dict[str, Any] | None = None
+    # applied on top of the engine's LoRAs, without restarting the generator
+    lora_model_ids: list[LoraIDAndWeightInput] = Field(default=[])
@@ -26,7 +26,8 @@ class WSEventGeneratorStreamerService:
 
     async def _internal_event_broadcaster(self):
         while True:
-            if not self._manager.websocket_event_queue.empty():
+            # everything queued since the last tick, progress events come in bursts
+            while not self._manager.websocket_event_queue.empty():
                 event = self._manager.websocket_event_queue.get()
                 print("broadcast event ", event)
                 # Broadcast to all connected clients
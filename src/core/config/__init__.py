@@ -1,6 +1,30 @@
 # Copyright © 2025-2026 Emmanouil Ragiadakos
 # SPDX-License-Identifier: MIT
 
-from .config import Config, enable_hugging_face_envs, read_config
+from .config import (
+    AdmissionConfig,
+    AutoscaleConfig,
+    BatchingConfig,
+    CacheConfig,
+    Config,
+    EventsConfig,
+    MemoryConfig,
+    QueueConfig,
+    SupervisorConfig,
+    enable_hugging_face_envs,
+    read_config,
+)
 
-__all__ = ["Config", "read_config", "enable_hugging_face_envs"]
+__all__ = [
+    "AdmissionConfig",
+    "AutoscaleConfig",
+    "BatchingConfig",
+    "CacheConfig",
+    "Config",
+    "EventsConfig",
+    "MemoryConfig",
+    "QueueConfig",
+    "SupervisorConfig",
+    "read_config",
+    "enable_hugging_face_envs",
+]
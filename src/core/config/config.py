@@ -2,17 +2,113 @@
 # SPDX-License-Identifier: MIT
 
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from mashumaro.mixins.yaml import DataClassYAMLMixin
 
 
+@dataclass
+class SupervisorConfig:
+    # seconds between heartbeats sent by each generator process
+    heartbeat_interval: float = 5.0
+    # a generator that stays silent for longer is considered hung and is killed
+    heartbeat_timeout: float = 60.0
+    check_interval: float = 2.0
+    # restarts wait restart_backoff * 2^n seconds, capped to restart_backoff_max
+    restart_backoff: float = 2.0
+    restart_backoff_max: float = 300.0
+    # crashes before the generator is left closed
+    max_restarts: int = 5
+    # crashes further apart than this start counting from zero again
+    restart_window: float = 600.0
+    # crashes or errors of a job before it is marked failed instead of requeued
+    max_job_attempts: int = 3
+    # images of a job that fail to be written before the job is marked failed
+    max_write_failures: int = 3
+
+
+@dataclass
+class AutoscaleConfig:
+    # seconds between evaluations of the engines' autoscale policies
+    check_interval: float = 5.0
+
+
+@dataclass
+class QueueConfig:
+    # share of the generators per tenant, tenants not listed weigh 1
+    tenant_weights: dict[str, float] = field(default_factory=dict)
+    # images of a job sent to a generator at a time
+    work_unit_images: int = 1
+
+
+@dataclass
+class AdmissionConfig:
+    # new jobs are refused while the engine's backlog needs longer to drain
+    max_drain_seconds: float | None = None
+    # images of a tenant that may wait or be processed at the same time
+    max_outstanding_images_per_tenant: int | None = None
+    # used until the generators have timed a few images of the engine
+    default_seconds_per_megapixel_step: float = 0.4
+
+
+@dataclass
+class BatchingConfig:
+    # work units a generator holds at once, their images share denoising batches
+    max_jobs_per_generator: int = 1
+    # how long a generator waits for more work before it starts a batch
+    window_ms: float = 20.0
+    # threads of each generator that prepare the next batch while one denoises
+    prefetch_workers: int = 1
+    # threads of each generator that encode and save finished images
+    writer_workers: int = 2
+
+
+@dataclass
+class CacheConfig:
+    # encoded prompts kept by each generator process
+    prompt_embeds_mb: int = 256
+    # preprocessed ControlNet images, by default under poses_path/conditioning
+    conditioning_path: str | None = None
+    conditioning_memory_mb: int = 256
+    conditioning_disk_mb: int = 2048
+    # LoRA files of jobs kept in CPU memory by each generator process
+    lora_memory_mb: int = 2048
+    # LoRA adapters that stay loaded in the pipe of each generator
+    loaded_loras: int = 8
+    # diffusers-layout copies of single-file models, None converts them on every start
+    converted_models_path: str | None = None
+    # torch.compile artifacts per engine, by default under hugging_face_path/compiled
+    compiled_path: str | None = None
+
+
+@dataclass
+class EventsConfig:
+    # least seconds between the step progress events of a generator, None sends none
+    progress_interval: float | None = 1.0
+
+
+@dataclass
+class MemoryConfig:
+    # share of a GPU's memory the generators on it may use together
+    gpu_budget_fraction: float = 0.9
+    # RAM the generators on the CPU may use together, None is unlimited
+    cpu_budget_mb: int | None = None
+
+
 @dataclass
 class Config(DataClassYAMLMixin):
     db_path: str
     images_path: str
     poses_path: str
     hugging_face_path: str
+    supervisor: SupervisorConfig = field(default_factory=SupervisorConfig)
+    autoscale: AutoscaleConfig = field(default_factory=AutoscaleConfig)
+    queue: QueueConfig = field(default_factory=QueueConfig)
+    admission: AdmissionConfig = field(default_factory=AdmissionConfig)
+    batching: BatchingConfig = field(default_factory=BatchingConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    memory: MemoryConfig = field(default_factory=MemoryConfig)
+    events: EventsConfig = field(default_factory=EventsConfig)
 
 
 def read_config(filepath: str) -> Config:
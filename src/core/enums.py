@@ -68,10 +68,41 @@ class Scheduler(enum.StrEnum):
     DEIS = "deis"
 
 
+class AttentionProcessor(enum.StrEnum):
+    SDPA = "sdpa"
+    CLASSIC = "classic"
+    XFORMERS = "xformers"
+
+
+class CompileMode(enum.StrEnum):
+    DEFAULT = "default"
+    REDUCE_OVERHEAD = "reduce-overhead"
+    MAX_AUTOTUNE = "max-autotune"
+
+
+class Device(enum.StrEnum):
+    AUTO = "auto"
+    CUDA = "cuda"
+    CPU = "cpu"
+
+
+class MemoryMode(enum.StrEnum):
+    AUTO = "auto"
+    FULL = "full"
+    VAE_SLICING = "vae_slicing"
+    VAE_TILING = "vae_tiling"
+    ATTENTION_SLICING = "attention_slicing"
+    MODEL_OFFLOAD = "model_offload"
+    SEQUENTIAL_OFFLOAD = "sequential_offload"
+
+
 class JobStatus(enum.StrEnum):
     WAITING = "waiting"
     PROCESSING = "processing"
     FINISHED = "finished"
+    CANCELLED = "cancelled"
+    # gave up after the job crashed or failed its generator too many times
+    FAILED = "failed"
 
 
 class GeneratorStatus(enum.StrEnum):
@@ -85,21 +116,27 @@ class GeneratorStatus(enum.StrEnum):
 class FileImageType(enum.StrEnum):
     JPG = "jpg"
     PNG = "png"
+    WEBP = "webp"
 
 
 class GeneratorCommandType(enum.StrEnum):
     JOB = "job"
     CLOSE = "close"
+    CANCEL = "cancel"
 
 
 class GeneratorEventType(enum.StrEnum):
     READY = "ready"
     JOB_STARTING = "job_starting"
     JOB_FINISHED = "job_finished"
+    JOB_CANCELLED = "job_cancelled"
+    JOB_FAILED = "job_failed"
     IMAGE_FINISHED = "image_finished"
+    IMAGE_PROGRESS = "image_progress"
     ERROR = "error"
     CRASH = "crash"
     CLOSED = "closed"
+    HEARTBEAT = "heartbeat"
 
 
 class ManagerSignalType(enum.StrEnum):
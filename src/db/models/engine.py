@@ -6,7 +6,9 @@ from tortoise.models import Model
 
 from src.core.enums import (
     AIModelType,
+    Device,
     LongPromptTechnique,
+    MemoryMode,
     PipeType,
     Scheduler,
 )
@@ -32,6 +34,12 @@ class Engine(TimestampMixin, Model):
     control_guidance_start = fields.FloatField(null=True)
     control_guidance_end = fields.FloatField(null=True)
     clip_skip = fields.IntField(null=True)
+    autoscale = fields.JSONField(null=True)
+    max_batch_size = fields.IntField(default=1)
+    encode_settings = fields.JSONField(null=True)
+    device = fields.CharEnumField(enum_type=Device, null=True)
+    acceleration = fields.JSONField(null=True)
+    memory_mode = fields.CharEnumField(enum_type=MemoryMode, null=True)
 
 
 class AIModelForEngine(Model):
@@ -5,7 +5,9 @@ from tortoise import fields
 from tortoise.models import Model
 
 from src.core.enums import (
+    Device,
     GeneratorStatus,
+    MemoryMode,
 )
 from src.db.models.common import TimestampMixin
 
@@ -16,3 +18,10 @@ class Generator(TimestampMixin, Model):
     engine_id = fields.IntField()
     gpu_id = fields.IntField(default=0)
     status = fields.CharEnumField(enum_type=GeneratorStatus)
+    device = fields.CharEnumField(enum_type=Device, null=True, default=None)
+    threads = fields.IntField(null=True, default=None)
+    memory_mode = fields.CharEnumField(enum_type=MemoryMode, null=True, default=None)
+    # highest device memory, or RSS on the CPU, measured while serving jobs
+    peak_memory_bytes = fields.BigIntField(null=True, default=None)
+    # timing of the phases of the last start
+    startup = fields.JSONField(null=True, default=None)
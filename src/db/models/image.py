@@ -10,7 +10,7 @@ from src.db.models.common import TimestampMixin
 
 class Image(TimestampMixin, Model):
     id = fields.IntField(primary_key=True)
-    generator_id = fields.IntField()
+    generator_id = fields.IntField(null=True, default=None)
     job_id = fields.IntField()
     ready = fields.BooleanField(default=False)
     file_path = fields.TextField()
@@ -25,6 +25,7 @@ class Image(TimestampMixin, Model):
     file_type = fields.CharEnumField(enum_type=FileImageType)
     control_guidance_start = fields.FloatField(null=True, default=None)
     control_guidance_end = fields.FloatField(null=True, default=None)
+    encode_settings = fields.JSONField(null=True, default=None)
 
 
 class ControlNetImage(TimestampMixin, Model):
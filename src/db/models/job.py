@@ -10,7 +10,11 @@ from src.db.models.common import TimestampMixin
 
 class Job(TimestampMixin, Model):
     id = fields.IntField(primary_key=True)
-    generator_id = fields.IntField()
+    generator_id = fields.IntField(null=True, default=None)
+    engine_id = fields.IntField(null=True, default=None)
+    priority = fields.IntField(default=0)
+    tenant = fields.TextField(default="default")
     status = fields.CharEnumField(enum_type=JobStatus, default=JobStatus.WAITING)
     ip_adapter_config = fields.JSONField(null=True, default=None)
+    lora_models = fields.JSONField(null=True, default=None)
     finshed_at = fields.DatetimeField(null=True, default=None)
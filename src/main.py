@@ -28,10 +28,12 @@ async def lifespan(app: FastAPI):
     os.makedirs(config.poses_path, exist_ok=True)
     enable_hugging_face_envs(config)
     await async_init_db(config.db_path)
-    _ = await container.get(GeneratorManager)
+    manager = await container.get(GeneratorManager)
+    await manager.start()
     _ = await container.get(WSEventGeneratorStreamerService)
     yield
     print("closing server")
+    await manager.close()
     await async_close_db()
 
 
@@ -50,6 +52,7 @@ def add_exception_handlers(app: FastAPI):
                 return JSONResponse(
                     status_code=status_code,
                     content=content,
+                    headers=meta.get("headers"),
                 )
 
         return JSONResponse(
@@ -0,0 +1,170 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from multiprocessing.queues import Queue
+
+import numpy as np
+from PIL import Image
+
+from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.engines.schemas import (
+    AccelerationOptions,
+    EngineSchema,
+)
+from src.api.v1.generators.process.generator import start_generator
+from src.api.v1.generators.process.types import (
+    GeneratorCommand,
+    GeneratorEvent,
+    GeneratorOptions,
+)
+from src.api.v1.images.schemas import ImageSchema
+from src.api.v1.jobs.schemas import JobSchema
+from src.core.config import enable_hugging_face_envs, read_config
+from src.core.enums import (
+    AIModelBase,
+    AIModelStatus,
+    AIModelType,
+    AttentionProcessor,
+    CompileMode,
+    Device,
+    GeneratorCommandType,
+    GeneratorEventType,
+    JobStatus,
+    PathType,
+    PipeType,
+    Scheduler,
+    Variant,
+)
+from src.utils import read_test_config
+
+# mean absolute difference of the pixels, out of 255, the accelerated
+# kernels may round differently but must draw the same images
+_MAX_PIXEL_DIFFERENCE = 8.0
+
+
+def _run_job(
+    engine: EngineSchema, options: GeneratorOptions
+) -> tuple[float, list[str]]:
+    """
+    Seconds the generator takes for a job of two images once it is READY,
+    with the paths of the images.
+    """
+    commandq: Queue[GeneratorCommand] = multiprocessing.Queue()
+    resultq: Queue[GeneratorEvent] = multiprocessing.Queue()
+
+    p = multiprocessing.Process(
+        target=start_generator,
+        args=("cpu", 1, 0, engine, commandq, resultq, options),
+    )
+    p.start()
+    res = resultq.get()
+    assert res.event == GeneratorEventType.READY
+
+    img_id = str(uuid.uuid4())
+    images = [
+        ImageSchema(
+            id=i + 1,
+            job_id=1,
+            generator_id=1,
+            prompt=prompt,
+            negative_prompt="bad quality",
+            ready=False,
+            file_path=f"/tmp/cpu-{i}-{img_id}.png",
+        )
+        for i, prompt in enumerate(["a king, blue hair", "a queen, red hair"])
+    ]
+    job = JobSchema(id=1, generator_id=1, images=images, status=JobStatus.WAITING)
+
+    start = time.time()
+    commandq.put(GeneratorCommand(command=GeneratorCommandType.JOB, value=job))
+    for _ in images:
+        res = resultq.get()
+        assert res.event == GeneratorEventType.IMAGE_FINISHED
+    res = resultq.get()
+    assert res.event == GeneratorEventType.JOB_FINISHED
+    end = time.time()
+    for img in images:
+        assert os.path.isfile(img.file_path)
+
+    commandq.put(GeneratorCommand(command=GeneratorCommandType.CLOSE, value=None))
+    res = resultq.get()
+    assert res.event == GeneratorEventType.CLOSED
+    p.join()
+    return end - start, [img.file_path for img in images]
+
+
+def _pixel_difference(path_a: str, path_b: str) -> float:
+    a = np.asarray(Image.open(path_a).convert("RGB"), dtype=np.float32)
+    b = np.asarray(Image.open(path_b).convert("RGB"), dtype=np.float32)
+    assert a.shape == b.shape
+    return float(np.abs(a - b).mean())
+
+
+def test_sd_cpu_acceleration():
+    logging.basicConfig(level=logging.DEBUG)
+    multiprocessing.set_start_method("spawn")
+    config = read_config("config.yaml")
+    enable_hugging_face_envs(config)
+    cfg = read_test_config("tests/test-config.yaml")
+    assert cfg.checkpoint_sd.file_path is not None
+
+    sd_model = AIModelSchema(
+        id=1,
+        name="sd_model",
+        status=AIModelStatus.READY,
+        path=cfg.checkpoint_sd.file_path,
+        path_type=PathType.FILE,
+        variant=Variant.FP16,
+        model_type=AIModelType.CHECKPOINT,
+        model_base=AIModelBase.SD,
+        tags="anime",
+    )
+
+    engine = EngineSchema(
+        id=1,
+        name="test sd cpu",
+        checkpoint_model=sd_model,
+        lora_models=[],
+        control_net_models=[],
+        embedding_models=[],
+        scheduler=Scheduler.EULERA,
+        guidance_scale=7.0,
+        seed=10,
+        width=512,
+        height=512,
+        steps=10,
+        pipe_type=PipeType.TXT2IMG,
+        device=Device.CPU,
+    )
+    accelerated = engine.model_copy(
+        update={
+            "acceleration": AccelerationOptions(
+                attention=AttentionProcessor.SDPA,
+                channels_last=True,
+                compile_mode=CompileMode.DEFAULT,
+            )
+        }
+    )
+
+    with tempfile.TemporaryDirectory() as compile_path:
+        options = GeneratorOptions(device=Device.CPU, compile_cache_path=compile_path)
+        plain, plain_paths = _run_job(engine, options)
+        compiled, compiled_paths = _run_job(accelerated, options)
+        # the compiled graphs are kept for the next start
+        cached = [f for _, _, files in os.walk(compile_path) for f in files]
+        assert len(cached) > 0
+
+    for plain_path, compiled_path in zip(plain_paths, compiled_paths):
+        difference = _pixel_difference(plain_path, compiled_path)
+        print(f"{compiled_path} differs by {difference:.2f} on average")
+        assert difference <= _MAX_PIXEL_DIFFERENCE
+
+    print(f"job on the plain pipe took {plain:.1f} seconds")
+    print(f"job on the accelerated pipe took {compiled:.1f} seconds")
+    print(f"speedup {plain / compiled:.2f}x")
@@ -0,0 +1,105 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import logging
+import multiprocessing
+import tempfile
+import time
+from multiprocessing.queues import Queue
+
+from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.engines.schemas import (
+    EngineSchema,
+)
+from src.api.v1.generators.process.generator import start_generator
+from src.api.v1.generators.process.types import (
+    GeneratorCommand,
+    GeneratorEvent,
+    GeneratorOptions,
+)
+from src.core.config import enable_hugging_face_envs, read_config
+from src.core.enums import (
+    AIModelBase,
+    AIModelStatus,
+    AIModelType,
+    GeneratorCommandType,
+    GeneratorEventType,
+    PathType,
+    PipeType,
+    Scheduler,
+    Variant,
+)
+from src.utils import read_test_config
+
+
+def _startup_seconds(engine: EngineSchema, options: GeneratorOptions) -> float:
+    """Seconds from starting the generator process until it is READY."""
+    commandq: Queue[GeneratorCommand] = multiprocessing.Queue()
+    resultq: Queue[GeneratorEvent] = multiprocessing.Queue()
+
+    start = time.time()
+    p = multiprocessing.Process(
+        target=start_generator,
+        args=("startup", 1, 0, engine, commandq, resultq, options),
+    )
+    p.start()
+    res = resultq.get()
+    end = time.time()
+    assert res.event == GeneratorEventType.READY
+
+    commandq.put(GeneratorCommand(command=GeneratorCommandType.CLOSE, value=None))
+    res = resultq.get()
+    assert res.event == GeneratorEventType.CLOSED
+    p.join()
+    return end - start
+
+
+def test_sdxl_converted_checkpoint_startup():
+    logging.basicConfig(level=logging.DEBUG)
+    multiprocessing.set_start_method("spawn")
+    config = read_config("config.yaml")
+    enable_hugging_face_envs(config)
+    cfg = read_test_config("tests/test-config.yaml")
+    assert cfg.checkpoint_sdxl.file_path is not None
+
+    sdxl_model = AIModelSchema(
+        id=1,
+        name="sdxl_model",
+        status=AIModelStatus.READY,
+        path=cfg.checkpoint_sdxl.file_path,
+        path_type=PathType.FILE,
+        variant=Variant.FP16,
+        model_type=AIModelType.CHECKPOINT,
+        model_base=AIModelBase.SDXL,
+        tags="anime",
+    )
+
+    engine = EngineSchema(
+        id=1,
+        name="test sdxl startup",
+        checkpoint_model=sdxl_model,
+        lora_models=[],
+        control_net_models=[],
+        embedding_models=[],
+        scheduler=Scheduler.EULERA,
+        guidance_scale=7.0,
+        seed=10,
+        width=1024,
+        height=1024,
+        steps=30,
+        pipe_type=PipeType.TXT2IMG,
+    )
+
+    with tempfile.TemporaryDirectory() as cache_path:
+        single_file = _startup_seconds(engine, GeneratorOptions())
+        converting = _startup_seconds(
+            engine, GeneratorOptions(checkpoint_cache_path=cache_path)
+        )
+        converted = _startup_seconds(
+            engine, GeneratorOptions(checkpoint_cache_path=cache_path)
+        )
+
+    print(f"startup from the single file took {single_file:.1f} seconds")
+    print(f"startup that converted the checkpoint took {converting:.1f} seconds")
+    print(f"startup from the converted checkpoint took {converted:.1f} seconds")
+    assert converted < single_file
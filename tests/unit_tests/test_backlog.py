@@ -0,0 +1,132 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+from typing import Any
+
+from src.api.v1.generators.backlog import BacklogEntry, JobBacklog
+
+ENGINE_ID = 1
+
+
+def _entry(
+    job_id: int,
+    tenant: str = "default",
+    priority: int = 0,
+    images: int = 1,
+    generator_id: int | None = None,
+    lora_key: tuple[Any, ...] = (),
+) -> BacklogEntry:
+    entry = BacklogEntry(
+        job_id=job_id,
+        generator_id=generator_id,
+        tenant=tenant,
+        priority=priority,
+        image_costs=[1.0] * images,
+        lora_key=lora_key,
+    )
+    # the order of the pushes, whatever the clock's resolution
+    entry.queued_at = float(job_id)
+    return entry
+
+
+def _pop(backlog: JobBacklog, count: int, generator_id: int = 1) -> list[int]:
+    res = []
+    for _ in range(count):
+        unit = backlog.pop_for(ENGINE_ID, generator_id)
+        assert unit is not None
+        res.append(unit.entry.job_id)
+    return res
+
+
+def test_higher_priority_goes_first():
+    backlog = JobBacklog()
+    backlog.push(ENGINE_ID, _entry(1))
+    backlog.push(ENGINE_ID, _entry(2, priority=5))
+    backlog.push(ENGINE_ID, _entry(3))
+
+    assert _pop(backlog, 3) == [2, 1, 3]
+    assert backlog.pop_for(ENGINE_ID, 1) is None
+
+
+def test_tenants_share_by_weight():
+    backlog = JobBacklog(weights={"a": 3, "b": 1})
+    for n in range(8):
+        backlog.push(ENGINE_ID, _entry(n, tenant="a"))
+        backlog.push(ENGINE_ID, _entry(100 + n, tenant="b"))
+
+    popped = _pop(backlog, 8)
+    assert len([job_id for job_id in popped if job_id < 100]) == 6
+    # each tenant's jobs in FIFO order
+    assert [job_id for job_id in popped if job_id < 100] == [0, 1, 2, 3, 4, 5]
+    assert [job_id for job_id in popped if job_id >= 100] == [100, 101]
+
+
+def test_idle_tenant_gets_no_credit():
+    backlog = JobBacklog()
+    for n in range(6):
+        backlog.push(ENGINE_ID, _entry(n, tenant="a"))
+    assert _pop(backlog, 3) == [0, 1, 2]
+
+    # b was idle while a was served, it starts level with a instead of
+    # taking the generator until it catches up
+    for n in range(3):
+        backlog.push(ENGINE_ID, _entry(100 + n, tenant="b"))
+    assert _pop(backlog, 4) == [3, 100, 4, 101]
+
+
+def test_prefers_the_active_loras():
+    backlog = JobBacklog()
+    backlog.push(ENGINE_ID, _entry(1, lora_key=("x",)))
+    backlog.push(ENGINE_ID, _entry(2, lora_key=("y",)))
+
+    unit = backlog.pop_for(ENGINE_ID, 1, lora_key=("y",))
+    assert unit is not None and unit.entry.job_id == 2
+    unit = backlog.pop_for(ENGINE_ID, 1, lora_key=("y",))
+    assert unit is not None and unit.entry.job_id == 1
+
+
+def test_pinned_jobs_wait_for_their_generator():
+    backlog = JobBacklog()
+    backlog.push(ENGINE_ID, _entry(1, generator_id=2, images=3))
+    backlog.push(ENGINE_ID, _entry(2))
+    assert backlog.pinned_cost(ENGINE_ID, 2) == 3.0
+    assert backlog.pinned_cost(ENGINE_ID, 1) == 0.0
+
+    assert _pop(backlog, 1, generator_id=1) == [2]
+    assert backlog.pop_for(ENGINE_ID, 1) is None
+    assert _pop(backlog, 1, generator_id=2) == [1]
+
+
+def test_work_units_are_at_least_one_batch():
+    backlog = JobBacklog(unit_images=2)
+    backlog.push(ENGINE_ID, _entry(1, images=5))
+    backlog.push(ENGINE_ID, _entry(2, images=5))
+    backlog.push(ENGINE_ID, _entry(3, images=1))
+
+    unit = backlog.pop_for(ENGINE_ID, 1, batch_size=1)
+    assert unit is not None
+    assert (unit.entry.job_id, unit.images, unit.cost) == (1, 2, 2.0)
+
+    unit = backlog.pop_for(ENGINE_ID, 1, batch_size=4)
+    assert unit is not None
+    assert (unit.entry.job_id, unit.images, unit.cost) == (2, 4, 4.0)
+
+    # never more images than the job has left
+    unit = backlog.pop_for(ENGINE_ID, 1, batch_size=4)
+    assert unit is not None
+    assert (unit.entry.job_id, unit.images) == (3, 1)
+
+
+def test_remove_and_depth():
+    backlog = JobBacklog()
+    backlog.push(ENGINE_ID, _entry(1, images=2))
+    backlog.push(ENGINE_ID, _entry(2))
+    # pushing a job that is queued already changes nothing
+    backlog.push(ENGINE_ID, _entry(2))
+    assert backlog.depth(ENGINE_ID) == 2
+    assert backlog.total_cost(ENGINE_ID) == 3.0
+
+    assert backlog.remove(1)
+    assert not backlog.remove(1)
+    assert backlog.depth(ENGINE_ID) == 1
+    assert _pop(backlog, 1) == [2]
@@ -0,0 +1,119 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import os
+from typing import Callable
+
+import pytest
+
+from src.api.v1.generators.process import checkpoint_cache
+from src.api.v1.generators.process.checkpoint_cache import CheckpointCache
+
+
+class FakeModel:
+    """Writes a weights file the way save_pretrained does."""
+
+    def save_pretrained(self, path: str, safe_serialization: bool):
+        assert safe_serialization
+        os.makedirs(path)
+        with open(os.path.join(path, "model.safetensors"), "wb") as f:
+            f.write(b"\0" * 1024)
+
+
+@pytest.fixture
+def hashes(monkeypatch) -> list[str]:
+    """The source files that got hashed, in order."""
+    res = []
+    sha256 = checkpoint_cache._sha256
+
+    def counting_sha256(path: str) -> str:
+        res.append(path)
+        return sha256(path)
+
+    monkeypatch.setattr(checkpoint_cache, "_sha256", counting_sha256)
+    return res
+
+
+def _converter(calls: list[str], kind: str) -> Callable[[], FakeModel]:
+    def convert() -> FakeModel:
+        calls.append(kind)
+        return FakeModel()
+
+    return convert
+
+
+def _source(tmp_path, content: bytes = b"weights") -> str:
+    path = tmp_path / "model.safetensors"
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_converts_once(tmp_path, hashes: list[str]):
+    cache = CheckpointCache(str(tmp_path / "converted"))
+    source = _source(tmp_path)
+    calls = []
+
+    entry = cache.ensure(source, "unet", "float16", _converter(calls, "unet"))
+    assert os.path.isfile(os.path.join(entry, "model.safetensors"))
+    assert cache.ensure(source, "unet", "float16", _converter(calls, "unet")) == entry
+    assert calls == ["unet"]
+
+    # another process finds it too, without hashing the source again
+    restarted = CheckpointCache(str(tmp_path / "converted"))
+    again = restarted.ensure(source, "unet", "float16", _converter(calls, "unet"))
+    assert again == entry
+    assert calls == ["unet"]
+    assert len(hashes) == 1
+
+
+def test_entries_depend_on_kind_and_dtype(tmp_path, hashes: list[str]):
+    cache = CheckpointCache(str(tmp_path / "converted"))
+    source = _source(tmp_path)
+    calls = []
+
+    unet = cache.ensure(source, "unet", "float16", _converter(calls, "unet"))
+    vae = cache.ensure(source, "vae", "float16", _converter(calls, "vae"))
+    unet32 = cache.ensure(source, "unet", "float32", _converter(calls, "unet"))
+
+    assert len({unet, vae, unet32}) == 3
+    assert calls == ["unet", "vae", "unet"]
+    assert len(hashes) == 1
+
+
+def test_a_changed_source_is_converted_again(tmp_path, hashes: list[str]):
+    cache = CheckpointCache(str(tmp_path / "converted"))
+    source = _source(tmp_path)
+    calls = []
+
+    entry = cache.ensure(source, "unet", "float16", _converter(calls, "unet"))
+    st = os.stat(source)
+    _source(tmp_path, b"other weights")
+    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    changed = cache.ensure(source, "unet", "float16", _converter(calls, "unet"))
+    assert changed != entry
+    assert calls == ["unet", "unet"]
+    assert len(hashes) == 2
+
+
+def test_entries_and_purge(tmp_path, hashes: list[str]):
+    cache = CheckpointCache(str(tmp_path / "converted"))
+    source = _source(tmp_path)
+    other = str(tmp_path / "other.safetensors")
+    with open(other, "wb") as f:
+        f.write(b"other weights")
+    calls = []
+
+    cache.ensure(source, "unet", "float16", _converter(calls, "unet"))
+    cache.ensure(source, "vae", "float16", _converter(calls, "vae"))
+    cache.ensure(other, "unet", "float16", _converter(calls, "unet"))
+
+    entries = cache.entries(source)
+    assert sorted(e["kind"] for e in entries) == ["unet", "vae"]
+    assert all(e["size_bytes"] >= 1024 for e in entries)
+    assert len(cache.entries()) == 3
+
+    assert cache.purge(source) == 2
+    assert len(cache.entries()) == 1
+    assert cache.purge() == 1
+    assert cache.entries() == []
@@ -0,0 +1,69 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import re
+from typing import Any
+
+from src.api.v1.generators.process.pipe import chunk_long_prompt
+
+
+class WordTokenizer:
+    """A fast tokenizer with one token per word and per punctuation mark."""
+
+    is_fast = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(
+        self, text: str, add_special_tokens: bool, return_offsets_mapping: bool
+    ) -> dict[str, Any]:
+        assert not add_special_tokens and return_offsets_mapping
+        self.calls += 1
+        return {
+            "offset_mapping": [m.span() for m in re.finditer(r"\w+|[^\w\s]", text)]
+        }
+
+
+def _tokens(text: str) -> int:
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def test_short_prompt_is_one_chunk():
+    prompt = "a cat, on a mat"
+    assert chunk_long_prompt(WordTokenizer(), prompt, 75) == [prompt]
+
+
+def test_splits_on_commas():
+    tokenizer = WordTokenizer()
+    parts = [" ".join(f"w{p}x{i}" for i in range(9)) for p in range(20)]
+    prompt = ", ".join(parts)
+
+    chunks = chunk_long_prompt(tokenizer, prompt, 75)
+    assert tokenizer.calls == 1
+    # 7 parts of 9 words and their 6 commas fill 69 of the 75 tokens
+    assert chunks == [
+        ", ".join(parts[0:7]),
+        ", ".join(parts[7:14]),
+        ", ".join(parts[14:20]),
+    ]
+
+
+def test_long_run_without_commas_is_split_not_truncated():
+    words = [f"word{i}" for i in range(200)]
+    prompt = " ".join(words)
+
+    chunks = chunk_long_prompt(WordTokenizer(), prompt, 75)
+    assert [_tokens(chunk) for chunk in chunks] == [75, 75, 50]
+    assert " ".join(chunks) == prompt
+
+
+def test_long_part_between_commas_is_split():
+    long_part = " ".join(f"long{i}" for i in range(100))
+    prompt = f"a cat, {long_part}, a mat"
+
+    chunks = chunk_long_prompt(WordTokenizer(), prompt, 75)
+    assert all(_tokens(chunk) <= 75 for chunk in chunks)
+    # every word is in one of the chunks, in order
+    words = [w for chunk in chunks for w in re.findall(r"\w+", chunk)]
+    assert words == re.findall(r"\w+", prompt)
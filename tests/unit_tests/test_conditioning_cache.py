@@ -0,0 +1,81 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import os
+
+from PIL import Image
+
+from src.api.v1.generators.process.conditioning_cache import (
+    ConditioningCache,
+    conditioning_key,
+)
+
+# bytes of a 10x10 RGB image in memory
+IMAGE_BYTES = 300
+
+
+def _image(color: int) -> Image.Image:
+    return Image.new("RGB", (10, 10), (color, color, color))
+
+
+def test_key_depends_on_everything():
+    key = conditioning_key("img", "canny", {"low": 100, "high": 200})
+    assert key == conditioning_key("img", "canny", {"high": 200, "low": 100})
+    assert key != conditioning_key("img", "canny", {"low": 101, "high": 200})
+    assert key != conditioning_key("img", "openpose", {"low": 100, "high": 200})
+    assert key != conditioning_key("other", "canny", {"low": 100, "high": 200})
+
+
+def test_memory_hits_and_eviction():
+    cache = ConditioningCache(None, 2 * IMAGE_BYTES, 0)
+    a, b, c = _image(0), _image(1), _image(2)
+
+    cache.put("a", a)
+    cache.put("b", b)
+    assert cache.get("a") is a
+    # b is the least recently used
+    cache.put("c", c)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is a
+    assert cache.get("c") is c
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # an image larger than the whole budget is never kept
+    cache.put("large", Image.new("RGB", (100, 100)))
+    assert cache.get("large") is None
+    assert cache.get("a") is a
+
+
+def test_disk_outlives_memory_and_the_process(tmp_path):
+    path = str(tmp_path)
+    cache = ConditioningCache(path, IMAGE_BYTES, 1024**2)
+    cache.put("a", _image(10))
+    cache.put("b", _image(20))
+
+    # a is only on disk now
+    img = cache.get("a")
+    assert img is not None and img.getpixel((0, 0)) == (10, 10, 10)
+    assert cache.hits == 1
+
+    restarted = ConditioningCache(path, IMAGE_BYTES, 1024**2)
+    img = restarted.get("b")
+    assert img is not None and img.getpixel((0, 0)) == (20, 20, 20)
+    assert restarted.get("c") is None
+
+
+def test_disk_keeps_to_its_budget(tmp_path):
+    path = str(tmp_path)
+    # smaller than any PNG, only the newest file stays
+    cache = ConditioningCache(path, 0, 1)
+    for n, key in enumerate("abc"):
+        cache.put(key, _image(n))
+
+    assert sorted(os.listdir(path)) == ["c.png"]
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+
+    # an entry whose file is gone is a miss, and is forgotten
+    os.remove(os.path.join(path, "c.png"))
+    assert cache.get("c") is None
+    assert cache.misses == 2
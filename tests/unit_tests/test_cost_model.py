@@ -0,0 +1,128 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.engines.schemas import EngineSchema
+from src.api.v1.generators.cost_model import CostModel, batch_size_for
+from src.core.enums import (
+    AIModelBase,
+    AIModelStatus,
+    AIModelType,
+    PathType,
+    PipeType,
+    Scheduler,
+    Variant,
+)
+
+GB = 1024**3
+
+
+@pytest.fixture
+def engine() -> EngineSchema:
+    checkpoint = AIModelSchema(
+        id=1,
+        name="sd_model",
+        status=AIModelStatus.READY,
+        path="/models/sd.safetensors",
+        path_type=PathType.FILE,
+        variant=Variant.FP16,
+        model_type=AIModelType.CHECKPOINT,
+        model_base=AIModelBase.SD,
+        tags="",
+    )
+    return EngineSchema(
+        id=1,
+        name="sd",
+        checkpoint_model=checkpoint,
+        lora_models=[],
+        control_net_models=[],
+        embedding_models=[],
+        scheduler=Scheduler.EULERA,
+        guidance_scale=7.0,
+        seed=10,
+        width=512,
+        height=512,
+        steps=20,
+        pipe_type=PipeType.TXT2IMG,
+    )
+
+
+def test_seconds_per_cost_is_averaged(engine: EngineSchema):
+    model = CostModel(default_seconds_per_cost=1.0, alpha=0.2)
+    assert not model.time_calibrated(1)
+    assert model.seconds_per_cost(1) == 1.0
+
+    # the first image sets it, the next ones move it by alpha
+    model.record_time(1, cost=10.0, seconds=20.0)
+    assert model.time_calibrated(1)
+    assert model.seconds_per_cost(1) == pytest.approx(2.0)
+    model.record_time(1, cost=10.0, seconds=40.0)
+    assert model.seconds_per_cost(1) == pytest.approx(2.4)
+    assert model.image_seconds(engine, 5.0) == pytest.approx(12.0)
+
+    # images without a cost say nothing
+    model.record_time(1, cost=0.0, seconds=100.0)
+    assert model.seconds_per_cost(1) == pytest.approx(2.4)
+    # every engine has its own
+    assert model.seconds_per_cost(2) == 1.0
+
+
+def test_memory_follows_the_fitted_line(engine: EngineSchema):
+    model = CostModel(default_seconds_per_cost=1.0)
+    assert not model.memory_calibrated(1)
+
+    model.record_memory(1, 1.0, 1, extra_bytes=0, peak_bytes=10 * GB)
+    # the adapters' memory is taken out of the fit
+    model.record_memory(1, 1.0, 2, extra_bytes=1 * GB, peak_bytes=15 * GB)
+    assert model.memory_calibrated(1)
+
+    # 6 GB plus 4 GB per megapixel of the batch
+    assert model.peak_bytes(engine, 3.0, 1) == pytest.approx(18 * GB, abs=16)
+    assert model.peak_bytes(engine, 1.5, 2) == pytest.approx(18 * GB, abs=16)
+    assert model.peak_bytes(engine, 1.0, 1, extra_bytes=GB) == pytest.approx(
+        11 * GB, abs=16
+    )
+
+
+def test_memory_of_a_single_size_shifts_the_prior(engine: EngineSchema):
+    prior = CostModel(default_seconds_per_cost=1.0)
+    model = CostModel(default_seconds_per_cost=1.0)
+    model.record_memory(1, 0.25, 1, extra_bytes=0, peak_bytes=3 * GB)
+    model.record_memory(1, 0.25, 1, extra_bytes=0, peak_bytes=5 * GB)
+
+    # through the mean of the peaks, with the slope of the prior
+    assert model.peak_bytes(engine, 0.25, 1) == pytest.approx(4 * GB, abs=16)
+    shift = 4 * GB - prior.peak_bytes(engine, 0.25, 1)
+    assert model.peak_bytes(engine, 1.0, 1) == pytest.approx(
+        prior.peak_bytes(engine, 1.0, 1) + shift, abs=16
+    )
+
+
+def test_memory_never_shrinks_with_size(engine: EngineSchema):
+    model = CostModel(default_seconds_per_cost=1.0)
+    model.record_memory(1, 1.0, 1, extra_bytes=0, peak_bytes=10 * GB)
+    model.record_memory(1, 2.0, 1, extra_bytes=0, peak_bytes=8 * GB)
+
+    assert model.peak_bytes(engine, 4.0, 1) == pytest.approx(9 * GB, abs=16)
+
+
+def test_max_batch_megapixels(engine: EngineSchema):
+    model = CostModel(default_seconds_per_cost=1.0)
+    model.record_memory(1, 1.0, 1, extra_bytes=0, peak_bytes=10 * GB)
+    model.record_memory(1, 2.0, 1, extra_bytes=0, peak_bytes=14 * GB)
+
+    assert model.max_batch_megapixels(engine, 14 * GB) == pytest.approx(2.0, abs=1e-3)
+    assert model.max_batch_megapixels(engine, 5 * GB) == pytest.approx(0.0, abs=1e-3)
+    # capped to the largest image batches are sized for
+    assert model.max_batch_megapixels(engine, 1024 * GB) == 64.0
+
+
+def test_batch_size_for():
+    assert batch_size_for(1.0, None, 4) == 4
+    assert batch_size_for(1.0, 2.5, 4) == 2
+    assert batch_size_for(0.25, 10.0, 4) == 4
+    # an image that doesn't fit still runs, alone
+    assert batch_size_for(1.0, 0.5, 4) == 1
+    assert batch_size_for(0.0, 0.5, 4) == 4
@@ -0,0 +1,199 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+import math
+from typing import AsyncGenerator
+
+import pytest
+from pytsterrors import TSTError
+
+from src.api.v1.aimodels.repositories import AIModelRepo
+from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.engines.repositories import EngineRepo
+from src.api.v1.engines.schemas import EngineSchema
+from src.api.v1.engines.user_inputs import LoraIDAndWeightInput
+from src.api.v1.generators.manager import GeneratorManager
+from src.api.v1.generators.repositories import GeneratorRepo
+from src.api.v1.images.repositories import ImageRepo
+from src.api.v1.images.schemas import EncodeSettings
+from src.api.v1.jobs.repositories import JobRepo
+from src.api.v1.jobs.services import JobService
+from src.api.v1.jobs.user_inputs import ImageUserInput, JobUserInput
+from src.core.config import Config
+from src.core.enums import (
+    AIModelBase,
+    AIModelStatus,
+    AIModelType,
+    Device,
+    PathType,
+    PipeType,
+    Scheduler,
+    Variant,
+)
+from src.db.database import async_close_db, async_init_db
+
+
+@pytest.fixture
+def config(tmp_path) -> Config:
+    return Config(
+        db_path=":memory:",
+        images_path=str(tmp_path / "images"),
+        poses_path=str(tmp_path / "poses"),
+        hugging_face_path=str(tmp_path / "hf"),
+    )
+
+
+@pytest.fixture
+async def engine_id(config: Config) -> AsyncGenerator[int, None]:
+    await async_init_db(config.db_path)
+    checkpoint = await AIModelRepo().create(
+        AIModelSchema(
+            name="sd_model",
+            status=AIModelStatus.READY,
+            path="/models/sd.safetensors",
+            path_type=PathType.FILE,
+            variant=Variant.FP16,
+            model_type=AIModelType.CHECKPOINT,
+            model_base=AIModelBase.SD,
+            tags="",
+        )
+    )
+    engine = await EngineRepo().create(
+        EngineSchema(
+            name="sd",
+            checkpoint_model=checkpoint,
+            lora_models=[],
+            control_net_models=[],
+            embedding_models=[],
+            scheduler=Scheduler.EULERA,
+            guidance_scale=7.0,
+            seed=10,
+            width=512,
+            height=512,
+            steps=20,
+            pipe_type=PipeType.TXT2IMG,
+            device=Device.CPU,
+        )
+    )
+    assert engine.id is not None
+    yield engine.id
+    await async_close_db()
+
+
+def _service(config: Config) -> JobService:
+    # never started, no generator runs and the backlog stays empty
+    manager = GeneratorManager(
+        GeneratorRepo(), EngineRepo(), JobRepo(), ImageRepo(), config
+    )
+    return JobService(
+        GeneratorRepo(), EngineRepo(), JobRepo(), ImageRepo(), manager, AIModelRepo()
+    )
+
+
+def _input(engine_id: int | None, images: int = 1, **kwargs) -> JobUserInput:
+    return JobUserInput(
+        engine_id=engine_id,
+        images=[
+            ImageUserInput(prompt="a cat", negative_prompt="") for _ in range(images)
+        ],
+        **kwargs,
+    )
+
+
+def _field_errors(err: TSTError) -> dict[str, list[str]]:
+    res: dict[str, list[str]] = {}
+    for e in err.metadata()["error_per_field"]:
+        res.setdefault(e["field"], []).append(e["error"])
+    return res
+
+
+async def test_valid_input_has_no_errors(config: Config, engine_id: int):
+    assert await _service(config)._validate(_input(engine_id)) == []
+
+
+async def test_exactly_one_of_generator_and_engine(config: Config, engine_id: int):
+    service = _service(config)
+    errs = await service._validate(_input(None))
+    assert [e["field"] for e in errs] == ["generator_id"]
+
+    errs = await service._validate(_input(engine_id, generator_id=1))
+    # the generator doesn't exist either
+    assert [e["field"] for e in errs] == ["generator_id", "generator_id"]
+
+    errs = await service._validate(_input(engine_id + 1))
+    assert [e["field"] for e in errs] == ["engine_id"]
+
+
+async def test_tenant_and_loras(config: Config, engine_id: int):
+    input = _input(
+        engine_id,
+        tenant="",
+        lora_model_ids=[LoraIDAndWeightInput(lora_model_id=99, weight=1.0)],
+    )
+    with pytest.raises(TSTError) as exc:
+        await _service(config)._validated(input)
+
+    assert exc.value.metadata()["status_code"] == 400
+    assert _field_errors(exc.value) == {
+        "tenant": ["tenant can't be empty"],
+        "lora_model_ids": ["LORA model with id 99 doesn't exist"],
+    }
+
+
+async def test_encode_settings(config: Config, engine_id: int):
+    input = _input(engine_id, images=2)
+    input.images[1].encode_settings = EncodeSettings(png_compress_level=10, quality=0)
+
+    errs = await _service(config)._validate(input)
+    assert [e["field"] for e in errs] == ["images.1.encode_settings"] * 2
+
+
+async def test_refuses_a_job_that_can_never_fit(config: Config, engine_id: int):
+    config.memory.cpu_budget_mb = 1
+    with pytest.raises(TSTError) as exc:
+        await _service(config)._admit(config, _input(engine_id, images=2))
+
+    assert exc.value.message() == (
+        f"Job needs more memory than engine {engine_id} can get"
+    )
+    assert exc.value.metadata()["status_code"] == 400
+    assert set(_field_errors(exc.value)) == {"images.0", "images.1"}
+
+    # without a limit it always fits
+    config.memory.cpu_budget_mb = None
+    await _service(config)._admit(config, _input(engine_id, images=2))
+
+
+async def test_refuses_a_job_while_the_queue_is_full(config: Config, engine_id: int):
+    service = _service(config)
+    input = _input(engine_id, images=2)
+    # two 512x512 images of 20 steps
+    cost = 2 * 20 * 512 * 512 / 1_000_000
+    drain = service.manager.estimate_drain_seconds(engine_id, cost)
+    assert drain == pytest.approx(
+        cost * config.admission.default_seconds_per_megapixel_step
+    )
+
+    config.admission.max_drain_seconds = drain - 2.5
+    with pytest.raises(TSTError) as exc:
+        await service._admit(config, input)
+    assert exc.value.metadata() == {
+        "status_code": 429,
+        "headers": {"Retry-After": "3"},
+    }
+
+    config.admission.max_drain_seconds = drain + 1
+    await service._admit(config, input)
+
+
+async def test_refuses_a_tenant_with_too_many_images(config: Config, engine_id: int):
+    config.admission.max_outstanding_images_per_tenant = 1
+    with pytest.raises(TSTError) as exc:
+        await _service(config)._admit(config, _input(engine_id, images=3))
+
+    # about as long as the two images over the limit take, at the default speed
+    seconds = 2 * 20 * 512 * 512 / 1_000_000 * 0.4
+    assert exc.value.metadata() == {
+        "status_code": 429,
+        "headers": {"Retry-After": str(math.ceil(seconds))},
+    }
@@ -0,0 +1,141 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+from typing import Any
+
+import torch
+from safetensors.torch import save_file
+
+from src.api.v1.aimodels.schemas import AIModelSchema
+from src.api.v1.engines.schemas import LoraAndWeight
+from src.api.v1.generators.process.lora import LoraAdapters, lora_key
+from src.core.enums import (
+    AIModelBase,
+    AIModelStatus,
+    AIModelType,
+    PathType,
+    Variant,
+)
+
+# bytes of the state dict of each LoRA file
+LORA_BYTES = 4096
+
+
+class FakePipe:
+    """Records the adapter calls LoraAdapters makes on a diffusers pipe."""
+
+    def __init__(self):
+        self.adapters: dict[str, Any] = {}
+        self.active: list[tuple[str, float]] = []
+        self.enabled = True
+        self.loads: list[str] = []
+
+    def load_lora_weights(self, weights: Any, adapter_name: str):
+        self.loads.append(adapter_name)
+        self.adapters[adapter_name] = weights
+
+    def delete_adapters(self, name: str):
+        del self.adapters[name]
+
+    def set_adapters(self, names: list[str], adapter_weights: list[float]):
+        assert all(name in self.adapters for name in names)
+        self.active = list(zip(names, adapter_weights))
+
+    def enable_lora(self):
+        self.enabled = True
+
+    def disable_lora(self):
+        self.enabled = False
+
+
+def _lora(tmp_path, id: int, weight: float = 1.0) -> LoraAndWeight:
+    path = tmp_path / f"lora_{id}.safetensors"
+    if not path.exists():
+        save_file({"w": torch.zeros(LORA_BYTES // 4, dtype=torch.float32)}, str(path))
+    aimodel = AIModelSchema(
+        id=id,
+        name=f"lora {id}",
+        status=AIModelStatus.READY,
+        path=str(path),
+        path_type=PathType.FILE,
+        variant=Variant.FP16,
+        model_type=AIModelType.LORA,
+        model_base=AIModelBase.SD,
+        tags="",
+    )
+    return LoraAndWeight(aimodel=aimodel, weight=weight)
+
+
+def test_activates_the_adapters_of_a_job(tmp_path):
+    adapters = LoraAdapters(max_cpu_bytes=10 * LORA_BYTES, max_loaded=4)
+    pipe = FakePipe()
+    loras = [_lora(tmp_path, 1, 0.5), _lora(tmp_path, 2, 0.8)]
+
+    adapters.activate(pipe, loras)
+    assert adapters.active == lora_key(loras)
+    assert pipe.active == [("lora_1", 0.5), ("lora_2", 0.8)]
+    assert pipe.loads == ["lora_1", "lora_2"]
+
+    # the same LoRAs in another order are the same set, nothing is loaded
+    adapters.activate(pipe, list(reversed(loras)))
+    assert pipe.loads == ["lora_1", "lora_2"]
+
+    # new weights of loaded adapters don't load them again
+    adapters.activate(pipe, [_lora(tmp_path, 1, 1.0)])
+    assert pipe.active == [("lora_1", 1.0)]
+    assert pipe.loads == ["lora_1", "lora_2"]
+
+    adapters.activate(pipe, [])
+    assert not pipe.enabled
+    assert adapters.active == ()
+
+
+def test_evicts_the_least_recently_used_adapter(tmp_path):
+    adapters = LoraAdapters(max_cpu_bytes=10 * LORA_BYTES, max_loaded=2)
+    pipe = FakePipe()
+
+    adapters.activate(pipe, [_lora(tmp_path, 1)])
+    adapters.activate(pipe, [_lora(tmp_path, 2)])
+    adapters.activate(pipe, [_lora(tmp_path, 1)])
+    adapters.activate(pipe, [_lora(tmp_path, 3)])
+    assert set(pipe.adapters) == {"lora_1", "lora_3"}
+
+    # the adapters of the job are never evicted for each other
+    adapters.activate(pipe, [_lora(tmp_path, 2), _lora(tmp_path, 4)])
+    assert set(pipe.adapters) == {"lora_2", "lora_4"}
+    adapters.activate(
+        pipe, [_lora(tmp_path, 1), _lora(tmp_path, 2), _lora(tmp_path, 3)]
+    )
+    assert set(pipe.adapters) == {"lora_1", "lora_2", "lora_3"}
+
+
+def test_reloads_come_from_memory(tmp_path):
+    adapters = LoraAdapters(max_cpu_bytes=2 * LORA_BYTES, max_loaded=1)
+    pipe = FakePipe()
+
+    for id in [1, 2, 1, 2]:
+        adapters.activate(pipe, [_lora(tmp_path, id)])
+    assert pipe.loads == ["lora_1", "lora_2", "lora_1", "lora_2"]
+    assert (adapters.hits, adapters.misses) == (2, 2)
+    # a copy, load_lora_weights changes the dict it gets
+    cached = adapters._state_dicts[str(tmp_path / "lora_2.safetensors")]
+    assert pipe.adapters["lora_2"] is not cached
+
+
+def test_keeps_to_its_memory_budget(tmp_path):
+    adapters = LoraAdapters(max_cpu_bytes=2 * LORA_BYTES, max_loaded=1)
+    pipe = FakePipe()
+
+    for id in [1, 2, 3, 1]:
+        adapters.activate(pipe, [_lora(tmp_path, id)])
+        assert adapters._state_dicts_bytes <= 2 * LORA_BYTES
+    # 1 was pushed out by 3
+    assert (adapters.hits, adapters.misses) == (0, 4)
+
+    # a file larger than the whole budget is read every time
+    small = LoraAdapters(max_cpu_bytes=LORA_BYTES // 2, max_loaded=1)
+    pipe = FakePipe()
+    for id in [1, 2, 1]:
+        small.activate(pipe, [_lora(tmp_path, id)])
+    assert (small.hits, small.misses) == (0, 3)
+    assert small._state_dicts_bytes == 0
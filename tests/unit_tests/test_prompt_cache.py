@@ -0,0 +1,72 @@
+# Copyright © 2025-2026 Emmanouil Ragiadakos
+# SPDX-License-Identifier: MIT
+
+from typing import Callable
+
+import torch
+
+from src.api.v1.generators.process.prompt_cache import PromptEmbedsCache
+
+# 1024 float32 values
+KB4 = 4096
+
+
+def _encoder(calls: list[str], key: str) -> Callable[[], torch.Tensor]:
+    def encode() -> torch.Tensor:
+        calls.append(key)
+        return torch.zeros(1024, dtype=torch.float32)
+
+    return encode
+
+
+def test_hits_skip_the_encoding():
+    cache = PromptEmbedsCache(max_bytes=4 * KB4)
+    calls = []
+
+    first = cache.get_or_encode("a", _encoder(calls, "a"))
+    again = cache.get_or_encode("a", _encoder(calls, "a"))
+
+    assert again is first
+    assert calls == ["a"]
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.size_bytes == KB4
+
+
+def test_evicts_the_least_recently_used():
+    cache = PromptEmbedsCache(max_bytes=2 * KB4)
+    calls = []
+
+    cache.get_or_encode("a", _encoder(calls, "a"))
+    cache.get_or_encode("b", _encoder(calls, "b"))
+    # a is used again, so b is the oldest when c comes in
+    cache.get_or_encode("a", _encoder(calls, "a"))
+    cache.get_or_encode("c", _encoder(calls, "c"))
+    assert cache.size_bytes == 2 * KB4
+
+    cache.get_or_encode("a", _encoder(calls, "a"))
+    cache.get_or_encode("b", _encoder(calls, "b"))
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_keeps_to_its_budget():
+    cache = PromptEmbedsCache(max_bytes=KB4 + KB4 // 2)
+    calls = []
+
+    for key in "abcd":
+        cache.get_or_encode(key, _encoder(calls, key))
+        assert cache.size_bytes <= KB4 + KB4 // 2
+
+    # a value larger than the whole cache is returned but never kept
+    def encode_large() -> tuple[torch.Tensor, torch.Tensor]:
+        calls.append("large")
+        return torch.zeros(1024), torch.zeros(1024)
+
+    cache.get_or_encode("large", encode_large)
+    cache.get_or_encode("large", encode_large)
+    assert calls[-2:] == ["large", "large"]
+    assert cache.size_bytes == KB4
+
+    cache.clear()
+    assert cache.size_bytes == 0
+    cache.get_or_encode("d", _encoder(calls, "d"))
+    assert calls[-1] == "d"